@@ -0,0 +1,229 @@
+"""
+Stand-ins for the things the director talks to, so it can be exercised on any
+Linux box with no VLC, no Scheduler, no NAS, and no network.
+"""
+import datetime
+import hashlib
+import json
+import random
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+# The director's modules import each other by bare name.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'technical_director'))
+
+
+class FakeMedia:
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.options = []
+        self.parsed = False
+
+    def add_option(self, option):
+        self.options.append(option)
+
+    def parse_with_options(self, flags, timeout):
+        self.parsed = True
+
+
+class FakeVLCController:
+    """
+    Looks like a VLCController to the director, but only remembers what it
+    was told to play. Call `finish_current_media` to pretend VLC reached the
+    end of the current media. `player_state` and `position` are whatever the
+    caller sets them to, for exercising the watchdog.
+    """
+
+    def __init__(self):
+        self.current_media = None
+        self.played = []
+        self.prepared_media = None
+        self.prepared_key = None
+        self.end_reached_callback = None
+        self.error_callback = None
+        self.transition_latencies_in_seconds = []
+        self.last_transition_latency_in_seconds = None
+        self.player_state = 'idle'
+        self.position = None
+
+    def play(self):
+        self.played.append(self.current_media)
+        self.player_state = 'playing'
+
+    def set_media(self, media):
+        self.current_media = media
+
+    def position_in_seconds(self):
+        return self.position
+
+    def state(self):
+        return self.player_state
+
+    def on_error(self, callback):
+        self.error_callback = callback
+
+    def on_end_reached(self, callback):
+        self.end_reached_callback = callback
+
+    def finish_current_media(self):
+        if self.end_reached_callback is not None:
+            self.end_reached_callback(None)
+
+    def media_for(self, file_path, start_at_second=None, end_at_second=None, repeat_count=0):
+        media = FakeMedia(file_path)
+        if start_at_second:
+            media.add_option(f':start-time={start_at_second}')
+        if end_at_second:
+            media.add_option(f':stop-time={end_at_second}')
+        if repeat_count:
+            media.add_option(f':input-repeat={repeat_count}')
+        return media
+
+    def prepare(self, file_path, start_at_second=None, end_at_second=None, repeat_count=0):
+        key = (file_path, start_at_second, end_at_second, repeat_count)
+        if key == self.prepared_key:
+            return
+        self.prepared_media = self.media_for(file_path, start_at_second, end_at_second, repeat_count)
+        self.prepared_media.parse_with_options(None, None)
+        self.prepared_key = key
+
+    def take_prepared_media(self, file_path, start_at_second=None, end_at_second=None, repeat_count=0):
+        media = self.prepared_media if self.prepared_key == (file_path, start_at_second, end_at_second, repeat_count) else None
+        self.prepared_media = None
+        self.prepared_key = None
+        return media
+
+
+def fixture_video_information(file_path) -> dict:
+    """
+    Plausible ffprobe output for a file that doesn't exist. Episodes are
+    21-24 minutes long with three or four chapters, and the same path always
+    gets the same answer.
+    """
+    seed = int(hashlib.sha1(file_path.encode('UTF-8')).hexdigest()[:8], 16)
+    rng = random.Random(seed)
+    if 'commercial' in file_path:
+        duration = rng.choice([15, 30, 30, 30, 60])
+        chapter_count = 0
+    elif 'smpte' in file_path:
+        duration = 10
+        chapter_count = 0
+    else:
+        duration = rng.uniform(21 * 60, 24 * 60)
+        chapter_count = rng.choice([0, 3, 4, 4])
+    chapters = []
+    if chapter_count:
+        boundaries = sorted(rng.uniform(0, duration) for _ in range(chapter_count - 1))
+        starts = [0] + boundaries
+        ends = boundaries + [duration]
+        chapters = [
+            {'id': index, 'start_time': f'{start:.6f}', 'end_time': f'{end:.6f}'}
+            for index, (start, end) in enumerate(zip(starts, ends))
+        ]
+    return {
+        'chapters': chapters,
+        'streams': [{'codec_type': 'video', 'duration': f'{duration:.6f}'}],
+    }
+
+
+def install_fixture_video_information():
+    # Swap ffprobe and the SMPTE encode for the fixture.
+    import video
+    import video_utils
+    video.get_video_information = fixture_video_information
+    video_utils.get_video_information = fixture_video_information
+    video.get_default_video_filepath = lambda channel_number=None: '/fixtures/smpte.mp4'
+
+
+def build_lineup(start, hours, block_minutes=30, show_count=40):
+    lineup = []
+    block_start = start
+    for index in range(int(hours * 60 / block_minutes)):
+        block_end = block_start + datetime.timedelta(minutes=block_minutes)
+        lineup.append({
+            'listing_id': index + 1,
+            'title': f'Show {index % show_count}',
+            'file_path': f'/media/tv/show-{index % show_count}/episode-{index}.mp4',
+            'start_time': block_start.isoformat(),
+            'end_time': block_end.isoformat(),
+        })
+        block_start = block_end
+    return lineup
+
+
+def build_catalog(size, seed=0):
+    rng = random.Random(seed)
+    subjects = [None] * 4 + [f'subject-{index}' for index in range(max(size // 8, 1))]
+    return [
+        {
+            'file_path': f'/media/commercials/spot-{index}.mp4',
+            'duration': str(rng.choice([10, 15, 15, 30, 30, 30, 45, 60]) + rng.choice([0, 0, 0.5, 0.04])),
+            'subject': rng.choice(subjects),
+        }
+        for index in range(size)
+    ]
+
+
+class StubScheduler:
+    """
+    A local HTTP server that answers the same requests the Scheduler does,
+    with ETags so conditional requests behave like the real thing.
+    """
+
+    def __init__(self, lineups_by_channel, commercials):
+        self.lineups_by_channel = lineups_by_channel
+        self.commercials = commercials
+        self.request_count = 0
+        self.fail_requests = False
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.request_count += 1
+                if stub.fail_requests:
+                    self.send_error(503)
+                    return
+                if self.path == '/commercials.json':
+                    payload = stub.commercials
+                elif self.path.startswith('/channels/ch') and self.path.endswith('/schedule.json'):
+                    channel_number = self.path[len('/channels/ch'):-len('/schedule.json')]
+                    if channel_number not in stub.lineups_by_channel:
+                        self.send_error(404)
+                        return
+                    payload = {'lineup': stub.lineups_by_channel[channel_number]}
+                else:
+                    self.send_error(404)
+                    return
+                body = json.dumps(payload).encode('UTF-8')
+                etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+                if self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('ETag', etag)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server.server_address[1]}'
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
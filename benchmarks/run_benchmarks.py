@@ -0,0 +1,280 @@
+"""
+Benchmarks for the director's hot paths, run against stand-ins (see
+fakes.py), so they work offline on any Linux box.
+
+    poetry run python benchmarks/run_benchmarks.py --save-baseline
+    ... change things ...
+    poetry run python benchmarks/run_benchmarks.py
+
+The second run compares itself with the saved baseline and exits non-zero if
+anything got slower (or less accurate) by more than the threshold.
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from decimal import Decimal
+from pathlib import Path
+
+from fakes import (
+    FakeVLCController,
+    StubScheduler,
+    build_catalog,
+    build_lineup,
+    install_fixture_video_information,
+)
+
+DEFAULT_BASELINE_PATH = Path(__file__).resolve().parent / 'baseline.json'
+
+# A result has regressed when it's this much worse than the baseline.
+DEFAULT_REGRESSION_THRESHOLD = 0.25
+
+CHANNEL_NUMBER = '7'
+CATALOG_SIZES = (10, 100, 1000, 10000)
+QUEUE_DEPTHS = (100, 1000, 10000)
+
+
+def timed(function, repeat):
+    durations = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        durations.append(time.perf_counter() - started)
+    return durations, result
+
+
+def summarize(durations):
+    ordered = sorted(durations)
+    return {
+        'median_seconds': statistics.median(ordered),
+        'p95_seconds': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+    }
+
+
+def most_recent_half_hour(moment):
+    return moment.replace(minute=(moment.minute // 30) * 30, second=0, microsecond=0)
+
+
+def plan_one_block(director, block_start):
+    director.enqueue(director.plan_ahead(block_start, until=block_start))
+
+
+def bench_feed_queue(scheduler, rounds):
+    from commercial_rotation import CommercialRotation
+    from technical_director import TechnicalDirector
+
+    results = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        started = time.perf_counter()
+        # Benchmark airings stay out of the real rotation history.
+        director = TechnicalDirector(channel_number=CHANNEL_NUMBER, vlc_controller=FakeVLCController(),
+                                     commercial_rotation=CommercialRotation(persist=False))
+        results['feed_queue_cold'] = {'median_seconds': time.perf_counter() - started}
+
+        first_block = most_recent_half_hour(datetime.datetime.now()) + datetime.timedelta(minutes=30)
+        block_starts = iter(first_block + datetime.timedelta(minutes=30 * index) for index in range(rounds))
+        durations, _ = timed(lambda: plan_one_block(director, next(block_starts)), rounds)
+    results['feed_queue_warm'] = summarize(durations)
+    results['feed_queue_warm']['scheduler_requests'] = scheduler.request_count
+    return results
+
+
+def bench_commercial_breaks(repeat):
+    from commercial_rotation import CommercialRotation
+    from commercial_utils import get_commercial_break
+
+    results = {}
+    rng = random.Random(42)
+    for size in CATALOG_SIZES:
+        catalog = build_catalog(size, seed=size)
+        for name, rotation in ((f'commercial_break_{size}', None),
+                               (f'commercial_break_rotation_{size}', CommercialRotation(persist=False, rng=rng))):
+            targets = [rng.uniform(30, 240) for _ in range(repeat)]
+            errors = []
+            durations = []
+            # Breaks four minutes apart, like a busy evening.
+            airs_at = datetime.datetime(2026, 10, 19, 18, 0)
+            for target in targets:
+                started = time.perf_counter()
+                commercial_break = get_commercial_break(target, rng=rng, commercials=catalog, rotation=rotation, airs_at=airs_at)
+                durations.append(time.perf_counter() - started)
+                actual = sum((video.duration_in_seconds() for video in commercial_break), Decimal(0))
+                errors.append(abs(float(actual) - target))
+                airs_at += datetime.timedelta(minutes=4)
+            results[name] = summarize(durations)
+            results[name]['mean_abs_error_seconds'] = statistics.mean(errors)
+    return results
+
+
+def bench_queue_operations(repeat):
+    from video import Video
+    from video_queue import VideoQueue
+
+    results = {}
+    for depth in QUEUE_DEPTHS:
+        videos = [Video(f'/media/commercials/spot-{index}.mp4', duration_in_seconds=Decimal(30)) for index in range(depth)]
+        queue = VideoQueue(videos)
+        midpoint = Decimal(depth * 15)
+
+        def operations():
+            queue.append(queue.popleft())
+            queue.duration_in_seconds()
+            queue.index_at(midpoint)
+            len(queue)
+
+        durations, _ = timed(operations, repeat)
+        results[f'queue_operations_{depth}'] = summarize(durations)
+    return results
+
+
+def bench_whats_on(scheduler, repeat):
+    from scheduler_client import SchedulerClient
+
+    client = SchedulerClient()
+    start = most_recent_half_hour(datetime.datetime.now())
+    client.whats_on(CHANNEL_NUMBER, start)
+    querytimes = iter(start + datetime.timedelta(minutes=30 * (index % 300)) for index in range(repeat))
+    durations, _ = timed(lambda: client.whats_on(CHANNEL_NUMBER, next(querytimes)), repeat)
+    return {'whats_on': summarize(durations)}
+
+
+def bench_as_run_record(repeat):
+    # What recording a segment costs the playback thread.
+    from as_run_log import AsRunLog
+
+    with tempfile.TemporaryDirectory() as as_run_dir:
+        as_run_log = AsRunLog(Path(as_run_dir) / 'ch7.jsonl')
+        now = datetime.datetime.now()
+        durations, _ = timed(lambda: as_run_log.record(
+            event='start', channel=CHANNEL_NUMBER, file_path='/media/tv/show-1/episode-1.mp4', batch_label='a1b2c3',
+            commercial=False, dead_air=False, start_at_second=Decimal('370.027'), end_at_second=Decimal('475.619'),
+            planned_start=now, actual_start=now, block_end=now), repeat)
+        as_run_log.close()
+    return {'as_run_record': summarize(durations)}
+
+
+def bench_import(repeat):
+    # A fresh interpreter every time, or it's only measuring the module cache.
+    # This is the part of startup that happens before anything can air.
+    source_dir = Path(__file__).resolve().parent.parent / 'technical_director'
+    command = [sys.executable, '-c', 'import technical_director']
+    durations, _ = timed(lambda: subprocess.run(command, cwd=source_dir, check=True), repeat)
+    return {'import_technical_director': summarize(durations)}
+
+
+def bench_stall_recovery(scheduler, repeat):
+    # The player stalls, alternately freezing and failing. Detection runs on a
+    # virtual clock, so time to recovery is what the watchdog's thresholds
+    # make it; the recovery itself is timed for real.
+    from clock import VirtualClock
+    from commercial_rotation import CommercialRotation
+    from playback_watchdog import WATCHDOG_INTERVAL_IN_SECONDS
+    from technical_director import TechnicalDirector
+
+    clock = VirtualClock(datetime.datetime.now())
+    player = FakeVLCController()
+    durations = []
+    time_to_recovery = {'frozen': [], 'error': []}
+    with contextlib.redirect_stdout(io.StringIO()):
+        director = TechnicalDirector(channel_number=CHANNEL_NUMBER, vlc_controller=player, clock=clock, plan_in_background=False,
+                                     commercial_rotation=CommercialRotation(persist=False))
+        director.play_next_video()
+        for index in range(repeat):
+            kind = 'frozen' if index % 2 == 0 else 'error'
+            clock.advance(WATCHDOG_INTERVAL_IN_SECONDS)
+            player.position = Decimal(index)
+            director.watchdog.sample()
+            if kind == 'error':
+                player.player_state = 'error'
+                player.error_callback(None)
+            while director.stall_reason is None:
+                clock.advance(WATCHDOG_INTERVAL_IN_SECONDS)
+                director.watchdog.sample()
+            started = time.perf_counter()
+            director.recover_from_stall()
+            durations.append(time.perf_counter() - started)
+            time_to_recovery[kind].append(director.last_time_to_recovery_in_seconds)
+            director.feed_queue_if_needed()
+    results = {'stall_recovery': summarize(durations)}
+    results['stall_recovery']['time_to_recovery_frozen_seconds'] = statistics.mean(time_to_recovery['frozen'])
+    results['stall_recovery']['time_to_recovery_error_seconds'] = statistics.mean(time_to_recovery['error'])
+    return results
+
+
+def find_regressions(results, baseline, threshold):
+    regressions = []
+    for name, measurements in results.items():
+        for measurement, value in measurements.items():
+            if not measurement.endswith('_seconds'):
+                continue
+            previous = baseline.get(name, {}).get(measurement)
+            if previous is None or previous <= 0:
+                continue
+            if value > previous * (1 + threshold):
+                regressions.append(f'{name}.{measurement}: {value:.6f} vs baseline {previous:.6f} (+{(value / previous - 1) * 100:.0f}%)')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--baseline', type=Path, default=DEFAULT_BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true', help='Record these results as the new baseline.')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_REGRESSION_THRESHOLD)
+    parser.add_argument('--quick', action='store_true', help='Fewer repetitions, for a smoke test.')
+    args = parser.parse_args()
+
+    repeat = 20 if args.quick else 200
+    now = datetime.datetime.now()
+    lineup = build_lineup(most_recent_half_hour(now) - datetime.timedelta(days=1), hours=24 * 8)
+    scheduler = StubScheduler({CHANNEL_NUMBER: lineup}, build_catalog(500)).start()
+    os.environ['SCHEDULER_URL'] = scheduler.url
+    os.environ['READ_AHEAD_BUDGET_GB'] = '0'
+    os.environ['RENDITION_BUDGET_GB'] = '0'
+    # A snapshot left by an earlier run would make the cold start less cold.
+    os.environ['SNAPSHOT_DAYS'] = '0'
+    os.environ['AS_RUN_MAX_MB'] = '0'
+    os.environ['SAVE_PLANS'] = '0'
+    install_fixture_video_information()
+
+    results = {}
+    try:
+        results.update(bench_feed_queue(scheduler, rounds=10 if args.quick else 48))
+        results.update(bench_commercial_breaks(repeat=10 if args.quick else 50))
+        results.update(bench_queue_operations(repeat * 10))
+        results.update(bench_whats_on(scheduler, repeat * 10))
+        results.update(bench_as_run_record(repeat * 10))
+        results.update(bench_stall_recovery(scheduler, repeat))
+        results.update(bench_import(repeat=5 if args.quick else 20))
+    finally:
+        scheduler.stop()
+
+    for name, measurements in results.items():
+        details = ', '.join(f'{measurement}={value:.6f}' if isinstance(value, float) else f'{measurement}={value}'
+                            for measurement, value in measurements.items())
+        print(f'{name}: {details}')
+
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(results, indent=2, sort_keys=True))
+        print(f'Saved baseline to {args.baseline}')
+        return 0
+
+    if not args.baseline.exists():
+        print(f'No baseline at {args.baseline}, run with --save-baseline to record one.')
+        return 0
+    regressions = find_regressions(results, json.loads(args.baseline.read_text()), args.threshold)
+    for regression in regressions:
+        print(f'REGRESSION {regression}')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,215 @@
+"""
+What actually aired, and when, one JSON object per line.
+
+    poetry run python technical_director/as_run_log.py --channel 7 --at 2026-10-19T20:14
+    poetry run python technical_director/as_run_log.py --channel 7 --from 2026-10-19T20:00 --to 2026-10-19T21:00
+
+The director writes a `start` record when it hands a segment to the player
+and an `end` record when the player says it's done, each with the planned and
+the actual times. This answers what was on the air then, and how far off the
+plan it was.
+"""
+import argparse
+import atexit
+import datetime
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from pathlib import Path
+
+# Rotate to a new file once the current one is this big...
+DEFAULT_MAX_BYTES = 8 * 1024 * 1024
+# ...and keep this many old ones. A few weeks of airings for a channel.
+DEFAULT_BACKUP_COUNT = 4
+
+# Records are written in batches at most this often, so the SD card sees a
+# handful of writes a minute instead of one per segment.
+FLUSH_INTERVAL_IN_SECONDS = 30
+
+
+def default_as_run_dir() -> Path:
+    return Path.home().joinpath('.mylittlecableco', 'technical_director', 'as-run')
+
+
+def as_run_path_for(channel_number, as_run_dir=None) -> Path:
+    return Path(as_run_dir or os.getenv('AS_RUN_DIR') or default_as_run_dir()) / f'ch{channel_number}.jsonl'
+
+
+def as_run_log_from_environment(channel_number):
+    # AS_RUN_MAX_MB=0 turns the as-run log off.
+    max_megabytes = float(os.getenv('AS_RUN_MAX_MB', DEFAULT_MAX_BYTES / 1024 ** 2))
+    if max_megabytes <= 0:
+        return None
+    as_run_log = AsRunLog(as_run_path_for(channel_number), max_bytes=int(max_megabytes * 1024 ** 2))
+    # Don't lose the last batch when the director is stopped.
+    atexit.register(as_run_log.close)
+    return as_run_log
+
+
+class AsRunLog:
+    """
+    A record of what actually aired, one JSON object per line.
+
+    `record` only puts the record on a queue. A background thread turns them
+    into JSON and appends them to the file in batches, and when the file is
+    over `max_bytes` it's renamed to `.1` (and `.1` to `.2`, and so on, up to
+    `backup_count`) and a new one started.
+    """
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES, backup_count=DEFAULT_BACKUP_COUNT,
+                 flush_interval_in_seconds=FLUSH_INTERVAL_IN_SECONDS):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.flush_interval_in_seconds = flush_interval_in_seconds
+        self._records = queue.SimpleQueue()
+        self._closed = False
+        self._writer = threading.Thread(target=self._write_loop, name=f'as-run-{self.path.stem}', daemon=True)
+        self._writer.start()
+
+    def record(self, **fields):
+        # Called on the playback thread, so this must never wait on the disk.
+        self._records.put(fields)
+
+    def close(self):
+        # Writes out everything recorded so far.
+        if self._closed:
+            return
+        self._closed = True
+        self._records.put(None)
+        self._writer.join()
+
+    def _write_loop(self):
+        pending = []
+        flush_at = None
+        while True:
+            timeout = None if flush_at is None else max(flush_at - time.monotonic(), 0)
+            try:
+                fields = self._records.get(timeout=timeout)
+            except queue.Empty:
+                fields = False
+            if fields:
+                pending.append(json.dumps(fields, default=str, separators=(',', ':')))
+                if flush_at is None:
+                    flush_at = time.monotonic() + self.flush_interval_in_seconds
+            if pending and (fields is None or time.monotonic() >= flush_at):
+                try:
+                    self._write(pending)
+                except OSError as e:
+                    # A full or read-only card shouldn't take playback down
+                    # with it. These records are lost.
+                    print(f'Could not write the as-run log: {e}')
+                pending = []
+                flush_at = None
+            if fields is None:
+                return
+
+    def _write(self, lines):
+        with open(self.path, 'a') as as_run_file:
+            as_run_file.write('\n'.join(lines) + '\n')
+            size = as_run_file.tell()
+        if size > self.max_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        for index in range(self.backup_count - 1, 0, -1):
+            older = self.path.with_name(f'{self.path.name}.{index}')
+            if older.exists():
+                os.replace(older, self.path.with_name(f'{self.path.name}.{index + 1}'))
+        if self.backup_count > 0:
+            os.replace(self.path, self.path.with_name(f'{self.path.name}.1'))
+        else:
+            self.path.unlink()
+
+
+def read_records(path):
+    # Oldest first: the rotated files from the highest number down, then the
+    # current one.
+    path = Path(path)
+    rotated = sorted(path.parent.glob(f'{path.name}.*'), key=lambda rotated_path: int(rotated_path.suffix[1:]), reverse=True)
+    for file_path in rotated + [path]:
+        try:
+            with open(file_path) as as_run_file:
+                for line in as_run_file:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        # The last line of a file cut off by a power loss.
+                        continue
+        except FileNotFoundError:
+            continue
+
+
+def airings(records):
+    """
+    Pair each `start` record with the `end` record that follows it. Yields
+    the start record with `actual_end` filled in. A segment without an end
+    record (the director was stopped) ended when the next one started, or,
+    if it's the last one, is still on and has `actual_end` None.
+    """
+    airing = None
+    for record in records:
+        event = record.get('event')
+        if event == 'start':
+            if airing is not None:
+                airing['actual_end'] = record.get('actual_start')
+                yield airing
+            airing = dict(record, actual_end=None)
+        elif event == 'end' and airing is not None and record.get('actual_start') == airing.get('actual_start'):
+            airing['actual_end'] = record.get('actual_end')
+            yield airing
+            airing = None
+    if airing is not None:
+        yield airing
+
+
+def airings_between(path, start, end):
+    # Everything that was on the air at some point from `start` to `end`.
+    for airing in airings(read_records(path)):
+        actual_start = datetime.datetime.fromisoformat(airing['actual_start'])
+        actual_end = datetime.datetime.fromisoformat(airing['actual_end']) if airing['actual_end'] else None
+        if actual_start <= end and (actual_end is None or actual_end > start):
+            yield airing
+
+
+def describe(airing) -> str:
+    kind = 'commercial' if airing.get('commercial') else 'dead air' if airing.get('dead_air') else 'program'
+    span = ''
+    if airing.get('start_at_second') or airing.get('end_at_second'):
+        span = f" [{airing.get('start_at_second') or 0}s-{airing.get('end_at_second') or 'end'}]"
+    return (f"{airing['actual_start']} - {airing['actual_end'] or '?'} {kind} {airing['file_path']}{span} "
+            f"(planned {airing.get('planned_start') or '?'})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--channel', default=os.getenv('CHANNEL_NUMBER'), required=os.getenv('CHANNEL_NUMBER') is None)
+    parser.add_argument('--at', type=datetime.datetime.fromisoformat, help='What was on at this time (ISO 8601, local time).')
+    parser.add_argument('--from', dest='start', type=datetime.datetime.fromisoformat, help='Everything on from this time...')
+    parser.add_argument('--to', dest='end', type=datetime.datetime.fromisoformat, help='...until this time.')
+    parser.add_argument('--path', type=Path, help='The as-run log to read. Defaults to the channel\'s in AS_RUN_DIR.')
+    args = parser.parse_args()
+
+    if args.at:
+        start = end = args.at
+    elif args.start:
+        start, end = args.start, args.end or datetime.datetime.now()
+    else:
+        parser.error('Give --at, or --from (and optionally --to).')
+
+    found = False
+    for airing in airings_between(args.path or as_run_path_for(args.channel), start, end):
+        found = True
+        print(describe(airing))
+    if not found:
+        print('Nothing in the as-run log for that time.')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,145 @@
+import random
+from decimal import Decimal
+
+# How far over (or under) the requested break length we are willing to land.
+DEFAULT_TOLERANCE_IN_SECONDS = 10
+
+# Durations are packed as whole multiples of this many milliseconds. A tenth
+# of a second is far below anything a viewer notices, and it keeps the search
+# space small enough for a Pi.
+DEFAULT_RESOLUTION_IN_MILLISECONDS = 100
+
+# We only consider a random sample of this many commercials per break. It
+# bounds the work no matter how big the catalog gets, and the random sample
+# keeps breaks from being the same every time.
+DEFAULT_MAX_CANDIDATES = 400
+
+# How much an individual break may deviate from an even share of the time
+# we need to fill. 0.35 means anywhere from 65% to 135% of an even share.
+DEFAULT_BREAK_LENGTH_VARIANCE = 0.35
+
+
+def pack_commercial_break(commercials, target_duration_in_seconds, tolerance_in_seconds=DEFAULT_TOLERANCE_IN_SECONDS,
+                          resolution_in_milliseconds=DEFAULT_RESOLUTION_IN_MILLISECONDS,
+                          max_candidates=DEFAULT_MAX_CANDIDATES, rng=random) -> list:
+    """
+    Pick commercials whose durations add up as close to the target as we can
+    get, never using two commercials with the same (non-empty) subject.
+
+    This is a subset-sum search where every subject is a group we may take at
+    most one commercial from. Reachable sums are kept as bits of a Python int,
+    so adding a commercial to every partial break at once is a single shift
+    and OR. The time it takes is bounded by `max_candidates` times the length
+    of the break, regardless of the size of the catalog.
+
+    Returns the chosen commercial dicts. We'd rather exceed the target than
+    underfill it (no dead air!), so the shortest break at or over the target
+    wins, and we only come in under when nothing fits within the tolerance.
+    """
+    target_units = _to_units(target_duration_in_seconds, resolution_in_milliseconds)
+    tolerance_units = _to_units(tolerance_in_seconds, resolution_in_milliseconds)
+    if target_units <= 0 or not commercials:
+        return []
+
+    candidates = list(commercials)
+    if len(candidates) > max_candidates:
+        candidates = rng.sample(candidates, max_candidates)
+    else:
+        rng.shuffle(candidates)
+
+    groups = _group_by_subject(candidates, resolution_in_milliseconds)
+    limit = target_units + tolerance_units
+    mask = (1 << (limit + 1)) - 1
+
+    # reachable[i] has bit `s` set when some selection from the first `i`
+    # groups adds up to exactly `s` units.
+    reachable = [1]
+    for group in groups:
+        previous = reachable[-1]
+        current = previous
+        for duration_units, _ in group:
+            if duration_units <= limit:
+                current |= previous << duration_units
+        reachable.append(current & mask)
+
+    best = _closest_sum(reachable[-1], target_units)
+    chosen = []
+    remaining = best
+    for index in range(len(groups) - 1, -1, -1):
+        previous = reachable[index]
+        if (previous >> remaining) & 1:
+            # We can get here without this group, so skip it.
+            continue
+        for duration_units, commercial in groups[index]:
+            if duration_units <= remaining and (previous >> (remaining - duration_units)) & 1:
+                chosen.append(commercial)
+                remaining -= duration_units
+                break
+    chosen.reverse()
+
+    # If everything that fits under the cap still leaves us well short (a
+    # small catalog, or only long commercials), top up with whichever unused
+    # commercial gets us closest, even if it takes us past the tolerance.
+    shortfall_units = target_units - best
+    if shortfall_units > tolerance_units:
+        chosen_ids = {id(commercial) for commercial in chosen}
+        used_subjects = {commercial.get('subject') for commercial in chosen if commercial.get('subject') is not None}
+        leftovers = [
+            (duration_units, commercial)
+            for group in groups
+            for duration_units, commercial in group
+            if id(commercial) not in chosen_ids and commercial.get('subject') not in used_subjects
+        ]
+        if leftovers:
+            _, commercial = min(leftovers, key=lambda leftover: abs(shortfall_units - leftover[0]))
+            chosen.append(commercial)
+    return chosen
+
+
+def split_break_lengths(total_length_in_seconds, count, variance=DEFAULT_BREAK_LENGTH_VARIANCE, rng=random) -> list:
+    """
+    Split the time we need to fill into `count` breaks of varying length that
+    still add up to the total. Varying length breaks keep it fresh.
+    """
+    if count <= 0:
+        return []
+    weights = [rng.uniform(1 - variance, 1 + variance) for _ in range(count)]
+    total_weight = sum(weights)
+    total_length = Decimal(total_length_in_seconds)
+    lengths = [total_length * Decimal(weight / total_weight) for weight in weights[:-1]]
+    # Give the last break whatever is left so rounding never loses time.
+    lengths.append(total_length - sum(lengths, Decimal(0)))
+    return lengths
+
+
+def _to_units(seconds, resolution_in_milliseconds) -> int:
+    return int(round(Decimal(seconds) * 1000 / resolution_in_milliseconds))
+
+
+def _group_by_subject(commercials, resolution_in_milliseconds) -> list:
+    # Commercials without a subject can be combined with anything, so each
+    # gets a group of its own.
+    groups = []
+    groups_by_subject = {}
+    for commercial in commercials:
+        duration_units = _to_units(commercial['duration'], resolution_in_milliseconds)
+        if duration_units <= 0:
+            continue
+        subject = commercial.get('subject')
+        if subject is None:
+            groups.append([(duration_units, commercial)])
+        elif subject in groups_by_subject:
+            groups_by_subject[subject].append((duration_units, commercial))
+        else:
+            groups_by_subject[subject] = [(duration_units, commercial)]
+            groups.append(groups_by_subject[subject])
+    return groups
+
+
+def _closest_sum(reachable, target_units) -> int:
+    at_or_over = reachable >> target_units
+    if at_or_over:
+        # Lowest set bit at or above the target.
+        return target_units + (at_or_over & -at_or_over).bit_length() - 1
+    # Highest set bit below the target. Bit 0 (the empty break) is always set.
+    return (reachable & ((1 << target_units) - 1)).bit_length() - 1
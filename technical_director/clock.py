@@ -0,0 +1,35 @@
+import datetime
+import threading
+
+
+class SystemClock:
+    """
+    The real time. What the director uses unless told otherwise.
+    """
+
+    def now(self):
+        return datetime.datetime.now()
+
+
+class VirtualClock:
+    """
+    A clock that only moves when it's told to, so a simulation can skip
+    straight to the next interesting moment instead of waiting for it.
+    """
+
+    def __init__(self, start):
+        self._now = start
+        self._lock = threading.Lock()
+
+    def now(self):
+        with self._lock:
+            return self._now
+
+    def advance_to(self, moment):
+        with self._lock:
+            if moment > self._now:
+                self._now = moment
+
+    def advance(self, seconds):
+        with self._lock:
+            self._now += datetime.timedelta(seconds=float(seconds))
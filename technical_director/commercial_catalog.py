@@ -0,0 +1,129 @@
+import threading
+import time
+
+from schedule_snapshot import snapshot_from_environment
+from scheduler_client import SchedulerClient
+
+# How long a downloaded catalog is trusted before we ask the Scheduler whether
+# it changed. Asking is cheap (a 304 with no body), so this is short.
+DEFAULT_TTL_IN_SECONDS = 5 * 60
+
+
+class CommercialCatalog:
+    """
+    An in-process copy of the Scheduler's commercial catalog.
+
+    Commercial breaks are assembled against this local copy instead of
+    downloading `/commercials.json` for every break. The copy is revalidated
+    with ETag/If-Modified-Since once it is older than the TTL, and a
+    background thread keeps it fresh so break assembly rarely waits on the
+    network at all.
+    """
+
+    def __init__(self, scheduler_client=None, ttl_in_seconds=DEFAULT_TTL_IN_SECONDS, snapshot=None):
+        self.scheduler_client = scheduler_client or SchedulerClient()
+        self.ttl_in_seconds = ttl_in_seconds
+        # Optional on-disk copy (a ScheduleSnapshot), so we have commercials
+        # to air before, or without, the Scheduler answering.
+        self.snapshot = snapshot
+        self._commercials = None
+        # Goes up every time the catalog's contents change, so anything built
+        # from it knows when to rebuild.
+        self.version = 0
+        self._etag = None
+        self._last_modified = None
+        self._fetched_at = None
+        self._lock = threading.Lock()
+        self._refresh_thread = None
+        self._refresh_now = threading.Event()
+        self._stop_refreshing = threading.Event()
+
+    def commercials(self) -> list:
+        """
+        Return a copy of the catalog. Callers are free to pop from it.
+        """
+        if self._commercials is None:
+            self._load_snapshot()
+        if self._commercials is None:
+            # Nothing to fall back on, we have to wait for the Scheduler.
+            self.refresh()
+        elif self.is_stale():
+            try:
+                self.refresh()
+            except Exception as e:
+                # We'd rather air a slightly outdated catalog than nothing.
+                print(f'Could not revalidate the commercial catalog, using the copy we have: {e}')
+        return list(self._commercials)
+
+    def cached_commercials(self):
+        # Whatever copy we have right now, never a request. None if we don't
+        # have one yet. Not a copy, so don't modify it.
+        return self._commercials
+
+    def is_stale(self) -> bool:
+        return self._fetched_at is None or (time.monotonic() - self._fetched_at) > self.ttl_in_seconds
+
+    def refresh(self):
+        with self._lock:
+            commercials, etag, last_modified = self.scheduler_client.get_all_commercials_if_modified(
+                etag=self._etag, last_modified=self._last_modified)
+            if commercials is not None:
+                self._commercials = commercials
+                self.version += 1
+                self._etag = etag
+                self._last_modified = last_modified
+                if self.snapshot is not None:
+                    self.snapshot.save_commercials(commercials, etag=etag, last_modified=last_modified)
+            self._fetched_at = time.monotonic()
+
+    def start_background_refresh(self):
+        if self._refresh_thread is not None:
+            return
+        self._refresh_thread = threading.Thread(target=self._refresh_loop, name='commercial-catalog-refresh', daemon=True)
+        self._refresh_thread.start()
+
+    def stop_background_refresh(self):
+        self._stop_refreshing.set()
+        self._refresh_now.set()
+
+    def _refresh_loop(self):
+        # Refresh a little before the TTL runs out so readers never see a
+        # stale catalog while the Scheduler is healthy.
+        while True:
+            self._refresh_now.wait(self.ttl_in_seconds * 0.8)
+            self._refresh_now.clear()
+            if self._stop_refreshing.is_set():
+                return
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f'Background refresh of the commercial catalog failed: {e}')
+
+    def _load_snapshot(self):
+        if self.snapshot is None:
+            return
+        with self._lock:
+            snapshot = self.snapshot.load_commercials()
+            if snapshot is None or self._commercials is not None:
+                return
+            self._commercials, self._etag, self._last_modified = snapshot
+            self.version += 1
+            # Counts as fresh so nobody waits, but reconcile right away.
+            self._fetched_at = time.monotonic()
+        print('Loaded the commercial catalog from the snapshot, checking it against the Scheduler in the background.')
+        self._refresh_now.set()
+
+
+_shared_commercial_catalog = None
+_shared_commercial_catalog_lock = threading.Lock()
+
+
+def get_commercial_catalog(scheduler_client=None) -> CommercialCatalog:
+    # One catalog per process, shared by every break we assemble on every
+    # channel. `scheduler_client` only matters to the first caller.
+    global _shared_commercial_catalog
+    with _shared_commercial_catalog_lock:
+        if _shared_commercial_catalog is None:
+            _shared_commercial_catalog = CommercialCatalog(scheduler_client=scheduler_client, snapshot=snapshot_from_environment())
+            _shared_commercial_catalog.start_background_refresh()
+        return _shared_commercial_catalog
@@ -0,0 +1,246 @@
+import atexit
+import heapq
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+# A spot that just aired goes to the back of the line for this long...
+DEFAULT_SPOT_COOLDOWN_IN_SECONDS = 12 * 60 * 60
+# ...and nothing else for the same subject should air for this long.
+DEFAULT_SUBJECT_COOLDOWN_IN_SECONDS = 60 * 60
+
+# How many of the longest-rested spots we offer the packer for each break.
+# Enough for it to hit the target length, few enough that freshness, not
+# fit, decides what airs.
+DEFAULT_CANDIDATE_COUNT = 48
+
+# However many candidates we want, we look at no more than this many times
+# as many spots to find them.
+CANDIDATE_SEARCH_FACTOR = 4
+
+# While spots are being recorded we write the recency index to disk at most
+# this often. The director flushes the rest after every plan, and we flush
+# at exit.
+SAVE_INTERVAL_IN_SECONDS = 60
+
+
+def default_rotation_state_path() -> Path:
+    return Path.home().joinpath('.mylittlecableco', 'technical_director', 'rotation.json')
+
+
+class CommercialRotation:
+    """
+    Remembers when every spot and every subject last aired, across breaks and
+    across restarts, and offers the packer the spots that have rested the
+    longest.
+
+    Spots sit in a heap ordered by when they're next due: the last time they
+    aired plus the cooldown, shortened for spots with a higher `weight` in the
+    catalog so those come around more often. Spots that never aired come
+    first. Picking a candidate is a heap pop, so a break costs the same no
+    matter how big the catalog is. Entries are never updated in place, a new
+    one is pushed and the old one is skipped when it surfaces.
+
+    Times are whatever the caller says they are (seconds since the epoch),
+    so planning hours ahead, or on a virtual clock, records the time the
+    break will air rather than the time it was planned.
+    """
+
+    def __init__(self, state_path=None, spot_cooldown_in_seconds=DEFAULT_SPOT_COOLDOWN_IN_SECONDS,
+                 subject_cooldown_in_seconds=DEFAULT_SUBJECT_COOLDOWN_IN_SECONDS, candidate_count=DEFAULT_CANDIDATE_COUNT,
+                 persist=True, rng=random):
+        self.state_path = Path(state_path) if state_path else default_rotation_state_path()
+        self.spot_cooldown_in_seconds = spot_cooldown_in_seconds
+        self.subject_cooldown_in_seconds = subject_cooldown_in_seconds
+        self.candidate_count = candidate_count
+        self.persist = persist
+        self.rng = rng
+
+        self._lock = threading.Lock()
+        # File path -> the commercial dict from the catalog.
+        self._spots = {}
+        # File path -> when it last aired. Subject -> when it last aired.
+        self._spot_last_aired = {}
+        self._subject_last_aired = {}
+        # (due at, tiebreak, file path). The entry for a spot is current only
+        # if `_due_at` still says the same.
+        self._heap = []
+        self._due_at = {}
+        self._synced_version = None
+        self._saved_at = 0
+        # Something was recorded since the last save.
+        self._dirty = False
+        self._load()
+
+    def sync(self, commercials, version):
+        """
+        Make the catalog `commercials` the one we rotate through. Only does
+        any work when `version` differs from the last one we saw.
+        """
+        with self._lock:
+            if version == self._synced_version:
+                return
+            self._synced_version = version
+            self._spots = {commercial['file_path']: commercial for commercial in commercials}
+            self._heap = []
+            self._due_at = {}
+            for file_path in self._spots:
+                self._push(file_path)
+
+    def sync_with(self, catalog):
+        # `catalog` is a CommercialCatalog. Asking for its commercials is
+        # also what keeps it fresh, so we do that whenever it's stale, but
+        # only rebuild when it actually changed.
+        if catalog.version == self._synced_version and not catalog.is_stale():
+            return
+        commercials = catalog.commercials()
+        self.sync(commercials, catalog.version)
+
+    def candidates(self, now, exclude=()) -> list:
+        """
+        Up to `candidate_count` spots, leaving out file paths in `exclude`.
+        Spots that are due come first, the most overdue first. Among those,
+        spots whose subject aired within the subject cooldown go last. Spots
+        that aren't due yet only make the list when there aren't enough
+        others.
+        """
+        with self._lock:
+            due = []
+            resting_subject = []
+            not_due = []
+            popped = []
+            while self._heap and len(due) < self.candidate_count and len(popped) < self.candidate_count * CANDIDATE_SEARCH_FACTOR:
+                due_at, _, file_path = self._heap[0]
+                if due_at > now and len(due) + len(resting_subject) + len(not_due) >= self.candidate_count:
+                    # Everything from here on is even less due.
+                    break
+                entry = heapq.heappop(self._heap)
+                if self._due_at.get(file_path) != due_at or file_path not in self._spots:
+                    # Superseded by a newer entry, or gone from the catalog.
+                    continue
+                popped.append(entry)
+                if file_path in exclude:
+                    continue
+                commercial = self._spots[file_path]
+                subject = commercial.get('subject')
+                if due_at > now:
+                    not_due.append(commercial)
+                elif subject is not None and abs(now - self._subject_last_aired.get(subject, float('-inf'))) < self.subject_cooldown_in_seconds:
+                    resting_subject.append(commercial)
+                else:
+                    due.append(commercial)
+            # We only looked, put them back.
+            for entry in popped:
+                heapq.heappush(self._heap, entry)
+            return (due + resting_subject + not_due)[:self.candidate_count]
+
+    def record_aired(self, commercials, aired_at):
+        with self._lock:
+            for commercial in commercials:
+                file_path = commercial['file_path']
+                self._spot_last_aired[file_path] = aired_at
+                if commercial.get('subject') is not None:
+                    self._subject_last_aired[commercial['subject']] = aired_at
+                if file_path in self._spots:
+                    self._push(file_path)
+            self._dirty = self._dirty or bool(commercials)
+            # Superseded entries pile up as spots air. Rebuild now and then
+            # so the heap stays proportional to the catalog.
+            if len(self._heap) > 2 * len(self._spots) + 64:
+                self._heap = []
+                for file_path in self._spots:
+                    self._push(file_path)
+            if self.persist and time.monotonic() - self._saved_at > SAVE_INTERVAL_IN_SECONDS:
+                self._save()
+
+    def record_aired_files(self, file_paths, aired_at):
+        # Like `record_aired`, for when all we have is the file paths (the
+        # videos of a plan).
+        with self._lock:
+            commercials = [self._spots.get(file_path, {'file_path': file_path}) for file_path in file_paths]
+        self.record_aired(commercials, aired_at)
+
+    def scratch_copy(self):
+        """
+        A copy that knows everything this one does, for planning commercials
+        that won't air. What's recorded in it goes nowhere.
+        """
+        with self._lock:
+            copy = CommercialRotation(state_path=self.state_path, spot_cooldown_in_seconds=self.spot_cooldown_in_seconds,
+                                      subject_cooldown_in_seconds=self.subject_cooldown_in_seconds, candidate_count=self.candidate_count,
+                                      persist=False, rng=self.rng)
+            copy._spots = self._spots
+            copy._spot_last_aired = dict(self._spot_last_aired)
+            copy._subject_last_aired = dict(self._subject_last_aired)
+            copy._heap = list(self._heap)
+            copy._due_at = dict(self._due_at)
+            copy._synced_version = self._synced_version
+            return copy
+
+    def last_aired(self, file_path):
+        return self._spot_last_aired.get(file_path)
+
+    def save(self):
+        with self._lock:
+            self._save()
+
+    def flush(self):
+        # Save whatever was recorded since the last save, if anything.
+        with self._lock:
+            if self.persist and self._dirty:
+                self._save()
+
+    def _push(self, file_path):
+        # Must be called with the lock held.
+        weight = float(self._spots[file_path].get('weight') or 1)
+        last_aired = self._spot_last_aired.get(file_path)
+        if last_aired is None:
+            # Never aired (as far as we know). Heavier spots go first.
+            due_at = -weight
+        else:
+            due_at = last_aired + self.spot_cooldown_in_seconds / max(weight, 0.01)
+        self._due_at[file_path] = due_at
+        # The random tiebreak shuffles spots that are due at the same time.
+        heapq.heappush(self._heap, (due_at, self.rng.random(), file_path))
+
+    def _load(self):
+        if not self.persist:
+            return
+        try:
+            state = json.loads(self.state_path.read_text())
+        except FileNotFoundError:
+            return
+        except (ValueError, OSError) as e:
+            print(f'Ignoring unreadable commercial rotation state: {e}')
+            return
+        self._spot_last_aired = state.get('spots', {})
+        self._subject_last_aired = state.get('subjects', {})
+
+    def _save(self):
+        # Must be called with the lock held.
+        self._saved_at = time.monotonic()
+        self._dirty = False
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+        descriptor, temporary_path = tempfile.mkstemp(dir=self.state_path.parent, prefix='.rotation.', suffix='.tmp')
+        with os.fdopen(descriptor, 'w') as temporary_file:
+            json.dump({'spots': self._spot_last_aired, 'subjects': self._subject_last_aired}, temporary_file)
+        os.replace(temporary_path, self.state_path)
+
+
+_shared_commercial_rotation = None
+_shared_commercial_rotation_lock = threading.Lock()
+
+
+def get_commercial_rotation() -> CommercialRotation:
+    # One rotation per process, so channels sharing a box don't air the same
+    # spot back to back either.
+    global _shared_commercial_rotation
+    with _shared_commercial_rotation_lock:
+        if _shared_commercial_rotation is None:
+            _shared_commercial_rotation = CommercialRotation()
+            atexit.register(_shared_commercial_rotation.flush)
+        return _shared_commercial_rotation
@@ -1,9 +1,16 @@
+import datetime
 import random
 
 from decimal import Decimal
-from scheduler_client import SchedulerClient
+from break_packing import DEFAULT_TOLERANCE_IN_SECONDS, pack_commercial_break
+from commercial_catalog import get_commercial_catalog
+from metrics import COMMERCIAL_BREAK_ERROR_SECONDS
 from video import Video
 
+# Even a small catalog gets repeated rather than leaving dead air, but we stop
+# after this many passes over it.
+MAX_CATALOG_PASSES = 4
+
 
 # NOTE: The intention is to move the commercial selection logic to the
 # Scheduler application. Technical Director ideally just says "Give me 1m45s
@@ -11,50 +18,48 @@ from video import Video
 # as close to 1m45s of commercials that are relevant to the listing
 # (appropriate for the content being played). For now we'll just make sure we
 # don't show a bunch of repeats or commercials for the same subject.
-def get_commercial_break(target_duration_in_seconds):
-    commercials = all_commercials()
-    actual_duration = Decimal(0)
-    commercial_break = []
-    # Keep track of the amount of times we tried to get closer to our time
-    # budget and couldn't. If we exceed 5 attempts, just grab whatever. We just
-    # make our best effort at filling the time budget without exceeding it too
-    # much, but we'd rather exceed it than underfill. No dead air!
-    attempts = 0
-    subjects_portrayed = []
-    while actual_duration < target_duration_in_seconds and commercials:
-        # Pick a random commercial
-        random_index = random.choice(range(0, len(commercials)))
-
-        # If the randomly selected commercial has a subject specified, make
-        # sure we haven't already included a commercial about that subject
-        # this break.
-        if commercials[random_index]['subject'] is not None and commercials[random_index]['subject'] in subjects_portrayed:
-            continue
-
-        # If the chosen commercial would put us more than ten seconds over our
-        # time budget, do not use it. If we exceed five attempts just give up
-        # and use whatever.
-        if ((actual_duration + Decimal(commercials[random_index]['duration'])) - Decimal(target_duration_in_seconds)) > 10:
-            attempts += 1
-            if attempts > 5:
-                commercial = commercials.pop(random_index)
-                decimal_duration = Decimal(commercial['duration'])
-                actual_duration += decimal_duration
-                subjects_portrayed.append(commercial['subject'])
-                commercial_video = Video(commercial['file_path'], duration_in_seconds=decimal_duration)
-                commercial_break.append(commercial_video)
+#
+# With a `rotation` (a CommercialRotation), that goes for the whole day, not
+# just this break: only the spots that have rested longest are considered,
+# and the ones we pick are recorded as airing at `airs_at` (default now).
+def get_commercial_break(target_duration_in_seconds, rng=random, tolerance_in_seconds=DEFAULT_TOLERANCE_IN_SECONDS, commercials=None,
+                         rotation=None, airs_at=None, commercials_version=None):
+    # Callers may bring their own catalog, otherwise we use the shared one.
+    # Bringing the shared catalog's commercials along with its version keeps
+    # the rotation from rebuilding for them.
+    if rotation is not None:
+        if commercials is None:
+            rotation.sync_with(get_commercial_catalog())
         else:
-            commercial = commercials.pop(random_index)
+            rotation.sync(commercials, version=id(commercials) if commercials_version is None else commercials_version)
+        aired_at = (airs_at or datetime.datetime.now()).timestamp()
+    elif commercials is None:
+        commercials = all_commercials()
+    commercial_break = []
+    actual_duration = Decimal(0)
+    remaining_duration = Decimal(target_duration_in_seconds)
+    # If the target duration exceeds the total duration of all commercials,
+    # we have to repeat. Each pass packs what it can out of the whole catalog.
+    for _ in range(MAX_CATALOG_PASSES):
+        if remaining_duration <= tolerance_in_seconds and commercial_break:
+            break
+        candidates = rotation.candidates(aired_at) if rotation is not None else commercials
+        packed = pack_commercial_break(candidates, remaining_duration, tolerance_in_seconds=tolerance_in_seconds, rng=rng)
+        if not packed:
+            break
+        if rotation is not None:
+            # Recorded right away, so the next pass (and the next break)
+            # reaches for other spots first.
+            rotation.record_aired(packed, aired_at)
+        for commercial in packed:
             decimal_duration = Decimal(commercial['duration'])
             actual_duration += decimal_duration
-            subjects_portrayed.append(commercial['subject'])
-            commercial_video = Video(commercial['file_path'], duration_in_seconds=decimal_duration)
-            commercial_break.append(commercial_video)
-    # TODO: Is there a chance the target duration exceeds the total duration
-    # of all commercials? In that case, we would need to repeat. >=-/
+            commercial_break.append(Video(commercial['file_path'], duration_in_seconds=decimal_duration, is_commercial=True))
+        remaining_duration = Decimal(target_duration_in_seconds) - actual_duration
+    COMMERCIAL_BREAK_ERROR_SECONDS.observe(float(actual_duration - Decimal(target_duration_in_seconds)))
     return commercial_break
 
 
 def all_commercials() -> list:
-    client = SchedulerClient()
-    return client.get_all_commercials()
+    # Served from the shared in-process catalog, not a fresh download.
+    return get_commercial_catalog().commercials()
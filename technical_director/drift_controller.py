@@ -0,0 +1,154 @@
+from collections import OrderedDict
+from decimal import Decimal
+
+from break_packing import pack_commercial_break
+from commercial_catalog import get_commercial_catalog
+from commercial_utils import get_commercial_break
+from metrics import BLOCK_DRIFT_SECONDS
+
+# Drift smaller than this is left alone. Anything we could add or remove is
+# a commercial, so chasing a second or two would do more harm than good.
+DRIFT_TOLERANCE_IN_SECONDS = 2
+
+# How many blocks' worth of drift measurements we keep around.
+DRIFT_HISTORY_LENGTH = 48
+
+
+class DriftController:
+    """
+    Keeps scheduling blocks ending on time.
+
+    Airtimes are planned from nominal durations, but startup latency, gaps
+    between videos, and breaks that came out a little long all push the real
+    timeline later (or earlier) than the plan. Every time we measure, we
+    project when the current block will actually end, from VLC's real
+    position in the current video plus whatever of the block is still queued,
+    and compare that to when the block is supposed to end. If we're off by
+    more than the tolerance, commercials still waiting in the block are
+    dropped (when late) or added to its last break (when early).
+
+    `on_queue_changed` is called after every correction, so the director can
+    save the plan as it now stands.
+    """
+
+    def __init__(self, video_queue, vlc_controller, tolerance_in_seconds=DRIFT_TOLERANCE_IN_SECONDS, metric_labels=None,
+                 commercial_rotation=None, on_queue_changed=None):
+        self.video_queue = video_queue
+        self.vlc_controller = vlc_controller
+        self.commercial_rotation = commercial_rotation
+        self.on_queue_changed = on_queue_changed
+        self.metric_labels = metric_labels or {}
+        self.tolerance_in_seconds = Decimal(tolerance_in_seconds)
+        # Block end -> the latest drift we measured for it, in seconds.
+        # Positive means the block is running late.
+        self.drift_by_block = OrderedDict()
+
+    def measure(self, current_video, current_video_started, now):
+        """
+        How many seconds after its planned end the current block will end,
+        or None if the current video isn't part of a planned block.
+        """
+        if current_video is None or current_video.block_end is None:
+            return None
+        projected_end_offset = self.remaining_in_current_video(current_video, current_video_started, now)
+        for video in self.block_videos(current_video.block_end):
+            projected_end_offset += Decimal(video.duration_in_seconds())
+        planned_end_offset = Decimal(str((current_video.block_end - now).total_seconds()))
+        drift = projected_end_offset - planned_end_offset
+
+        self.drift_by_block[current_video.block_end] = drift
+        BLOCK_DRIFT_SECONDS.set(float(drift), **self.metric_labels)
+        self.drift_by_block.move_to_end(current_video.block_end)
+        while len(self.drift_by_block) > DRIFT_HISTORY_LENGTH:
+            self.drift_by_block.popitem(last=False)
+        return drift
+
+    def measure_and_correct(self, current_video, current_video_started, now):
+        drift = self.measure(current_video, current_video_started, now)
+        if drift is None or abs(drift) <= self.tolerance_in_seconds:
+            return drift
+        if drift > 0:
+            self.shorten_block(current_video.block_end, drift)
+        else:
+            self.lengthen_block(current_video.block_end, -drift, current_video.scheduling_block)
+        return drift
+
+    def remaining_in_current_video(self, current_video, current_video_started, now) -> Decimal:
+        start = Decimal(current_video.start_at_second or 0)
+        duration = Decimal(current_video.duration_in_seconds())
+        position = self.vlc_controller.position_in_seconds()
+        if position is None or position < start or current_video.repeat_count:
+            # VLC hasn't told us where it is yet, or it's a repeated video
+            # (the dead air loop) and its position starts over with every
+            # pass. Go by the clock instead.
+            elapsed = Decimal(str((now - current_video_started).total_seconds())) if current_video_started else Decimal(0)
+            return max(duration - elapsed, Decimal(0))
+        return max(start + duration - position, Decimal(0))
+
+    def block_videos(self, block_end):
+        # The block's videos are always at the front of the queue, right
+        # after the one that's playing.
+        videos = []
+        for index in range(len(self.video_queue)):
+            video = self.video_queue[index]
+            if video.block_end != block_end:
+                break
+            videos.append(video)
+        return videos
+
+    def shorten_block(self, block_end, drift):
+        block_videos = self.block_videos(block_end)
+        commercials = [video for video in block_videos if video.is_commercial]
+        if not commercials:
+            return
+        # Keep the set of queued commercials that comes closest to their
+        # current total minus the drift. Subjects don't matter here, these
+        # already passed that check when the breaks were assembled.
+        candidates = [{'duration': video.duration_in_seconds(), 'subject': None, 'video': video} for video in commercials]
+        keep_duration = sum((Decimal(video.duration_in_seconds()) for video in commercials), Decimal(0)) - drift
+        kept = pack_commercial_break(candidates, keep_duration, tolerance_in_seconds=self.tolerance_in_seconds) if keep_duration > 0 else []
+        kept_ids = {id(candidate['video']) for candidate in kept}
+        new_block_videos = [video for video in block_videos if not video.is_commercial or id(video) in kept_ids]
+        dropped = len(block_videos) - len(new_block_videos)
+        if dropped:
+            print(f'Block ending {block_end} is running {round(drift, 1)}s late, dropping {dropped} commercial(s).')
+            self.video_queue.replace(0, len(block_videos), new_block_videos)
+            self.queue_changed()
+
+    def lengthen_block(self, block_end, drift, scheduling_block=None):
+        # `scheduling_block` is the block's, for when none of its videos are
+        # left in the queue to take it from.
+        block_videos = self.block_videos(block_end)
+        # This runs on the playback thread, so we make do with the catalog as
+        # it is rather than wait for the Scheduler to revalidate it.
+        catalog = get_commercial_catalog()
+        commercials = catalog.cached_commercials()
+        if not commercials:
+            return
+        extra_commercials = get_commercial_break(drift, tolerance_in_seconds=self.tolerance_in_seconds, commercials=commercials,
+                                                 commercials_version=catalog.version, rotation=self.commercial_rotation, airs_at=block_end)
+        if not extra_commercials:
+            return
+        # Add them to the block's last break, or to the very end of the block
+        # if no break is left in it.
+        insert_at = len(block_videos)
+        batch_label = None
+        for index, video in enumerate(block_videos):
+            if video.is_commercial:
+                insert_at = index + 1
+                batch_label = video.batch_label
+        if block_videos:
+            scheduling_block = block_videos[max(insert_at - 1, 0)].scheduling_block
+        for commercial_video in extra_commercials:
+            # Like the rest of the block, so a saved plan keeps them in it.
+            commercial_video.block_end = block_end
+            commercial_video.scheduling_block = scheduling_block
+            if batch_label:
+                commercial_video.batch_label = batch_label
+        print(f'Block ending {block_end} is running {round(drift, 1)}s early, adding {len(extra_commercials)} commercial(s).')
+        self.video_queue.replace(insert_at, insert_at, extra_commercials)
+        self.queue_changed()
+
+    def queue_changed(self):
+        if self.on_queue_changed is not None:
+            self.on_queue_changed()
@@ -0,0 +1,135 @@
+"""
+Index the media library ahead of time, so nothing has to be probed when it's
+about to air.
+
+    poetry run python technical_director/indexer.py /mnt/nas/tv /mnt/nas/commercials
+
+Every video under the given directories (or MEDIA_ROOTS, separated by
+colons) is run through ffprobe by a pool of worker processes, and the results
+go into the same metadata cache the director reads from. Files that are
+already indexed at their current size and modification time are skipped, and
+every result is saved the moment it's ready, so an interrupted run picks up
+where it left off when started again.
+
+With --detect-breaks, shows that don't have chapter markers are also decoded
+in full to find where they fade to black and go quiet, and those points are
+used for commercial breaks instead. That's slow (minutes per episode on a Pi)
+but only ever happens once per file.
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from metadata_cache import get_metadata_cache
+from video_utils import detect_natural_breaks, get_video_duration_in_seconds, probe_video_information
+
+VIDEO_EXTENSIONS = {'.avi', '.m4v', '.mkv', '.mov', '.mp4', '.mpg', '.ts', '.webm'}
+
+# ffprobe mostly waits on the NAS, break detection keeps a core busy. One
+# worker per core suits both.
+DEFAULT_WORKERS = os.cpu_count() or 2
+
+# Print progress every this many files.
+PROGRESS_INTERVAL = 100
+
+
+def find_videos(media_roots):
+    # Yields (file_path, size, mtime_ns) for every video under the roots.
+    for media_root in media_roots:
+        for directory, subdirectories, file_names in os.walk(media_root):
+            # Skip hidden directories, like the read-ahead cache's.
+            subdirectories[:] = sorted(name for name in subdirectories if not name.startswith('.'))
+            for file_name in sorted(file_names):
+                if file_name.startswith('.') or os.path.splitext(file_name)[1].lower() not in VIDEO_EXTENSIONS:
+                    continue
+                file_path = os.path.join(directory, file_name)
+                try:
+                    stat_result = os.stat(file_path)
+                except OSError:
+                    continue
+                yield file_path, stat_result.st_size, stat_result.st_mtime_ns
+
+
+def needs_indexing(information, detect_breaks) -> bool:
+    if information is None:
+        return True
+    # Indexed before, but without looking for breaks it now needs.
+    return detect_breaks and not information.get('chapters') and 'detected_chapters' not in information
+
+
+def index_file(file_path, detect_breaks, previous_information=None):
+    """
+    Runs in a worker process. Returns (file_path, information, error).
+    """
+    try:
+        information = previous_information or probe_video_information(file_path)
+        if detect_breaks and not information.get('chapters'):
+            information['detected_chapters'] = detect_natural_breaks(file_path, get_video_duration_in_seconds(information))
+        return file_path, information, None
+    except Exception as e:
+        return file_path, None, e
+
+
+class Indexer:
+    def __init__(self, media_roots, workers=DEFAULT_WORKERS, detect_breaks=False, metadata_cache=None):
+        self.media_roots = media_roots
+        self.workers = workers
+        self.detect_breaks = detect_breaks
+        self.metadata_cache = metadata_cache or get_metadata_cache()
+        self.indexed = 0
+        self.skipped = 0
+        self.failed = 0
+
+    def run(self):
+        started = time.monotonic()
+        # Only a few files are in flight at a time, so a library of any size
+        # is crawled and indexed at the same time in constant memory.
+        in_flight = {}
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            for file_path, size, mtime_ns in find_videos(self.media_roots):
+                information = self.metadata_cache.stored_information(file_path, size, mtime_ns)
+                if not needs_indexing(information, self.detect_breaks):
+                    self.skipped += 1
+                    continue
+                future = executor.submit(index_file, file_path, self.detect_breaks, information)
+                in_flight[future] = (size, mtime_ns)
+                if len(in_flight) >= self.workers * 4:
+                    self.collect(in_flight, wait(in_flight, return_when=FIRST_COMPLETED).done)
+            self.collect(in_flight, wait(in_flight).done)
+        print(f'Indexed {self.indexed} file(s), skipped {self.skipped} already indexed, {self.failed} failed, '
+              f'in {round(time.monotonic() - started, 1)}s.')
+
+    def collect(self, in_flight, done):
+        for future in done:
+            size, mtime_ns = in_flight.pop(future)
+            file_path, information, error = future.result()
+            if error is not None:
+                self.failed += 1
+                print(f'Could not index {file_path}: {error}')
+                continue
+            # Saved right away, that's what makes an interrupted run resumable.
+            self.metadata_cache.put(file_path, size, mtime_ns, information)
+            self.indexed += 1
+            if self.indexed % PROGRESS_INTERVAL == 0:
+                print(f'Indexed {self.indexed} file(s) so far...')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('media_roots', nargs='*', help='Directories to index. Defaults to MEDIA_ROOTS.')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS)
+    parser.add_argument('--detect-breaks', action='store_true',
+                        help='Find natural commercial breaks in videos without chapter markers.')
+    args = parser.parse_args()
+
+    media_roots = args.media_roots or [root for root in os.getenv('MEDIA_ROOTS', '').split(':') if root]
+    if not media_roots:
+        parser.error('Give at least one directory to index, or set MEDIA_ROOTS.')
+    Indexer(media_roots, workers=args.workers, detect_breaks=args.detect_breaks).run()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,197 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from metrics import METADATA_CACHE_LOOKUPS
+
+# Roughly how many files we remember. A row is a few kilobytes of ffprobe
+# JSON, so this keeps the database comfortably small on an SD card while still
+# covering a whole library of episodes and commercials.
+DEFAULT_MAX_ENTRIES = 50000
+
+# Bumping the "last used" time of a row on every hit would turn every read
+# into a write. We only care about it for eviction, so a day of slop is fine.
+LAST_USED_UPDATE_INTERVAL_IN_SECONDS = 24 * 60 * 60
+
+# How many files' information we also keep in memory. A few days of
+# planning touches far fewer than this.
+DEFAULT_MEMO_ENTRIES = 2000
+
+# Once over the size cap, we evict this much of it on top, so that a full
+# cache isn't deleting a row on every put.
+EVICTION_SLACK = 0.01
+
+
+def default_metadata_cache_path() -> Path:
+    return Path.home().joinpath('.mylittlecableco', 'technical_director', 'metadata.sqlite3')
+
+
+class MetadataCache:
+    """
+    Persistent ffprobe results, keyed by file path, size, and modification
+    time. If a file is replaced on the NAS its size or mtime changes, the key
+    no longer matches, and we probe it again.
+    """
+
+    def __init__(self, db_path=None, max_entries=DEFAULT_MAX_ENTRIES, memo_entries=DEFAULT_MEMO_ENTRIES):
+        self.db_path = Path(db_path) if db_path else default_metadata_cache_path()
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.memo_entries = memo_entries
+        self.hits = 0
+        self.misses = 0
+
+        # Several threads (and later several directors) share one cache, so
+        # we serialize access to the connection ourselves.
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(str(self.db_path), check_same_thread=False, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS video_information ('
+            ' file_path TEXT PRIMARY KEY,'
+            ' size INTEGER NOT NULL,'
+            ' mtime_ns INTEGER NOT NULL,'
+            ' information TEXT NOT NULL,'
+            ' last_used REAL NOT NULL)'
+        )
+        self._connection.execute('CREATE INDEX IF NOT EXISTS video_information_last_used ON video_information (last_used)')
+
+        # How many rows there are, kept up to date as we go so a put doesn't
+        # have to count them.
+        self._row_count = self._count_rows()
+
+        # In-memory copy of what we've already read from disk this run, so
+        # repeated lookups (one per chapter segment) don't even hit sqlite.
+        # File path -> (size, mtime_ns, information), least recently used
+        # first.
+        self._memo = OrderedDict()
+
+    def get(self, file_path, size, mtime_ns):
+        with self._lock:
+            memo = self._memo.get(file_path)
+            if memo is not None and memo[:2] == (size, mtime_ns):
+                self._memo.move_to_end(file_path)
+                return memo[2]
+            row = self._connection.execute(
+                'SELECT information, last_used FROM video_information WHERE file_path = ? AND size = ? AND mtime_ns = ?',
+                (file_path, size, mtime_ns),
+            ).fetchone()
+            if row is None:
+                return None
+            information, last_used = row
+            now = time.time()
+            if now - last_used > LAST_USED_UPDATE_INTERVAL_IN_SECONDS:
+                self._connection.execute('UPDATE video_information SET last_used = ? WHERE file_path = ?', (now, file_path))
+            information = json.loads(information)
+            self._remember(file_path, size, mtime_ns, information)
+            return information
+
+    def stored_information(self, file_path, size, mtime_ns):
+        # Like `get`, but for looking over the whole library (the indexer):
+        # nothing is remembered in memory and `last_used` isn't touched.
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT information FROM video_information WHERE file_path = ? AND size = ? AND mtime_ns = ?',
+                (file_path, size, mtime_ns),
+            ).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def put(self, file_path, size, mtime_ns, information):
+        with self._lock:
+            # Replaces anything we remembered about an older version of the file.
+            self._remember(file_path, size, mtime_ns, information)
+            replacing = self._connection.execute('SELECT 1 FROM video_information WHERE file_path = ?', (file_path,)).fetchone()
+            self._connection.execute(
+                'INSERT OR REPLACE INTO video_information (file_path, size, mtime_ns, information, last_used) VALUES (?, ?, ?, ?, ?)',
+                (file_path, size, mtime_ns, json.dumps(information), time.time()),
+            )
+            if replacing is None:
+                self._row_count += 1
+                if self._row_count > self.max_entries:
+                    self._enforce_size_cap()
+
+    def invalidate(self, file_path):
+        with self._lock:
+            self._memo.pop(file_path, None)
+            deleted = self._connection.execute('DELETE FROM video_information WHERE file_path = ?', (file_path,)).rowcount
+            self._row_count -= deleted
+
+    def clear(self):
+        with self._lock:
+            self._memo.clear()
+            self._connection.execute('DELETE FROM video_information')
+            self._row_count = 0
+
+    def __len__(self):
+        with self._lock:
+            return self._count_rows()
+
+    def get_or_probe(self, file_path, probe):
+        """
+        Return the cached information for `file_path`, calling `probe` (and
+        remembering its result) only when we have never seen this version of
+        the file before.
+        """
+        try:
+            stat_result = os.stat(file_path)
+        except OSError:
+            # We can't key it, so don't cache it. Let the probe raise (or not)
+            # exactly as it would have without a cache.
+            self.misses += 1
+            METADATA_CACHE_LOOKUPS.inc(result='miss')
+            return probe(file_path)
+
+        information = self.get(file_path, stat_result.st_size, stat_result.st_mtime_ns)
+        if information is not None:
+            self.hits += 1
+            METADATA_CACHE_LOOKUPS.inc(result='hit')
+            return information
+
+        self.misses += 1
+        METADATA_CACHE_LOOKUPS.inc(result='miss')
+        information = probe(file_path)
+        self.put(file_path, stat_result.st_size, stat_result.st_mtime_ns, information)
+        return information
+
+    def _remember(self, file_path, size, mtime_ns, information):
+        # Must be called with the lock held.
+        self._memo[file_path] = (size, mtime_ns, information)
+        self._memo.move_to_end(file_path)
+        if len(self._memo) > self.memo_entries:
+            self._memo.popitem(last=False)
+
+    def _count_rows(self):
+        return self._connection.execute('SELECT COUNT(*) FROM video_information').fetchone()[0]
+
+    def _enforce_size_cap(self):
+        # Must be called with the lock held. Another process (the indexer)
+        # may have added rows too, so we count for real before deleting any.
+        self._row_count = self._count_rows()
+        overflow = self._row_count - self.max_entries
+        if overflow <= 0:
+            return
+        overflow += int(self.max_entries * EVICTION_SLACK)
+        deleted = self._connection.execute(
+            'DELETE FROM video_information WHERE file_path IN '
+            '(SELECT file_path FROM video_information ORDER BY last_used ASC LIMIT ?)',
+            (overflow,),
+        ).rowcount
+        self._row_count -= deleted
+
+
+_shared_metadata_cache = None
+_shared_metadata_cache_lock = threading.Lock()
+
+
+def get_metadata_cache() -> MetadataCache:
+    # Every Video shares one cache per process.
+    global _shared_metadata_cache
+    with _shared_metadata_cache_lock:
+        if _shared_metadata_cache is None:
+            _shared_metadata_cache = MetadataCache()
+        return _shared_metadata_cache
@@ -0,0 +1,208 @@
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Where Prometheus can scrape us. Set METRICS_PORT=0 to turn the endpoint off.
+DEFAULT_METRICS_PORT = 9101
+
+# Seconds. Good for everything from a cache hit to a slow ffprobe.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+METRIC_NAME_PREFIX = 'technical_director_'
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(label_key):
+    if not label_key:
+        return ''
+    escaped = (f'{name}="{_escape_label_value(value)}"' for name, value in label_key)
+    return '{' + ','.join(escaped) + '}'
+
+
+def _escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class Counter:
+    type_name = 'counter'
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(_label_key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+
+class Gauge(Counter):
+    type_name = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+
+class Histogram:
+    type_name = 'histogram'
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        # Label key -> [per-bucket counts, sum, count]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            if key not in self._values:
+                self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            bucket_counts, _, _ = self._values[key]
+            for index, upper_bound in enumerate(self.buckets):
+                if value <= upper_bound:
+                    bucket_counts[index] += 1
+            self._values[key][1] += value
+            self._values[key][2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - started, **labels)
+
+    def count(self, **labels):
+        values = self._values.get(_label_key(labels))
+        return values[2] if values else 0
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, (bucket_counts, total, count) in self._values.items():
+                for upper_bound, bucket_count in zip(self.buckets, bucket_counts):
+                    samples.append((f'{self.name}_bucket', key + (('le', _format_value(upper_bound)),), bucket_count))
+                samples.append((f'{self.name}_sum', key, total))
+                samples.append((f'{self.name}_count', key, count))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, metric_class, name, help_text, **kwargs):
+        full_name = METRIC_NAME_PREFIX + name
+        with self._lock:
+            if full_name not in self._metrics:
+                self._metrics[full_name] = metric_class(full_name, help_text, **kwargs)
+            return self._metrics[full_name]
+
+    def counter(self, name, help_text) -> Counter:
+        return self._get_or_create(Counter, name, help_text)
+
+    def gauge(self, name, help_text) -> Gauge:
+        return self._get_or_create(Gauge, name, help_text)
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, help_text, buckets=buckets)
+
+    def render(self) -> str:
+        """
+        Everything we've recorded, in the Prometheus text exposition format.
+        """
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.help_text}')
+            lines.append(f'# TYPE {metric.name} {metric.type_name}')
+            for sample_name, label_key, value in metric.samples():
+                lines.append(f'{sample_name}{_format_labels(label_key)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+# The registry every module records into.
+REGISTRY = Registry()
+
+TRANSITION_GAP_SECONDS = REGISTRY.histogram(
+    'transition_gap_seconds', 'Time from VLC reporting the end of a video to us calling play() on the next one.')
+TRANSITION_LATENCY_SECONDS = REGISTRY.histogram(
+    'transition_latency_seconds', 'Time from VLC reporting the end of a video to VLC reporting the next one playing.')
+FFPROBE_DURATION_SECONDS = REGISTRY.histogram(
+    'ffprobe_duration_seconds', 'How long each ffprobe run took.')
+METADATA_CACHE_LOOKUPS = REGISTRY.counter(
+    'metadata_cache_lookups_total', 'Video information lookups, by result (hit or miss).')
+SCHEDULER_REQUEST_DURATION_SECONDS = REGISTRY.histogram(
+    'scheduler_request_duration_seconds', 'Latency of requests to the Scheduler, by endpoint.')
+SCHEDULER_REQUEST_ERRORS = REGISTRY.counter(
+    'scheduler_request_errors_total', 'Requests to the Scheduler that failed, by endpoint.')
+FEED_QUEUE_DURATION_SECONDS = REGISTRY.histogram(
+    'feed_queue_duration_seconds', 'Wall time spent planning a scheduling block.')
+COMMERCIAL_BREAK_ERROR_SECONDS = REGISTRY.histogram(
+    'commercial_break_error_seconds', 'Assembled commercial break length minus the length we asked for.',
+    buckets=(-30, -10, -5, -2, -1, -0.5, 0, 0.5, 1, 2, 5, 10, 30))
+QUEUE_DEPTH_SECONDS = REGISTRY.gauge(
+    'queue_depth_seconds', 'Seconds of video lined up after the one playing.')
+QUEUE_LENGTH = REGISTRY.gauge(
+    'queue_length', 'Number of videos lined up after the one playing.')
+STARTUP_SECONDS = REGISTRY.gauge(
+    'startup_seconds', 'Time from launch to the first video being handed to the player.')
+BLOCK_DRIFT_SECONDS = REGISTRY.gauge(
+    'block_drift_seconds', 'How late (positive) or early (negative) the current block is projected to end.')
+PLAYBACK_STALLS = REGISTRY.counter(
+    'playback_stalls_total', 'Times the watchdog found playback stalled, by reason.')
+TIME_TO_RECOVERY_SECONDS = REGISTRY.histogram(
+    'time_to_recovery_seconds', 'Time from playback stalling to the player being handed something to play instead.',
+    buckets=(1, 2, 3, 5, 7.5, 10, 15, 30, 60))
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode('UTF-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes every few seconds would drown out the log we care about.
+        pass
+
+
+def start_metrics_server(port=DEFAULT_METRICS_PORT, registry=REGISTRY):
+    handler = type('BoundMetricsRequestHandler', (MetricsRequestHandler,), {'registry': registry})
+    server = ThreadingHTTPServer(('', port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name='metrics', daemon=True)
+    thread.start()
+    return server
@@ -0,0 +1,108 @@
+"""
+Run several channels from one process, each on its own VLC player.
+
+    CHANNEL_NUMBERS=7,8 VLC_OPTIONS_CH8="--x11-display=:1" \
+        SCHEDULER_URL=http://mlcc-03.local:3000 poetry run python technical_director/multi_channel.py
+
+Every channel gets its own director, player, and queue. Everything that
+doesn't need to be per channel is made once and shared: the connection pool
+to the Scheduler (and the lineups it caches), the commercial catalog, the
+metadata cache, the read-ahead and rendition caches, and the threads that
+plan blocks and run ffprobe. Adding a channel costs a player and a queue,
+not another copy of all of that.
+"""
+import argparse
+import os
+import shlex
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from commercial_catalog import get_commercial_catalog
+from metrics import DEFAULT_METRICS_PORT, start_metrics_server
+from queue_planner import DEFAULT_PROBE_WORKERS
+from read_ahead_cache import ReadAheadCache
+from schedule_snapshot import snapshot_from_environment
+from scheduler_client import SchedulerClient
+from technical_director import DEFAULT_READ_AHEAD_BUDGET_IN_GB, TechnicalDirector, report_startup_time
+from transcode_cache import DEFAULT_BUDGET_IN_BYTES as DEFAULT_RENDITION_BUDGET_IN_BYTES, TranscodeCache
+
+
+def player_options_for(channel_number):
+    # VLC_OPTIONS_CH7="--x11-display=:0.1" sends channel 7 to that display.
+    return shlex.split(os.getenv(f'VLC_OPTIONS_CH{channel_number}', ''))
+
+
+class MultiChannelRuntime:
+    def __init__(self, channel_numbers, scheduler_client=None, vlc_controllers=None):
+        self.channel_numbers = list(channel_numbers)
+        self.scheduler_client = scheduler_client or SchedulerClient(snapshot=snapshot_from_environment())
+        self.scheduler_client.start_background_refresh()
+        get_commercial_catalog(self.scheduler_client)
+
+        read_ahead_budget_in_gb = float(os.getenv('READ_AHEAD_BUDGET_GB', DEFAULT_READ_AHEAD_BUDGET_IN_GB))
+        self.read_ahead_cache = None
+        if read_ahead_budget_in_gb > 0:
+            # One budget for every channel.
+            self.read_ahead_cache = ReadAheadCache(budget_in_bytes=int(read_ahead_budget_in_gb * 1024 ** 3))
+        rendition_budget_in_gb = float(os.getenv('RENDITION_BUDGET_GB', DEFAULT_RENDITION_BUDGET_IN_BYTES / 1024 ** 3))
+        self.transcode_cache = None
+        if rendition_budget_in_gb > 0:
+            self.transcode_cache = TranscodeCache(budget_in_bytes=int(rendition_budget_in_gb * 1024 ** 3))
+
+        # Each director has at most one plan in flight, so a worker per
+        # channel means nobody waits on anybody else's plan.
+        self.planning_executor = ThreadPoolExecutor(max_workers=len(self.channel_numbers), thread_name_prefix='planner')
+        self.probe_executor = ThreadPoolExecutor(max_workers=DEFAULT_PROBE_WORKERS, thread_name_prefix='probe')
+
+        vlc_controllers = vlc_controllers or {}
+        self.directors = [
+            TechnicalDirector(
+                channel_number=channel_number,
+                scheduler_client=self.scheduler_client,
+                vlc_controller=vlc_controllers.get(channel_number),
+                read_ahead_budget_in_gb=0,
+                rendition_budget_in_gb=0,
+                read_ahead_cache=self.read_ahead_cache,
+                transcode_cache=self.transcode_cache,
+                planning_executor=self.planning_executor,
+                probe_executor=self.probe_executor,
+                player_options=player_options_for(channel_number),
+            )
+            for channel_number in self.channel_numbers
+        ]
+
+    def run(self):
+        # Every channel runs its own loop on its own thread. They only sleep
+        # and wake on their own player's events.
+        threads = []
+        for director in self.directors:
+            director.vlc_controller.on_end_reached(director.react_to_vlc_media_player_end_reached_event)
+            director.play_next_video()
+            report_startup_time(director)
+            director.watchdog.start()
+            thread = threading.Thread(target=director.queue_fill_advance_and_sleep_loop, name=f'ch{director.channel_number}', daemon=True)
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('channel_numbers', nargs='*', help='Channels to run. Defaults to CHANNEL_NUMBERS (comma separated).')
+    args = parser.parse_args()
+    channel_numbers = args.channel_numbers or [number.strip() for number in os.getenv('CHANNEL_NUMBERS', '').split(',') if number.strip()]
+    if not channel_numbers:
+        parser.error('Give the channels to run, or set CHANNEL_NUMBERS.')
+
+    metrics_port = int(os.getenv('METRICS_PORT', DEFAULT_METRICS_PORT))
+    if metrics_port:
+        start_metrics_server(metrics_port)
+
+    MultiChannelRuntime(channel_numbers).run()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
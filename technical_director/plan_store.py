@@ -0,0 +1,151 @@
+import bisect
+import datetime
+import json
+import os
+import tempfile
+from decimal import Decimal
+from pathlib import Path
+
+from video import Video
+
+# Keys in a scheduling block that hold datetimes.
+BLOCK_DATETIME_KEYS = ('block_start', 'block_end')
+
+
+def default_plan_dir() -> Path:
+    return Path.home().joinpath('.mylittlecableco', 'technical_director', 'plans')
+
+
+def plan_store_from_environment():
+    # SAVE_PLANS=0 turns saved plans off.
+    return PlanStore(persist=os.getenv('SAVE_PLANS', '1') != '0')
+
+
+class PlanStore:
+    """
+    The plan the director is airing, kept on disk: every segment still to
+    come (and the one on now), when it's expected to air, and the scheduling
+    block it belongs to.
+
+    After a restart the director picks the plan up where the wall clock says
+    it should be, instead of planning the block over again. Everything needed
+    to play it is in the plan, so that happens without asking ffprobe or the
+    Scheduler anything.
+    """
+
+    def __init__(self, plan_dir=None, persist=True):
+        self.plan_dir = Path(plan_dir) if plan_dir else default_plan_dir()
+        self.persist = persist
+
+    def save(self, channel_number, planned_videos, now=None):
+        """
+        `planned_videos` is a list of (video, airs_at) tuples, in the order
+        they air.
+        """
+        if not self.persist:
+            return
+        blocks = []
+        block_indexes = {}
+        segments = []
+        for video, airs_at in planned_videos:
+            block_index = None
+            if video.scheduling_block is not None:
+                block_index = block_indexes.get(id(video.scheduling_block))
+                if block_index is None:
+                    block_index = block_indexes[id(video.scheduling_block)] = len(blocks)
+                    blocks.append(video.scheduling_block)
+            segments.append({
+                'file_path': video.file_path,
+                'batch_label': video.batch_label,
+                'label': video.label,
+                'commercial': video.is_commercial,
+                'start_at_second': video.start_at_second,
+                'end_at_second': video.end_at_second,
+                'duration_in_seconds': video.duration_in_seconds(),
+                'repeat_count': video.repeat_count,
+                'block': block_index,
+                'airs_at': airs_at,
+            })
+        self._write(self._plan_path(channel_number), {
+            'saved_at': now or datetime.datetime.now(),
+            'blocks': blocks,
+            'segments': segments,
+        })
+
+    def load(self, channel_number):
+        # Returns the saved plan as (video, airs_at) tuples, or None if there
+        # isn't a usable one.
+        if not self.persist:
+            return None
+        path = self._plan_path(channel_number)
+        try:
+            with open(path) as plan_file:
+                plan = json.load(plan_file)
+            blocks = []
+            for block in plan['blocks']:
+                for key in BLOCK_DATETIME_KEYS:
+                    block[key] = datetime.datetime.fromisoformat(block[key])
+                blocks.append(block)
+            planned_videos = []
+            for segment in plan['segments']:
+                video = Video.segment(
+                    segment['file_path'],
+                    segment['duration_in_seconds'],
+                    start_at_second=optional_decimal(segment['start_at_second']),
+                    end_at_second=optional_decimal(segment['end_at_second']),
+                    batch_label=segment['batch_label'],
+                    label=segment['label'],
+                    is_commercial=segment['commercial'],
+                    repeat_count=segment['repeat_count'],
+                )
+                if segment['block'] is not None:
+                    video.scheduling_block = blocks[segment['block']]
+                    video.block_end = video.scheduling_block['block_end']
+                planned_videos.append((video, datetime.datetime.fromisoformat(segment['airs_at'])))
+        except FileNotFoundError:
+            return None
+        except (KeyError, IndexError, TypeError, ValueError, OSError) as e:
+            print(f'Ignoring unreadable saved plan {path}: {e}')
+            return None
+        return planned_videos
+
+    def _plan_path(self, channel_number) -> Path:
+        return self.plan_dir / f'ch{channel_number}-plan.json'
+
+    def _write(self, path, payload):
+        # Same as the schedule snapshot: a temporary file renamed into place,
+        # so a power cut leaves the previous plan intact.
+        self.plan_dir.mkdir(parents=True, exist_ok=True)
+        descriptor, temporary_path = tempfile.mkstemp(dir=self.plan_dir, prefix=f'.{path.name}.', suffix='.tmp')
+        try:
+            with os.fdopen(descriptor, 'w') as temporary_file:
+                json.dump(payload, temporary_file, default=str)
+                temporary_file.flush()
+                os.fsync(temporary_file.fileno())
+            os.replace(temporary_path, path)
+        except BaseException:
+            try:
+                os.unlink(temporary_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+
+def resume_at(planned_videos, moment) -> list:
+    """
+    `planned_videos` is a list of (video, airs_at) tuples, in the order they
+    air. Returns what's left of it from `moment` on: the video that would be
+    on at `moment`, picked up partway through, and everything after it.
+    Empty if `moment` is outside the plan.
+    """
+    airtimes = [airs_at for _, airs_at in planned_videos]
+    index = bisect.bisect_right(airtimes, moment) - 1
+    if index < 0:
+        return []
+    video, airs_at = planned_videos[index]
+    offset = Decimal(str((moment - airs_at).total_seconds()))
+    return video.remainder_after(offset) + [video for video, _ in planned_videos[index + 1:]]
+
+
+def optional_decimal(value):
+    return None if value is None else Decimal(value)
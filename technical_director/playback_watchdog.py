@@ -0,0 +1,129 @@
+import threading
+
+from metrics import PLAYBACK_STALLS
+
+# How often we look at the player. Asking libvlc for its state and time is
+# cheap, so this can be often enough to notice a stall within seconds.
+WATCHDOG_INTERVAL_IN_SECONDS = 1
+
+# A position that hasn't moved for this long, while the player says it's
+# playing (or still opening or buffering), is a stall. Long enough that a
+# slow open from the NAS isn't one.
+FROZEN_AFTER_IN_SECONDS = 6
+
+# The player stopped, ended, paused or failed without telling us the media
+# ended, and stayed that way this long. Ended is what the player says for a
+# moment between every pair of videos, so it gets a little time to move on.
+WRONG_STATE_AFTER_IN_SECONDS = 3
+
+# States the player goes through on its way to playing.
+STARTING_STATES = ('opening', 'buffering')
+# States it should never be in for long while we're on the air.
+WRONG_STATES = ('paused', 'stopped', 'ended', 'error', 'idle')
+
+
+class PlaybackWatchdog:
+    """
+    Notices when playback has stalled and VLC isn't going to tell us: a file
+    it can't decode, or a read from the NAS that never comes back. In those
+    cases EndReached never fires and, left alone, the channel sits on a
+    frozen frame until the next restart.
+
+    `sample` looks at the player's state and position. A stall is an error
+    event from the player, a position that stops moving, or a state the
+    player shouldn't be in. The first time it sees one for the media that's
+    on, it calls `on_stall(reason, stalled_since)` and then stays quiet until
+    `watch` says the director put something new on the air. `on_stall` must
+    return quickly and not call the watchdog.
+
+    `start` samples on a background thread. The simulation and the benchmarks
+    call `sample` themselves, on their own clock.
+    """
+
+    def __init__(self, vlc_controller, clock, on_stall, interval_in_seconds=WATCHDOG_INTERVAL_IN_SECONDS,
+                 frozen_after_in_seconds=FROZEN_AFTER_IN_SECONDS, wrong_state_after_in_seconds=WRONG_STATE_AFTER_IN_SECONDS,
+                 metric_labels=None):
+        self.vlc_controller = vlc_controller
+        self.clock = clock
+        self.on_stall = on_stall
+        self.interval_in_seconds = interval_in_seconds
+        self.frozen_after_in_seconds = frozen_after_in_seconds
+        self.wrong_state_after_in_seconds = wrong_state_after_in_seconds
+        self.metric_labels = metric_labels or {}
+
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self.watch()
+
+    def watch(self):
+        # The director just handed the player something new. Start over.
+        with self._lock:
+            self.last_position = None
+            self.last_progress_at = self.clock.now()
+            self.wrong_state_since = None
+            self.error_reported_at = None
+            self.stalled = False
+
+    def react_to_error_event(self, event):
+        # Runs on VLC's event thread, so it only takes note. The next sample
+        # reports it.
+        self.error_reported_at = self.clock.now()
+
+    def sample(self):
+        """
+        Look at the player once. Returns the reason if this sample found a
+        stall, otherwise None.
+        """
+        with self._lock:
+            if self.stalled:
+                # Already reported, waiting for the director to do something
+                # about it.
+                return None
+            now = self.clock.now()
+            state = self.vlc_controller.state()
+            position = self.vlc_controller.position_in_seconds()
+            reason = None
+            stalled_since = now
+            if self.error_reported_at is not None or state == 'error':
+                reason = 'error'
+                stalled_since = self.error_reported_at or now
+            elif state in WRONG_STATES:
+                if self.wrong_state_since is None:
+                    self.wrong_state_since = now
+                elif (now - self.wrong_state_since).total_seconds() >= self.wrong_state_after_in_seconds:
+                    reason = state
+                    stalled_since = self.wrong_state_since
+            else:
+                self.wrong_state_since = None
+                if position != self.last_position:
+                    self.last_position = position
+                    self.last_progress_at = now
+                elif (now - self.last_progress_at).total_seconds() >= self.frozen_after_in_seconds:
+                    reason = 'frozen' if state not in STARTING_STATES else 'stuck_' + state
+                    stalled_since = self.last_progress_at
+            if reason is None:
+                return None
+            self.stalled = True
+            PLAYBACK_STALLS.inc(reason=reason, **self.metric_labels)
+            # Still holding the lock, so a `watch` for new media can't slip in
+            # between noticing this stall and reporting it.
+            self.on_stall(reason, stalled_since)
+        return reason
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._sample_loop, name='playback-watchdog', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _sample_loop(self):
+        while not self._stop.wait(self.interval_in_seconds):
+            try:
+                self.sample()
+            except Exception as e:
+                # The watchdog going down would leave nobody watching.
+                print(f'Playback watchdog could not sample the player: {e}')
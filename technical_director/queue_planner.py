@@ -0,0 +1,84 @@
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from metrics import FEED_QUEUE_DURATION_SECONDS
+from video import Video
+
+# ffprobe runs in a subprocess and the rest is network I/O, so threads are
+# plenty. A handful keeps a Pi 3B+ (and the NAS) from being swamped.
+DEFAULT_PROBE_WORKERS = 4
+
+
+class QueuePlanner:
+    """
+    Plans the next scheduling block on a worker thread so the playback loop
+    never waits on the Scheduler, ffprobe, or commercial break assembly.
+
+    `plan` is called with the time the block should start and returns the
+    videos to queue. It can have the files it's about to plan with probed all
+    at once with `load_metadata`. `deliver` is called with the videos once
+    every one of them knows its duration, and is expected to add them to the
+    queue in one go.
+
+    With `synchronous=True` planning happens right in `request`, which is
+    what a simulation wants.
+
+    Several channels can share one `planning_executor` and one
+    `probe_executor`. Each planner still only ever has one plan in flight.
+    """
+
+    def __init__(self, plan, deliver, probe_workers=DEFAULT_PROBE_WORKERS, probe_executor=None, synchronous=False,
+                 planning_executor=None, metric_labels=None):
+        self.plan = plan
+        self.deliver = deliver
+        self.synchronous = synchronous
+        self.metric_labels = metric_labels or {}
+        self._planning_executor = planning_executor or ThreadPoolExecutor(max_workers=1, thread_name_prefix='planner')
+        self.probe_executor = probe_executor or ThreadPoolExecutor(max_workers=probe_workers, thread_name_prefix='probe')
+        self._in_flight = None
+
+    def busy(self) -> bool:
+        return self._in_flight is not None and not self._in_flight.done()
+
+    def request(self, time_at_queue_completion) -> bool:
+        """
+        Start planning the block for `time_at_queue_completion` unless a plan
+        is already being built. Returns immediately either way.
+        """
+        if self.synchronous:
+            self._plan_and_deliver(time_at_queue_completion)
+            return True
+        if self.busy():
+            return False
+        self._in_flight = self._planning_executor.submit(self._plan_and_deliver, time_at_queue_completion)
+        return True
+
+    def _plan_and_deliver(self, time_at_queue_completion):
+        try:
+            with FEED_QUEUE_DURATION_SECONDS.time(**self.metric_labels):
+                videos = self.plan(time_at_queue_completion)
+                self.warm_metadata(videos)
+            self.deliver(videos)
+        except Exception as e:
+            # The loop will ask again, and the queue still has time in it.
+            print(f'Planning the block at {time_at_queue_completion} failed: {e}')
+
+    def load_metadata(self, file_paths) -> dict:
+        # Start probing every one of `file_paths` at the same time. Returns
+        # file path -> future; once a future is done, the file's metadata is
+        # in the metadata cache.
+        return {file_path: self.probe_executor.submit(Video(file_path).video_information) for file_path in dict.fromkeys(file_paths)}
+
+    def warm_metadata(self, videos):
+        # Anything in the plan that still can't say how long it is without
+        # ffprobe gets probed now, all at once, so nothing is probed on the
+        # playback thread later. Commercials (the catalog has their length),
+        # dead air, and chapters of a feature are skipped.
+        first_video_for_file = {}
+        for video in videos:
+            if video.duration_needs_probe():
+                first_video_for_file.setdefault(video.file_path, video)
+        futures = [self.probe_executor.submit(video.duration_in_seconds) for video in first_video_for_file.values()]
+        wait(futures)
+        for future in futures:
+            if future.exception() is not None:
+                print(f'Could not load video information: {future.exception()}')
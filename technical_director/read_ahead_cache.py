@@ -0,0 +1,184 @@
+import hashlib
+import os
+import queue
+import shutil
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+# How much local storage the staged copies may use.
+DEFAULT_BUDGET_IN_BYTES = 4 * 1024 * 1024 * 1024
+
+# How far ahead of the play head we stage files, counted in queue entries.
+DEFAULT_LOOKAHEAD_COUNT = 12
+
+# Big sequential reads are what a NAS over CIFS is good at.
+COPY_BUFFER_SIZE_IN_BYTES = 8 * 1024 * 1024
+
+
+def default_read_ahead_dir() -> Path:
+    return Path.home().joinpath('.mylittlecableco', 'technical_director', 'read_ahead')
+
+
+class ReadAheadCache:
+    """
+    Copies the files that are about to air off the NAS onto local storage, on
+    a background thread, so a slow NAS or a Wi-Fi blip in the middle of a
+    program doesn't drop frames.
+
+    Staged copies are named after the source's path, size, and modification
+    time, and are evicted least-recently-used first once they exceed the byte
+    budget. Files that are coming up in the queue are never evicted.
+    """
+
+    def __init__(self, cache_dir=None, budget_in_bytes=DEFAULT_BUDGET_IN_BYTES, lookahead_count=DEFAULT_LOOKAHEAD_COUNT):
+        self.cache_dir = Path(cache_dir) if cache_dir else default_read_ahead_dir()
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.budget_in_bytes = budget_in_bytes
+        self.lookahead_count = lookahead_count
+
+        self._lock = threading.Lock()
+        # Staged file name -> size in bytes, least recently used first.
+        self._staged = OrderedDict()
+        # Source path -> staged file name, for what we've staged this run.
+        self._names_by_source = {}
+        # Who asked (a channel) -> the files coming up for them.
+        self._pinned_by_owner = {}
+        self._pending = queue.Queue()
+        self._queued_sources = set()
+
+        self._load_existing()
+        self._worker = threading.Thread(target=self._stage_loop, name='read-ahead', daemon=True)
+        self._worker.start()
+
+    def local_path_for(self, file_path):
+        """
+        The local copy of `file_path` if we have one, otherwise None.
+
+        This is asked on the playback thread, so it only looks at what's in
+        memory and never touches the NAS. A copy left by an earlier run is
+        found again when `stage_upcoming` asks for the file.
+        """
+        with self._lock:
+            name = self._names_by_source.get(file_path)
+            if name is None or name not in self._staged:
+                return None
+            self._staged.move_to_end(name)
+        local_path = self.cache_dir / name
+        # Touch it so the least-recently-used order survives a restart.
+        try:
+            os.utime(local_path)
+        except FileNotFoundError:
+            return None
+        return str(local_path)
+
+    def stage_upcoming(self, file_paths, owner=None):
+        """
+        Stage the next few of `file_paths` (in play order). Only the first
+        `lookahead_count` distinct files are considered, and those are
+        protected from eviction until the next call with the same `owner`.
+        Channels sharing the cache each pass their own.
+        """
+        upcoming = []
+        for file_path in file_paths:
+            if file_path not in upcoming:
+                upcoming.append(file_path)
+            if len(upcoming) >= self.lookahead_count:
+                break
+        with self._lock:
+            self._pinned_by_owner[owner] = set(upcoming)
+            for file_path in upcoming:
+                if file_path in self._names_by_source or file_path in self._queued_sources:
+                    continue
+                self._queued_sources.add(file_path)
+                self._pending.put(file_path)
+
+    def _stage_loop(self):
+        while True:
+            file_path = self._pending.get()
+            try:
+                self._stage(file_path)
+            except Exception as e:
+                print(f'Could not stage {file_path} locally: {e}')
+            finally:
+                with self._lock:
+                    self._queued_sources.discard(file_path)
+                self._pending.task_done()
+
+    def join(self):
+        # Wait until everything asked for so far is staged, or given up on.
+        self._pending.join()
+
+    def _stage(self, file_path):
+        name = self._staged_name(file_path)
+        if name is None:
+            return
+        with self._lock:
+            if name in self._staged:
+                self._names_by_source[file_path] = name
+                return
+            if not any(file_path in pinned for pinned in self._pinned_by_owner.values()):
+                # It aired (or was dropped from the queue) before we got to it.
+                return
+        size = os.stat(file_path).st_size
+        if not self._make_room(size):
+            # What's coming up already fills the budget. This one plays
+            # from the NAS.
+            return
+
+        # Copy to a temporary name and rename, so a half-copied file is
+        # never mistaken for a staged one.
+        destination = self.cache_dir / name
+        partial = self.cache_dir / f'{name}.partial'
+        with open(file_path, 'rb') as source, open(partial, 'wb') as target:
+            shutil.copyfileobj(source, target, COPY_BUFFER_SIZE_IN_BYTES)
+        os.replace(partial, destination)
+
+        with self._lock:
+            self._staged[name] = size
+            self._names_by_source[file_path] = name
+
+    def _make_room(self, incoming_size) -> bool:
+        # Evict unpinned copies, least recently used first, until
+        # `incoming_size` more fits in the budget. Returns whether it does.
+        # If it can't fit even with nothing else left, nothing is evicted.
+        with self._lock:
+            used = sum(self._staged.values())
+            pinned_names = {self._names_by_source.get(file_path) for pinned in self._pinned_by_owner.values() for file_path in pinned}
+            pinned_used = sum(size for name, size in self._staged.items() if name in pinned_names)
+            if pinned_used + incoming_size > self.budget_in_bytes:
+                return False
+            for name in list(self._staged):
+                if used + incoming_size <= self.budget_in_bytes:
+                    break
+                if name in pinned_names:
+                    continue
+                used -= self._staged.pop(name)
+                self._names_by_source = {source: staged for source, staged in self._names_by_source.items() if staged != name}
+                try:
+                    (self.cache_dir / name).unlink()
+                except FileNotFoundError:
+                    pass
+            return used + incoming_size <= self.budget_in_bytes
+
+    def _load_existing(self):
+        # Pick up what previous runs staged, oldest first, and throw away any
+        # copy that was interrupted.
+        entries = []
+        for path in self.cache_dir.iterdir():
+            if path.name.endswith('.partial'):
+                path.unlink()
+                continue
+            stat_result = path.stat()
+            entries.append((stat_result.st_mtime, path.name, stat_result.st_size))
+        for _, name, size in sorted(entries):
+            self._staged[name] = size
+
+    @staticmethod
+    def _staged_name(file_path):
+        try:
+            stat_result = os.stat(file_path)
+        except OSError:
+            return None
+        identity = f'{file_path}|{stat_result.st_size}|{stat_result.st_mtime_ns}'
+        return hashlib.sha1(identity.encode('UTF-8')).hexdigest() + Path(file_path).suffix
@@ -0,0 +1,106 @@
+import datetime
+import json
+import os
+import tempfile
+from pathlib import Path
+
+# How many days of lineup we keep on disk.
+DEFAULT_SNAPSHOT_DAYS = 3
+
+
+def default_snapshot_dir() -> Path:
+    return Path.home().joinpath('.mylittlecableco', 'technical_director', 'snapshots')
+
+
+def snapshot_from_environment():
+    # SNAPSHOT_DAYS=0 turns snapshots off.
+    days = int(os.getenv('SNAPSHOT_DAYS', DEFAULT_SNAPSHOT_DAYS))
+    return ScheduleSnapshot(days=days) if days > 0 else None
+
+
+class ScheduleSnapshot:
+    """
+    The last lineup and commercial catalog we got from the Scheduler, kept on
+    disk. On boot we can start playing from it without waiting for the
+    Scheduler, and when the Scheduler is unreachable we keep airing what it
+    last told us instead of dead air.
+
+    Files are written to a temporary name and renamed into place, so a power
+    cut mid-write leaves the previous snapshot intact.
+    """
+
+    def __init__(self, snapshot_dir=None, days=DEFAULT_SNAPSHOT_DAYS):
+        self.snapshot_dir = Path(snapshot_dir) if snapshot_dir else default_snapshot_dir()
+        self.days = days
+
+    def save_lineup(self, channel_number, listings, now=None):
+        """
+        `listings` is a list of (start_time, end_time, listing) tuples. Only
+        the ones that haven't ended yet and start within the next `days` days
+        are kept.
+
+        Unlike the commercial catalog, the lineup is saved without its ETag
+        and Last-Modified. Those describe the whole lineup, not the slice of
+        it we keep, and asking the Scheduler with them after a restart would
+        get a 304 and leave us with only the slice.
+        """
+        now = now or datetime.datetime.now()
+        horizon = now + datetime.timedelta(days=self.days)
+        lineup = [listing for start_time, end_time, listing in listings if end_time > now and start_time < horizon]
+        self._write(self._lineup_path(channel_number), {
+            'saved_at': now.isoformat(),
+            'lineup': lineup,
+        })
+
+    def load_lineup(self, channel_number):
+        # Returns the saved listings, or None if there's no usable snapshot
+        # for this channel.
+        snapshot = self._read(self._lineup_path(channel_number))
+        if snapshot is None:
+            return None
+        return snapshot['lineup']
+
+    def save_commercials(self, commercials, etag=None, last_modified=None):
+        self._write(self.snapshot_dir / 'commercials.json', {
+            'saved_at': datetime.datetime.now().isoformat(),
+            'etag': etag,
+            'last_modified': last_modified,
+            'commercials': commercials,
+        })
+
+    def load_commercials(self):
+        # Returns (commercials, etag, last_modified), or None.
+        snapshot = self._read(self.snapshot_dir / 'commercials.json')
+        if snapshot is None:
+            return None
+        return snapshot['commercials'], snapshot.get('etag'), snapshot.get('last_modified')
+
+    def _lineup_path(self, channel_number) -> Path:
+        return self.snapshot_dir / f'ch{channel_number}-lineup.json'
+
+    def _write(self, path, payload):
+        self.snapshot_dir.mkdir(parents=True, exist_ok=True)
+        descriptor, temporary_path = tempfile.mkstemp(dir=self.snapshot_dir, prefix=f'.{path.name}.', suffix='.tmp')
+        try:
+            with os.fdopen(descriptor, 'w') as temporary_file:
+                json.dump(payload, temporary_file)
+                temporary_file.flush()
+                os.fsync(temporary_file.fileno())
+            os.replace(temporary_path, path)
+        except BaseException:
+            try:
+                os.unlink(temporary_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path) as snapshot_file:
+                return json.load(snapshot_file)
+        except FileNotFoundError:
+            return None
+        except (ValueError, OSError) as e:
+            print(f'Ignoring unreadable snapshot {path}: {e}')
+            return None
@@ -1,40 +1,291 @@
+import bisect
+import datetime
 import os
+import threading
+import time
 
-import arrow
-import requests
+from metrics import SCHEDULER_REQUEST_DURATION_SECONDS, SCHEDULER_REQUEST_ERRORS
+
+# (connect, read) timeouts in seconds. A hung Scheduler must never freeze the
+# playback loop, so we give up quickly and fall back on what we have.
+DEFAULT_TIMEOUT = (3.05, 10)
+
+# How long a downloaded lineup is trusted before we ask the Scheduler whether
+# it changed.
+DEFAULT_SCHEDULE_TTL_IN_SECONDS = 5 * 60
+
+# If somebody asks about a time past the end of the lineup we have, we refetch
+# in case the lineup grew, but not more often than this.
+MINIMUM_REFETCH_INTERVAL_IN_SECONDS = 30
+
+# A lineup snapshot only holds the next few days, so even when the lineup
+# hasn't changed we save it again now and then to keep those days ahead of us.
+SNAPSHOT_RESAVE_INTERVAL_IN_SECONDS = 60 * 60
+
+
+def new_session():
+    # requests (and arrow, below) take a good while to import on a Pi, so
+    # they're imported when first needed instead of before the first picture.
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def parse_scheduler_time(timestamp):
+    # Warning!! We ignore timezones. Make sure the timezone of your
+    # technical director and your scheduler match!!
+    try:
+        # The Scheduler sends ISO 8601, which the standard library reads.
+        return datetime.datetime.fromisoformat(timestamp).replace(tzinfo=None)
+    except (TypeError, ValueError):
+        import arrow
+        return arrow.get(timestamp).datetime.replace(tzinfo=None)
+
+
+class ChannelSchedule:
+    """
+    One channel's lineup, parsed once and indexed by start time so that a
+    lookup is a dictionary access instead of a scan of the whole lineup.
+
+    The start times are also kept sorted, so finding the listing on at any
+    moment (not just on a half hour), or every listing in a range of time,
+    is a binary search.
+    """
+
+    def __init__(self, lineup, etag=None, last_modified=None):
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetched_at = time.monotonic()
+        self.blocks_by_start = {}
+        self.covers_until = None
+        # (start_time, end_time, listing) for every listing, as we got it.
+        self.listings = []
+        for listing in lineup:
+            start_time = parse_scheduler_time(listing['start_time'])
+            end_time = parse_scheduler_time(listing['end_time'])
+            self.listings.append((start_time, end_time, listing))
+            self.blocks_by_start[start_time] = {
+                'label': listing['title'],
+                'listing_id': listing.get('listing_id'),
+                'file_path': listing.get('file_path'),
+                'show_commercials': True,
+                'block_start': start_time,
+                'block_end': end_time,
+                'block_duration_in_minutes': int((end_time - start_time).total_seconds() / 60),
+            }
+            if self.covers_until is None or end_time > self.covers_until:
+                self.covers_until = end_time
+        self.block_starts = sorted(self.blocks_by_start)
+
+    def age_in_seconds(self):
+        return time.monotonic() - self.fetched_at
+
+    def block_starting_at(self, querytime):
+        block_data = self.blocks_by_start.get(querytime)
+        # Hand out a copy, callers are allowed to modify what they get.
+        return dict(block_data) if block_data is not None else None
+
+    def block_at(self, moment):
+        # The block on the air at `moment`, however long it is and whenever
+        # it started, or None if nothing is scheduled then.
+        index = bisect.bisect_right(self.block_starts, moment) - 1
+        if index < 0:
+            return None
+        block_data = self.blocks_by_start[self.block_starts[index]]
+        return dict(block_data) if moment < block_data['block_end'] else None
+
+    def blocks_between(self, start, end):
+        # Every block on the air at some point from `start` up to `end`, in
+        # order.
+        index = max(bisect.bisect_right(self.block_starts, start) - 1, 0)
+        blocks = []
+        while index < len(self.block_starts) and self.block_starts[index] < end:
+            block_data = self.blocks_by_start[self.block_starts[index]]
+            if block_data['block_end'] > start:
+                blocks.append(dict(block_data))
+            index += 1
+        return blocks
 
 
 class SchedulerClient:
-    def __init__(self):
+    def __init__(self, session=None, timeout=DEFAULT_TIMEOUT, schedule_ttl_in_seconds=DEFAULT_SCHEDULE_TTL_IN_SECONDS, snapshot=None):
         self.scheduler_url = os.getenv('SCHEDULER_URL')
         if self.scheduler_url is None:
             raise RuntimeError('SCHEDULER_URL not found in ENV. Example: "export SCHEDULER_URL=http://mlcc-03.local"')
+        # Made on the first request, see `new_session`.
+        self._session = session
+        self._session_lock = threading.Lock()
+        self.timeout = timeout
+        self.schedule_ttl_in_seconds = schedule_ttl_in_seconds
+        self._schedules = {}
+        self._schedules_lock = threading.Lock()
+
+        # Optional on-disk copy of each lineup (a ScheduleSnapshot), for cold
+        # starts and Scheduler outages.
+        self.snapshot = snapshot
+        # Channel number -> when we last saved its snapshot (time.monotonic).
+        self._snapshot_saved_at = {}
+        self._refresh_thread = None
+        self._refresh_now = threading.Event()
+        self._stop_refreshing = threading.Event()
+
+    @property
+    def session(self):
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    self._session = new_session()
+        return self._session
+
+    def get(self, path, headers=None):
+        session = self.session
+        from requests import RequestException
+        try:
+            with SCHEDULER_REQUEST_DURATION_SECONDS.time(endpoint=path):
+                response = session.get(f'{self.scheduler_url}{path}', headers=headers, timeout=self.timeout)
+        except RequestException:
+            SCHEDULER_REQUEST_ERRORS.inc(endpoint=path)
+            raise
+        if response.status_code >= 400:
+            SCHEDULER_REQUEST_ERRORS.inc(endpoint=path)
+        return response
 
     def get_all_commercials(self):
-        response = requests.get(f'{self.scheduler_url}/commercials.json')
+        response = self.get('/commercials.json')
         response.raise_for_status()
         commercials = response.json()
         return commercials
 
-    def whats_on(self, channel_number, querytime):
-        channel_schedule = requests.get(f'{self.scheduler_url}/channels/ch{channel_number}/schedule.json')
-        target_listing = None
-        for listing in channel_schedule.json()['lineup']:
-            # Warning!! We ignore timezones. Make sure the timezone of your
-            # technical director and your scheduler match!!
-            listing_start_time = arrow.get(listing['start_time']).datetime.replace(tzinfo=None)
-            if(querytime == listing_start_time):
-                target_listing = listing
-        if target_listing is None:
+    def get_all_commercials_if_modified(self, etag=None, last_modified=None):
+        # Returns (commercials, etag, last_modified). `commercials` is None if
+        # the Scheduler says the catalog hasn't changed since we last saw it.
+        response = self.get('/commercials.json', headers=conditional_headers(etag, last_modified))
+        if response.status_code == 304:
+            return None, etag, last_modified
+        response.raise_for_status()
+        return response.json(), response.headers.get('ETag'), response.headers.get('Last-Modified')
+
+    def channel_schedule(self, channel_number, querytime=None) -> ChannelSchedule:
+        with self._schedules_lock:
+            schedule = self._schedules.get(channel_number)
+            if schedule is None:
+                schedule = self._load_snapshot(channel_number)
+        if not self._should_refetch(schedule, querytime):
+            return schedule
+        try:
+            return self.refresh_channel_schedule(channel_number)
+        except Exception:
+            if schedule is None:
+                raise
+            # Keep serving the lineup we already have.
+            print(f'Could not refresh the schedule for channel {channel_number}, using the copy we have.')
+            return schedule
+
+    def refresh_channel_schedule(self, channel_number) -> ChannelSchedule:
+        with self._schedules_lock:
+            previous_schedule = self._schedules.get(channel_number)
+        # The request happens outside the lock, so a slow Scheduler only holds
+        # up whoever is waiting on this channel's lineup.
+        schedule = self._fetch_channel_schedule(channel_number, previous_schedule)
+        with self._schedules_lock:
+            self._schedules[channel_number] = schedule
+        if self.snapshot is not None:
+            saved_at = self._snapshot_saved_at.get(channel_number)
+            if schedule is not previous_schedule or saved_at is None or time.monotonic() - saved_at > SNAPSHOT_RESAVE_INTERVAL_IN_SECONDS:
+                self.snapshot.save_lineup(channel_number, schedule.listings)
+                self._snapshot_saved_at[channel_number] = time.monotonic()
+        return schedule
+
+    def start_background_refresh(self, interval_in_seconds=None):
+        # Keep every lineup we've looked at fresh (and its snapshot current)
+        # without anybody having to wait on the Scheduler for it.
+        if self._refresh_thread is not None:
+            return
+        interval_in_seconds = interval_in_seconds or self.schedule_ttl_in_seconds * 0.8
+        self._refresh_thread = threading.Thread(target=self._refresh_loop, args=(interval_in_seconds,), name='schedule-refresh', daemon=True)
+        self._refresh_thread.start()
+
+    def stop_background_refresh(self):
+        self._stop_refreshing.set()
+        self._refresh_now.set()
+
+    def _refresh_loop(self, interval_in_seconds):
+        while True:
+            self._refresh_now.wait(interval_in_seconds)
+            self._refresh_now.clear()
+            if self._stop_refreshing.is_set():
+                return
+            with self._schedules_lock:
+                channel_numbers = list(self._schedules)
+            for channel_number in channel_numbers:
+                try:
+                    self.refresh_channel_schedule(channel_number)
+                except Exception as e:
+                    print(f'Background refresh of the channel {channel_number} schedule failed: {e}')
+
+    def _load_snapshot(self, channel_number):
+        # Must be called with the lock held.
+        if self.snapshot is None:
+            return None
+        lineup = self.snapshot.load_lineup(channel_number)
+        if lineup is None:
             return None
-        start_time = arrow.get(target_listing['start_time']).datetime.replace(tzinfo=None)
-        end_time = arrow.get(target_listing['end_time']).datetime.replace(tzinfo=None)
-        block_data = {
-            'label': target_listing['title'],
-            'listing_id': target_listing.get('listing_id'),
-            'file_path': target_listing.get('file_path'),
-            'show_commercials': True,
-            'block_start': start_time,
-            'block_duration_in_minutes': int((end_time - start_time).seconds / 60),
-        }
-        return block_data
+        # No ETag or Last-Modified, so the first request after this gets the
+        # whole lineup rather than a 304 for the few days we saved.
+        schedule = ChannelSchedule(lineup)
+        self._schedules[channel_number] = schedule
+        print(f'Loaded the channel {channel_number} lineup from the snapshot, checking it against the Scheduler in the background.')
+        # The snapshot counts as fresh so nobody waits on the Scheduler, but
+        # we reconcile it right away.
+        self._refresh_now.set()
+        return schedule
+
+    def whats_on(self, channel_number, querytime):
+        return self.channel_schedule(channel_number, querytime).block_starting_at(querytime)
+
+    def blocks_between(self, channel_number, start, end):
+        # One lineup lookup covers hours of planning. The last moment of the
+        # range decides whether the lineup we have reaches far enough.
+        return self.channel_schedule(channel_number, end - datetime.timedelta(microseconds=1)).blocks_between(start, end)
+
+    def cached_channel_schedule(self, channel_number):
+        # Whatever we have in memory right now, never a request.
+        with self._schedules_lock:
+            return self._schedules.get(channel_number)
+
+    def _should_refetch(self, schedule, querytime):
+        if schedule is None:
+            return True
+        if schedule.age_in_seconds() > self.schedule_ttl_in_seconds:
+            return True
+        beyond_known_lineup = querytime is not None and (schedule.covers_until is None or querytime >= schedule.covers_until)
+        return beyond_known_lineup and schedule.age_in_seconds() > MINIMUM_REFETCH_INTERVAL_IN_SECONDS
+
+    def _fetch_channel_schedule(self, channel_number, previous_schedule):
+        etag = previous_schedule.etag if previous_schedule else None
+        last_modified = previous_schedule.last_modified if previous_schedule else None
+        response = self.get(f'/channels/ch{channel_number}/schedule.json', headers=conditional_headers(etag, last_modified))
+        if response.status_code == 304 and previous_schedule is not None:
+            # The lineup hasn't changed, so there's nothing to re-parse.
+            previous_schedule.fetched_at = time.monotonic()
+            return previous_schedule
+        response.raise_for_status()
+        return ChannelSchedule(
+            response.json()['lineup'],
+            etag=response.headers.get('ETag'),
+            last_modified=response.headers.get('Last-Modified'),
+        )
+
+
+def conditional_headers(etag=None, last_modified=None) -> dict:
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    return headers
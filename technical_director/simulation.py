@@ -0,0 +1,250 @@
+"""
+Run the director against a virtual clock and a simulated player, to check a
+channel's programming without waiting for it to air.
+
+    SCHEDULER_URL=http://mlcc-03.local:3000 poetry run python technical_director/simulation.py \
+        --channel 7 --start 2026-10-19T06:00 --hours 168 --as-run week.jsonl
+
+The real planning code runs (feed_queue, commercial breaks, drift
+correction); only playback is simulated. Each video "plays" for exactly its
+duration, plus an optional gap between videos. With --stall-every the player
+stalls halfway through every so many segments, alternately freezing and
+failing, so the watchdog and the director's recovery get exercised too. By
+default the simulation runs as fast as it can. Use --speed to pace it against the wall clock instead
+(--speed 1000 plays an hour in 3.6 seconds).
+"""
+import argparse
+import cProfile
+import datetime
+import json
+import os
+import pstats
+import time
+from decimal import Decimal
+
+from as_run_log import AsRunLog
+from clock import VirtualClock
+from commercial_rotation import CommercialRotation
+from plan_store import PlanStore
+from playback_watchdog import WATCHDOG_INTERVAL_IN_SECONDS
+from technical_director import TechnicalDirector
+
+# What a simulated stall looks like, taking turns: the picture freezes, or
+# the player gives up on the media.
+STALL_KINDS = ('frozen', 'error')
+
+
+class SimulatedMedia:
+    def __init__(self, file_path, start_at_second=None, end_at_second=None, repeat_count=0):
+        self.file_path = file_path
+        self.start_at_second = start_at_second
+        self.end_at_second = end_at_second
+        self.repeat_count = repeat_count
+
+    def parse_with_options(self, flags, timeout):
+        pass
+
+
+class SimulatedVLCController:
+    """
+    Stands in for VLCController. Nothing is decoded, it just remembers what it
+    was asked to play and when, and reports positions off the virtual clock.
+    `stall` makes it stop partway through, the way a bad file or a lost NAS
+    read would.
+    """
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.current_media = None
+        self.started_at = None
+        self.prepared_media = None
+        self.prepared_key = None
+        self.end_reached_callback = None
+        self.error_callback = None
+        self.transition_latencies_in_seconds = []
+        self.last_transition_latency_in_seconds = None
+        # Set by `stall`, cleared by the next `play`.
+        self.stalled_position = None
+        self.failed = False
+
+    def play(self):
+        self.started_at = self.clock.now()
+        self.stalled_position = None
+        self.failed = False
+
+    def set_media(self, media):
+        self.current_media = media
+
+    def position_in_seconds(self):
+        if self.stalled_position is not None:
+            return self.stalled_position
+        if self.current_media is None or self.started_at is None:
+            return None
+        elapsed = Decimal(str((self.clock.now() - self.started_at).total_seconds()))
+        return Decimal(self.current_media.start_at_second or 0) + elapsed
+
+    def state(self):
+        if self.failed:
+            return 'error'
+        return 'idle' if self.started_at is None else 'playing'
+
+    def on_error(self, callback):
+        self.error_callback = callback
+
+    def stall(self, kind):
+        if kind == 'error':
+            self.failed = True
+            if self.error_callback is not None:
+                self.error_callback(None)
+        else:
+            self.stalled_position = self.position_in_seconds()
+
+    def on_end_reached(self, callback):
+        self.end_reached_callback = callback
+
+    def reach_end(self):
+        if self.end_reached_callback is not None:
+            self.end_reached_callback(None)
+
+    def media_for(self, file_path, start_at_second=None, end_at_second=None, repeat_count=0):
+        return SimulatedMedia(file_path, start_at_second, end_at_second, repeat_count)
+
+    def prepare(self, file_path, start_at_second=None, end_at_second=None, repeat_count=0):
+        self.prepared_key = (file_path, start_at_second, end_at_second, repeat_count)
+        self.prepared_media = self.media_for(file_path, start_at_second, end_at_second, repeat_count)
+
+    def take_prepared_media(self, file_path, start_at_second=None, end_at_second=None, repeat_count=0):
+        media = self.prepared_media if self.prepared_key == (file_path, start_at_second, end_at_second, repeat_count) else None
+        self.prepared_media = None
+        self.prepared_key = None
+        return media
+
+
+class Simulation:
+    def __init__(self, channel_number, start, as_run_path, speed=0, gap_in_seconds=0, stall_every=0):
+        self.clock = VirtualClock(start)
+        self.player = SimulatedVLCController(self.clock)
+        self.speed = speed
+        self.gap_in_seconds = Decimal(str(gap_in_seconds))
+        self.stall_every = stall_every
+        self.as_run_log = AsRunLog(as_run_path)
+        self.director = TechnicalDirector(
+            channel_number=channel_number,
+            vlc_controller=self.player,
+            clock=self.clock,
+            plan_in_background=False,
+            read_ahead_budget_in_gb=0,
+            rendition_budget_in_gb=0,
+            # Simulated airings stay out of the real rotation history.
+            commercial_rotation=CommercialRotation(persist=False),
+            # The director writes the as-run log itself, on the virtual clock.
+            as_run_log=self.as_run_log,
+            plan_store=PlanStore(persist=False),
+        )
+        self.player.on_end_reached(self.director.react_to_vlc_media_player_end_reached_event)
+
+        self.segment_count = 0
+        self.segments_started = 0
+        self.time_to_recovery_in_seconds = []
+        self.dead_air_incidents = 0
+        self.dead_air_seconds = Decimal(0)
+        # Block end -> how late (or early, if negative) it actually ended.
+        self.block_drift_in_seconds = {}
+
+    def run(self, hours):
+        end = self.clock.now() + datetime.timedelta(hours=hours)
+        self.director.play_next_video()
+        while self.clock.now() < end:
+            video = self.director.current_video
+            started = self.director.current_video_started
+            duration = Decimal(video.duration_in_seconds())
+            ended = started + datetime.timedelta(seconds=float(duration))
+            self.segments_started += 1
+            if self.stall_every and self.segments_started % self.stall_every == 0:
+                # This one doesn't make it to the end. Whatever the director
+                # puts on instead is the next segment.
+                halfway = started + datetime.timedelta(seconds=float(duration) / 2)
+                self.pace(halfway - self.clock.now())
+                self.clock.advance_to(halfway)
+                self.stall_and_recover()
+                continue
+            self.pace(ended - self.clock.now())
+            self.clock.advance_to(ended)
+            self.record(video, started, ended, duration)
+
+            self.player.reach_end()
+            if self.gap_in_seconds:
+                self.clock.advance(self.gap_in_seconds)
+            self.director.run_loop_iteration()
+        self.as_run_log.close()
+
+    def stall_and_recover(self):
+        # The watchdog saw it playing fine right up to the stall.
+        self.director.watchdog.sample()
+        self.player.stall(STALL_KINDS[len(self.time_to_recovery_in_seconds) % len(STALL_KINDS)])
+        while self.director.stall_reason is None:
+            self.clock.advance(WATCHDOG_INTERVAL_IN_SECONDS)
+            self.director.watchdog.sample()
+        self.director.run_loop_iteration()
+        self.time_to_recovery_in_seconds.append(self.director.last_time_to_recovery_in_seconds)
+
+    def pace(self, virtual_duration):
+        if self.speed:
+            time.sleep(max(virtual_duration.total_seconds(), 0) / self.speed)
+
+    def record(self, video, started, ended, duration):
+        self.segment_count += 1
+        dead_air = video.label == 'Dead Air'
+        if dead_air:
+            self.dead_air_incidents += 1
+            self.dead_air_seconds += duration
+        if video.block_end is not None:
+            # The last segment of a block to air decides when it ended.
+            self.block_drift_in_seconds[video.block_end] = (ended - video.block_end).total_seconds()
+
+    def report(self) -> dict:
+        drifts = list(self.block_drift_in_seconds.values())
+        return {
+            'segments': self.segment_count,
+            'blocks': len(drifts),
+            'dead_air_incidents': self.dead_air_incidents,
+            'dead_air_seconds': float(self.dead_air_seconds),
+            'mean_abs_block_drift_seconds': sum(abs(drift) for drift in drifts) / len(drifts) if drifts else 0,
+            'max_abs_block_drift_seconds': max((abs(drift) for drift in drifts), default=0),
+            'stalls': len(self.time_to_recovery_in_seconds),
+            'max_time_to_recovery_seconds': max(self.time_to_recovery_in_seconds, default=0),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--channel', default=os.getenv('CHANNEL_NUMBER'), required=os.getenv('CHANNEL_NUMBER') is None)
+    parser.add_argument('--start', type=datetime.datetime.fromisoformat, default=None,
+                        help='When the simulation starts (ISO 8601, local time). Defaults to now.')
+    parser.add_argument('--hours', type=float, default=24)
+    parser.add_argument('--as-run', default='as-run.jsonl', help='Where to write the as-run log.')
+    parser.add_argument('--speed', type=float, default=0, help='Times faster than real time. 0 means as fast as possible.')
+    parser.add_argument('--gap', type=float, default=0, help='Seconds of simulated dead air between videos.')
+    parser.add_argument('--stall-every', type=int, default=0, help='Stall the player halfway through every Nth segment.')
+    parser.add_argument('--profile', action='store_true', help='Print the planning hot spots when done.')
+    args = parser.parse_args()
+
+    simulation = Simulation(args.channel, args.start or datetime.datetime.now(), args.as_run, speed=args.speed, gap_in_seconds=args.gap,
+                            stall_every=args.stall_every)
+    profiler = cProfile.Profile() if args.profile else None
+    started = time.monotonic()
+    if profiler:
+        profiler.enable()
+    simulation.run(args.hours)
+    if profiler:
+        profiler.disable()
+
+    report = simulation.report()
+    report['wall_seconds'] = round(time.monotonic() - started, 3)
+    print(json.dumps(report, indent=2))
+    if profiler:
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(25)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,17 +1,56 @@
 import datetime
+import itertools
 import os
 import random
 import re
 import socket
+import threading
 import time
+from concurrent.futures import wait
 from decimal import Decimal
 
-from vlc import EventType
-from vlc_controller import VLCController
+# Before anything slow is imported, so startup time counts it.
+LAUNCHED_AT = time.monotonic()
 
+from as_run_log import as_run_log_from_environment
+from break_packing import split_break_lengths
+from clock import SystemClock
+from commercial_catalog import get_commercial_catalog
+from commercial_rotation import get_commercial_rotation
 from commercial_utils import get_commercial_break
+from drift_controller import DriftController
+from metrics import (
+    DEFAULT_METRICS_PORT,
+    FEED_QUEUE_DURATION_SECONDS,
+    QUEUE_DEPTH_SECONDS,
+    QUEUE_LENGTH,
+    STARTUP_SECONDS,
+    TIME_TO_RECOVERY_SECONDS,
+    start_metrics_server,
+)
+from plan_store import plan_store_from_environment, resume_at
+from playback_watchdog import PlaybackWatchdog
+from queue_planner import QueuePlanner
+from read_ahead_cache import ReadAheadCache
+from schedule_snapshot import snapshot_from_environment
 from scheduler_client import SchedulerClient
+from transcode_cache import DEFAULT_BUDGET_IN_BYTES as DEFAULT_RENDITION_BUDGET_IN_BYTES, TranscodeCache
 from video import Video
+from video_queue import VideoQueue
+
+# The main loop sleeps until VLC tells us a video ended. This is only the
+# longest it will ever sleep without being woken, as a safety net.
+HOUSEKEEPING_INTERVAL_IN_SECONDS = 60
+
+# We plan this far ahead of the wall clock, several blocks in one go...
+PLANNING_HORIZON_IN_SECONDS = 3 * 60 * 60
+# ...whenever the queue gets shorter than this. Refills are rare and never
+# anywhere near the end of what's queued.
+REFILL_BELOW_IN_SECONDS = 60 * 60
+
+# How much local storage the read-ahead cache may use for upcoming files.
+# Set READ_AHEAD_BUDGET_GB=0 to read everything straight from the NAS.
+DEFAULT_READ_AHEAD_BUDGET_IN_GB = 4
 
 
 def detect_channel_number() -> str:
@@ -32,87 +71,329 @@ def detect_channel_number() -> str:
 
 
 class TechnicalDirector:
-    def __init__(self):
-        self.channel_number = detect_channel_number()
-
-        self.scheduler_client = SchedulerClient()
-
-        self.vlc_controller = VLCController()
+    def __init__(self, channel_number=None, scheduler_client=None, vlc_controller=None, clock=None, plan_in_background=True,
+                 read_ahead_budget_in_gb=None, rendition_budget_in_gb=None, read_ahead_cache=None, transcode_cache=None,
+                 planning_executor=None, probe_executor=None, player_options=None, commercial_rotation=None, as_run_log=None,
+                 plan_store=None):
+        # The Scheduler client, caches, and executors can be handed in already
+        # made, so several directors (one per channel, see multi_channel.py)
+        # can share them.
+        self.channel_number = channel_number or detect_channel_number()
+        # Every metric we record is labelled with the channel.
+        self.metric_labels = {'channel': str(self.channel_number)}
+
+        # Everything that asks "what time is it?" asks this, so a simulation
+        # can run the director on a virtual clock.
+        self.clock = clock or SystemClock()
+
+        # The lineup is kept on disk too, so we can start from it on boot
+        # and keep airing it if the Scheduler goes away.
+        self.scheduler_client = scheduler_client or SchedulerClient(snapshot=snapshot_from_environment())
+        self.scheduler_client.start_background_refresh()
+        # Commercials come over the same connections as the lineup.
+        get_commercial_catalog(self.scheduler_client)
+        # Which spots aired when, so the same ones don't keep coming back.
+        self.commercial_rotation = commercial_rotation or get_commercial_rotation()
+
+        if vlc_controller is None:
+            # Imported here so the director can be driven by a stand-in
+            # player (benchmarks, simulation) on a box without libvlc.
+            from vlc_controller import VLCController
+            vlc_controller = VLCController(player_options=player_options, metric_labels=self.metric_labels)
+        self.vlc_controller = vlc_controller
+
+        if read_ahead_budget_in_gb is None:
+            read_ahead_budget_in_gb = float(os.getenv('READ_AHEAD_BUDGET_GB', DEFAULT_READ_AHEAD_BUDGET_IN_GB))
+        self.read_ahead_cache = read_ahead_cache
+        if self.read_ahead_cache is None and read_ahead_budget_in_gb > 0:
+            self.read_ahead_cache = ReadAheadCache(budget_in_bytes=int(read_ahead_budget_in_gb * 1024 ** 3))
+
+        # Decode-friendly renditions made by transcode_cache.py, if any.
+        # RENDITION_BUDGET_GB=0 plays the originals no matter what.
+        if rendition_budget_in_gb is None:
+            rendition_budget_in_gb = float(os.getenv('RENDITION_BUDGET_GB', DEFAULT_RENDITION_BUDGET_IN_BYTES / 1024 ** 3))
+        self.transcode_cache = transcode_cache
+        if self.transcode_cache is None and rendition_budget_in_gb > 0:
+            self.transcode_cache = TranscodeCache(budget_in_bytes=int(rendition_budget_in_gb * 1024 ** 3))
 
         # This is the semaphore we look for to know if we should advance the
         # queue. When VLC sends the event that represents the player reaching
         # the end of the currently-playing media, we set this to True, which
         # we then react to in the endless loop.
         self.should_move_to_next_video = False
+        # Setting the semaphore also sets this event, which wakes the main
+        # loop immediately instead of it having to poll.
+        self.wake_event = threading.Event()
 
+        # The plan we're airing, on disk, so a restart picks it back up.
+        self.plan_store = plan_store or plan_store_from_environment()
+
+        # What actually aired, and when. None if turned off.
+        self.as_run_log = as_run_log if as_run_log is not None else as_run_log_from_environment(self.channel_number)
+
+        self.current_video = None
         self.current_video_started = None
         self.current_video_duration_in_seconds = None
-        self.video_queue = []
-        self.feed_queue()
-
-    def feed_queue(self, time_at_queue_completion=datetime.datetime.now()):
+        # The planner thread adds to the queue while the playback thread
+        # takes from it. The queue takes care of its own locking.
+        self.video_queue = VideoQueue()
+        # Where the planned blocks in the queue run out. The next plan picks
+        # up exactly here, so a block is never planned twice.
+        self.planned_until = None
+        # The lineup the queued plan was last checked against.
+        self.planned_against = None
+
+        # Shrinks or stretches the commercial breaks left in the current
+        # block so it ends when it's supposed to. The plan is saved after
+        # every correction, or a restart would bring back the uncorrected one.
+        self.drift_controller = DriftController(self.video_queue, self.vlc_controller, metric_labels=self.metric_labels,
+                                                commercial_rotation=self.commercial_rotation, on_queue_changed=self.save_plan)
+
+        # Notices when the player stalls without telling us (see
+        # `recover_from_stall`). Like the end-of-media semaphore, a stall is
+        # only noted here and dealt with in the main loop.
+        self.watchdog = PlaybackWatchdog(self.vlc_controller, self.clock, on_stall=self.react_to_stall, metric_labels=self.metric_labels)
+        self.vlc_controller.on_error(self.watchdog.react_to_error_event)
+        self.stall_reason = None
+        self.stalled_since = None
+        # The video we last reloaded after a stall. If that stalls too, we
+        # give up on it.
+        self.reloaded_video = None
+        self.last_time_to_recovery_in_seconds = None
+
+        # Upcoming blocks are planned in the background, so refilling the
+        # queue never delays the next video.
+        self.planner = QueuePlanner(plan=self.plan_ahead, deliver=self.enqueue_planned_videos, synchronous=not plan_in_background,
+                                    planning_executor=planning_executor, probe_executor=probe_executor, metric_labels=self.metric_labels)
+
+        # We have to have something to play before we start. After a
+        # restart that's the rest of the plan we were airing. Otherwise the
+        # current block is planned right here. Either way the planner fills
+        # in the hours after it in the background.
+        if not self.resume_saved_plan():
+            self.feed_queue()
+
+    def feed_queue(self, time_at_queue_completion=None):
+        time_at_queue_completion = time_at_queue_completion or self.clock.now()
+        with FEED_QUEUE_DURATION_SECONDS.time(**self.metric_labels):
+            videos = self.plan_ahead(time_at_queue_completion, until=time_at_queue_completion)
+        self.enqueue(videos)
+        self.print_queue_summary(videos)
+        self.save_plan()
+
+    def resume_saved_plan(self) -> bool:
+        # Pick up the saved plan where the wall clock says we are. Nothing in
+        # here asks ffprobe or the Scheduler anything.
+        planned_videos = self.plan_store.load(self.channel_number)
+        if not planned_videos:
+            return False
+        videos = resume_at(planned_videos, self.clock.now())
+        if not videos:
+            return False
+        self.enqueue(videos)
+        print(f'Resumed the saved plan at {videos[0].file_path} ({videos[0].start_at_second or 0}s in), '
+              f'{len(videos)} videos through {self.planned_until}.')
+        return True
+
+    def save_plan(self):
+        # The video on now and everything queued after it, with when each
+        # is expected to air.
+        planned_videos = []
+        if self.current_video is not None and self.current_video_started is not None:
+            planned_videos.append((self.current_video, self.current_video_started))
+        planned_videos.extend(self.video_queue.airtimes(self.estimated_time_at_end_of_current_video()))
+        try:
+            self.plan_store.save(self.channel_number, planned_videos, now=self.clock.now())
+        except OSError as e:
+            print(f'Could not save the plan: {e}')
+        # The spots in the plan were recorded as aired while it was built.
+        # Save them with it, or a restart would pick them again.
         try:
-            scheduling_block = self.get_scheduling_block(time_at_queue_completion)
+            self.commercial_rotation.flush()
+        except OSError as e:
+            print(f'Could not save the commercial rotation: {e}')
+
+    def enqueue(self, videos):
+        # All of a plan's videos go in at once, never half a plan.
+        offsets = self.video_queue.extend(videos)
+        if videos:
+            self.planned_until = videos[-1].block_end
+        # Remember when each one is planned to air, to compare against when
+        # it actually does.
+        front_starts_at = self.estimated_time_at_end_of_current_video()
+        for video, offset in zip(videos, offsets):
+            video.planned_start = front_starts_at + datetime.timedelta(seconds=float(offset))
+
+    def enqueue_planned_videos(self, videos):
+        # Called on the planner thread once a block is ready.
+        self.enqueue(videos)
+        self.print_queue_summary(videos)
+        # Wake the main loop so it can pre-roll and stage the new videos.
+        self.wake_event.set()
+        self.save_plan()
+
+    def plan_ahead(self, starting_at, until=None):
+        """
+        Plan every block from `starting_at` until `until` (by default, the
+        planning horizon from now), back to back, and return their videos.
+        At least one block is always planned.
+
+        Each block picks up exactly where the last one ends, so we never plan
+        the block that's already queued again, and a block longer than half
+        an hour is planned once, as a whole.
+        """
+        until = until or self.clock.now() + datetime.timedelta(seconds=PLANNING_HORIZON_IN_SECONDS)
+        try:
+            # One lookup for the whole range instead of one per block.
+            scheduled_blocks = self.scheduler_client.blocks_between(self.channel_number, starting_at, max(until, starting_at + datetime.timedelta(minutes=1)))
         except Exception as e:
-            # TODO: Make this more specific in what it catches.
-            # Don't crash the process if we can't get what's on next, just
-            # queue the default video
-            scheduling_block = {
-                'label': 'Dead Air',
-                'listing_id': '0000',
-                'file_path': None,
-                'show_commercials': False,
-                'block_start': time_at_queue_completion,
-                'block_duration_in_minutes': 30,
-            }
+            # Don't crash the process if we can't get what's on next, the
+            # gaps get the default video.
+            print(f'Could not get the lineup from {starting_at} on: {e}')
+            scheduled_blocks = []
 
-        # Get a Video object for the video that should be airing.
-        if scheduling_block['file_path'] is None:
-            target_video = Video.default_video()
-            scheduling_block['show_commercials'] = False
-        else:
-            target_video = Video(scheduling_block['file_path'], label=str(scheduling_block['listing_id']))
+        # Every feature in the range is probed at the same time, before we
+        # start planning with the first of them.
+        metadata = self.planner.load_metadata(block['file_path'] for block in scheduled_blocks if block['file_path'])
 
+        videos = []
+        airs_at = max(starting_at, self.clock.now())
+        while True:
+            while scheduled_blocks and scheduled_blocks[0]['block_end'] <= airs_at:
+                scheduled_blocks.pop(0)
+            if scheduled_blocks and scheduled_blocks[0]['block_start'] <= airs_at:
+                scheduling_block = scheduled_blocks.pop(0)
+            else:
+                next_block_start = scheduled_blocks[0]['block_start'] if scheduled_blocks else None
+                scheduling_block = self.dead_air_block(airs_at, next_block_start)
+            try:
+                videos.extend(self.plan_block_from(scheduling_block, airs_at, metadata))
+            except Exception as e:
+                # A missing or corrupt file costs its own slot, not every
+                # block planned after it. The default video fills in.
+                print(f"Could not plan {scheduling_block['file_path']} at {airs_at}, airing the default video instead: {e}")
+                scheduling_block = self.dead_air_block(airs_at, scheduling_block['block_end'])
+                videos.extend(self.plan_block(scheduling_block, airs_at))
+            airs_at = scheduling_block['block_end']
+            if airs_at >= until:
+                return videos
+
+    def plan_block_from(self, scheduling_block, airs_at, metadata=None):
+        # Joining a block that's already under way (we just started, or the
+        # queue ran dry), we plan all of it, as if from the top, and pick it
+        # up where it would be by now. Plans are seeded by listing, so where
+        # the breaks fall and how long they run is what it would have been.
+        # Which spots fill them depends on the rotation, though, so they can
+        # differ.
+        block_start = scheduling_block['block_start']
+        if scheduling_block['file_path'] is None or airs_at <= block_start:
+            return self.plan_block(scheduling_block, airs_at, metadata)
+        # The part of the block we skip never airs, so its spots are picked
+        # from a copy of the rotation, and only the ones we keep are
+        # recorded in the real one.
+        rotation = self.commercial_rotation.scratch_copy()
+        videos = self.plan_block(scheduling_block, block_start, metadata, rotation=rotation)
+        offsets = itertools.accumulate((video.duration_in_seconds() for video in videos[:-1]), initial=Decimal(0))
+        planned_videos = [(video, block_start + datetime.timedelta(seconds=float(offset))) for video, offset in zip(videos, offsets)]
+        resumed = resume_at(planned_videos, airs_at)
+        if not resumed:
+            # The plan came up short of the block's end and we're past it.
+            # Fall back on what's left of the show itself.
+            return self.plan_block(scheduling_block, airs_at, metadata)
+        self.commercial_rotation.record_aired_files([video.file_path for video in resumed if video.is_commercial], block_start.timestamp())
+        return resumed
+
+    @staticmethod
+    def plan_seed(scheduling_block) -> str:
+        # The same listing in the same slot always gets the same plan.
+        return f"{scheduling_block['listing_id']}|{scheduling_block['file_path']}|{scheduling_block['block_start'].isoformat()}"
+
+    def dead_air_block(self, airs_at, next_block_start=None):
+        # Nothing is scheduled at `airs_at`. Fill until the next listing
+        # starts, or the next half hour if that comes first.
+        block_end = self.most_recent_half_hour(airs_at) + datetime.timedelta(minutes=30)
+        if next_block_start is not None:
+            block_end = min(block_end, next_block_start)
+        return {
+            'label': 'Dead Air',
+            'listing_id': '0000',
+            'file_path': None,
+            'show_commercials': False,
+            'block_start': airs_at,
+            'block_end': block_end,
+            'block_duration_in_minutes': int((block_end - airs_at).total_seconds() / 60),
+        }
+
+    def plan_block(self, scheduling_block, airs_at=None, metadata=None, rotation=None):
+        # `metadata` is what `plan_ahead` is already probing, file path ->
+        # future. `rotation` picks the commercials, by default ours.
+        # Get a Video object for the video that should be airing.
         # See how much time is left in the programming block.
         # Example:
         # We are in the middle of a 30 minute block.
         # It started 27 minutes, 30 seconds ago.
         # We have 2 minutes, thirty seconds left.
-        remaining_time = self.seconds_until_end_of_scheduling_block(scheduling_block)
+        remaining_time = self.seconds_until_end_of_scheduling_block(scheduling_block, airs_at)
+
+        if scheduling_block['file_path'] is None:
+            # Nothing scheduled. The default video's loop fills the block
+            # exactly, no commercials.
+            scheduling_block['show_commercials'] = False
+            return self.label_with_block(Video.dead_air(remaining_time, self.channel_number), scheduling_block)
+        loading = (metadata or {}).get(scheduling_block['file_path'])
+        if loading is not None:
+            # Waiting for that beats probing the file a second time here.
+            wait([loading])
+        target_video = Video(scheduling_block['file_path'], label=str(scheduling_block['listing_id']))
+        rng = random.Random(self.plan_seed(scheduling_block))
 
         # If the remaining time is less than the duration of the target video,
         # queue it so that it ends at the cutover.
         video_duration = target_video.duration_in_seconds()
         if remaining_time < video_duration:
-            print('Not enough time to show the whole thing!')
-            print(f'There are {remaining_time} seconds left, but the video is {video_duration} seconds long!')
-            self.queue_video(target_video,
+            print(f'Not enough time to show the whole thing! There are {remaining_time} seconds left, but the video is {video_duration} seconds long!')
+            videos = self.plan_video(target_video,
                 start_at_second=(video_duration-remaining_time),
                 intersperse_commercials=False,
-                block_duration_in_seconds=scheduling_block['block_duration_in_minutes'] * 60)
+                block_duration_in_seconds=remaining_time,
+                airs_at=airs_at,
+                rng=rng,
+                rotation=rotation)
         # Else queue it and pad with commercials.
         else:
-            print('There is enough time to show the whole thing.')
-            print(f'There are {remaining_time} seconds left, and the video is {video_duration} seconds long.')
-            self.queue_video(target_video,
+            videos = self.plan_video(target_video,
                 intersperse_commercials=scheduling_block['show_commercials'],
-                block_duration_in_seconds=scheduling_block['block_duration_in_minutes'] * 60)
-        self.print_queue()
+                block_duration_in_seconds=remaining_time,
+                airs_at=airs_at,
+                rng=rng,
+                rotation=rotation)
+        return self.label_with_block(videos, scheduling_block)
+
+    @staticmethod
+    def label_with_block(videos, scheduling_block):
+        # Remember which block every video belongs to, so drift can be
+        # corrected against the block's end, and the plan revised if the
+        # block changes.
+        for video in videos:
+            video.block_end = scheduling_block['block_end']
+            video.scheduling_block = scheduling_block
+        return videos
 
     def react_to_vlc_media_player_end_reached_event(self, event):
         # Hey there. The reason this just sets a flag and doesn't just start
         # the next video itself is because attempting to call methods on the
         # player object while reacting to a player event causes the player to
         # hang. Instead this just sets a semaphore that is read during the main
-        # loop.
+        # loop. Setting the event wakes that loop right away.
         self.should_move_to_next_video = True
+        self.wake_event.set()
+        self.record_airing_ended()
 
     def play_next_video(self):
         try:
-            video = self.video_queue.pop(0)
+            video = self.video_queue.popleft()
         except IndexError:
-            video = Video.default_video()
-        media = self.vlc_controller.vlc_instance.media_new(video.file_path)
+            video = Video.default_video(self.channel_number)
         # If start_at_second is specified, we don't bother with chapters,
         # commercials, etc. Just queue the video from the time specified.
         # This usually occurs when there is not enough time in the timeslot
@@ -120,23 +401,139 @@ class TechnicalDirector:
         # Well, it can happen if you turn your channel on in the middle of a
         # timeslot. In this case it would be like the content had been playing,
         # it finishes exactly on time.
-        if video.start_at_second:
-            media.add_option(f':start-time={round(Decimal(video.start_at_second), 3)}')
-        if video.end_at_second:
-            media.add_option(f":stop-time={round(Decimal(video.end_at_second), 3)}")
+        #
+        # Usually the media was already built and parsed while the previous
+        # video played (see `preroll_next_video`).
+        file_path = self.playable_path(video.file_path)
+        media = self.vlc_controller.take_prepared_media(file_path, video.start_at_second, video.end_at_second, video.repeat_count)
+        if media is None:
+            media = self.vlc_controller.media_for(file_path, video.start_at_second, video.end_at_second, video.repeat_count)
 
         self.vlc_controller.set_media(media)
+        if self.transcode_cache is not None:
+            self.transcode_cache.mark_played(video.file_path)
 
         self.vlc_controller.play()
-        self.current_video_started = datetime.datetime.now()
+        self.current_video = video
+        self.current_video_started = self.clock.now()
         self.current_video_duration_in_seconds = video.duration_in_seconds()
-
-    def queue_video(self, target_video, start_at_second=0, intersperse_commercials=False, block_duration_in_seconds=(30 * 60)):
+        # Anything the watchdog noticed before now was about the last video.
+        self.watchdog.watch()
+        self.stall_reason = None
+        self.record_airing_started()
+        self.preroll_next_video()
+
+    def react_to_stall(self, reason, stalled_since):
+        # Called by the watchdog, from its own thread. Same as with the end
+        # of a video, we only leave a note for the main loop and wake it.
+        self.stalled_since = stalled_since
+        self.stall_reason = reason
+        self.wake_event.set()
+
+    def recover_from_stall(self):
+        # The player stalled and isn't going to tell us the video ended. The
+        # first time, we load the video again from where it should be by now,
+        # which keeps the block on time. If the reloaded video stalls too, or
+        # it was about over anyway, we skip to the next one and let the drift
+        # controller make up the difference.
+        reason = self.stall_reason
+        stalled_since = self.stalled_since
+        video = self.current_video
+        remainder = []
+        if video is not None and video is not self.reloaded_video:
+            elapsed = Decimal(str((self.clock.now() - self.current_video_started).total_seconds()))
+            remainder = video.remainder_after(elapsed)
+        self.record_airing_ended()
+        if remainder:
+            print(f'Playback stalled ({reason}) {round(elapsed)}s into {video.file_path}, reloading it from there.')
+            self.video_queue.replace(0, 0, remainder)
+            self.reloaded_video = remainder[0]
+        else:
+            print(f'Playback stalled ({reason}) in {video.file_path if video else "nothing"}, skipping to the next video.')
+        self.play_next_video()
+
+        time_to_recovery = (self.clock.now() - stalled_since).total_seconds()
+        self.last_time_to_recovery_in_seconds = time_to_recovery
+        TIME_TO_RECOVERY_SECONDS.observe(time_to_recovery, **self.metric_labels)
+        print(f'Back on the air {round(time_to_recovery, 2)}s after playback stalled.')
+
+    def record_airing_started(self):
+        if self.as_run_log is None:
+            return
+        video = self.current_video
+        self.as_run_log.record(
+            event='start',
+            channel=self.channel_number,
+            file_path=video.file_path,
+            batch_label=video.batch_label,
+            commercial=video.is_commercial,
+            dead_air=video.label == 'Dead Air',
+            start_at_second=video.start_at_second,
+            end_at_second=video.end_at_second,
+            planned_start=video.planned_start,
+            actual_start=self.current_video_started,
+            block_end=video.block_end,
+        )
+
+    def record_airing_ended(self):
+        # Runs on VLC's event thread, so it only queues the record.
+        if self.as_run_log is None or self.current_video is None:
+            return
+        self.as_run_log.record(
+            event='end',
+            channel=self.channel_number,
+            file_path=self.current_video.file_path,
+            actual_start=self.current_video_started,
+            actual_end=self.clock.now(),
+        )
+
+    def preroll_next_video(self):
+        # Get the next video ready while this one plays, so the cut to it is
+        # as close to gapless as we can make it.
+        next_video = self.video_queue.peek()
+        if next_video is not None:
+            self.vlc_controller.prepare(self.playable_path(next_video.file_path), next_video.start_at_second, next_video.end_at_second,
+                                        next_video.repeat_count)
+
+    def playable_path(self, file_path):
+        # Prefer the local copy the read-ahead cache made, if there is one,
+        # of whichever file we'd play.
+        file_path = self.rendition_or_original(file_path)
+        if self.read_ahead_cache is not None:
+            return self.read_ahead_cache.local_path_for(file_path) or file_path
+        return file_path
+
+    def rendition_or_original(self, file_path):
+        # A Pi-friendly rendition plays in place of the original when there
+        # is one.
+        if self.transcode_cache is not None:
+            return self.transcode_cache.rendition_path_for(file_path) or file_path
+        return file_path
+
+    def stage_upcoming_videos(self):
+        if self.read_ahead_cache is not None:
+            self.read_ahead_cache.stage_upcoming(self.files_to_stage(), owner=self.channel_number)
+
+    def files_to_stage(self):
+        # A generator, so only the files the read-ahead cache looks at get
+        # looked up.
+        for video in self.video_queue:
+            file_path = self.rendition_or_original(video.file_path)
+            if file_path != video.file_path and self.transcode_cache.is_local:
+                # Already on local storage.
+                continue
+            yield file_path
+
+    def plan_video(self, target_video, start_at_second=0, intersperse_commercials=False, block_duration_in_seconds=(30 * 60), airs_at=None,
+                   rng=random, rotation=None):
+        # Returns the videos to queue, in order. Nothing is added to the queue
+        # here, that happens all at once when the plan is done.
+        videos_to_queue = []
         if start_at_second:
             # If start_at_second is specified, we don't bother with chapters,
             # commercials, etc. Just queue the video from the time specified.
             target_video.start_at_second = start_at_second
-            self.video_queue.append(target_video)
+            videos_to_queue.append(target_video)
         else:
             # In this logic branch, we will queue the video, but we will
             # potentially prepend, append, and intersperse commercials.
@@ -154,14 +551,12 @@ class TechnicalDirector:
             # In this example, we queued 10 videos total, including the target
             # video twice.
 
-            videos_to_queue = []
-
             # Figure out how many commercial breaks we'll have. We could have
             # one before we start the video, we could have one after we end the
             # video, and we might decide to put commercials within the video at
             # the chapter markers.
-            commercials_before_start = random.randint(0,1) == 1
-            commercials_after_end = random.randint(0,1) == 1
+            commercials_before_start = rng.randint(0,1) == 1
+            commercials_after_end = rng.randint(0,1) == 1
             total_commercial_breaks = 0
             if commercials_before_start:
                 total_commercial_breaks += 1
@@ -191,7 +586,8 @@ class TechnicalDirector:
             # Knowing how much time you need to fill, and how many breaks you
             # have to fill it, get a list of commercial file paths, grouped by
             # which break to show them in.
-            commercial_breaks = self.assemble_commercial_breaks(total_commercial_breaks, block_duration_minus_content_duration_in_seconds)
+            commercial_breaks = self.assemble_commercial_breaks(total_commercial_breaks, block_duration_minus_content_duration_in_seconds, airs_at, rng,
+                                                                rotation)
             # This counter is used to associate the commercial videos to the
             # correct commercial break. This allows you to see where one
             # commercial break ends and one begins when printing the queue,
@@ -207,7 +603,7 @@ class TechnicalDirector:
                 commercial_break = commercial_breaks.pop()
                 for commercial_video in commercial_break:
                     commercial_video.batch_label = f'{target_video.batch_label}-break#{commercial_break_label}'
-                    self.video_queue.append(commercial_video)
+                    videos_to_queue.append(commercial_video)
                 commercial_break_label += 1
             if target_video.chapters() and intersperse_commercials:
                 # Since this video has chapters and we've elected to insert
@@ -220,18 +616,18 @@ class TechnicalDirector:
                     video_segment = Video(target_video.file_path, batch_label=target_video.batch_label)
                     video_segment.start_at_second = round(Decimal(chapter['start_time']), 3)
                     video_segment.end_at_second = round(Decimal(chapter['end_time']), 3)
-                    self.video_queue.append(video_segment)
+                    videos_to_queue.append(video_segment)
                     if index < len(target_video.chapters()) - 1:
                         commercial_break = commercial_breaks.pop()
                         for commercial_video in commercial_break:
                             commercial_video.batch_label = f'{target_video.batch_label}-break#{commercial_break_label}'
-                            self.video_queue.append(commercial_video)
+                            videos_to_queue.append(commercial_video)
                         commercial_break_label += 1
             else:
                 # Either this video did not have chapter information or we
                 # elected to not insert commercials. In this case, simply queue
                 # the video.
-                self.video_queue.append(target_video)
+                videos_to_queue.append(target_video)
             if commercials_after_end:
                 # If we are supposed to have a commercial break after the
                 # content ends, grab one of our prepared commercial breaks,
@@ -240,29 +636,26 @@ class TechnicalDirector:
                 commercial_break = commercial_breaks.pop()
                 for commercial_video in commercial_break:
                     commercial_video.batch_label = f'{target_video.batch_label}-break#{commercial_break_label}'
-                    self.video_queue.append(commercial_video)
+                    videos_to_queue.append(commercial_video)
                 commercial_break_label += 1
+        return videos_to_queue
 
-    def assemble_commercial_breaks(self, count, total_length):
+    def assemble_commercial_breaks(self, count, total_length, airs_at=None, rng=random, rotation=None):
         commercial_breaks = []
-        # TODO: make these not so even! Varying length breaks keep it fresh.
-        target_length = total_length / count
-        for i in range(0, count):
-            commercial_breaks.append(get_commercial_break(target_length))
+        # Varying length breaks keep it fresh. So does not airing the same
+        # spots as the last few breaks, which is the rotation's job. Every
+        # break in a block counts as airing when the block does, which is
+        # close enough to keep them apart.
+        airs_at = airs_at or self.clock.now()
+        rotation = rotation or self.commercial_rotation
+        for target_length in split_break_lengths(total_length, count, rng=rng):
+            commercial_breaks.append(get_commercial_break(target_length, rng=rng, rotation=rotation, airs_at=airs_at))
         return commercial_breaks
-        
-    def seconds_until_end_of_scheduling_block(self, scheduling_block) -> int:
-        block_start = scheduling_block['block_start']
-        block_duration_in_minutes = scheduling_block['block_duration_in_minutes']
-        return ((block_start + datetime.timedelta(minutes=block_duration_in_minutes)) - max(datetime.datetime.now(), block_start)).seconds
 
-    def get_scheduling_block(self, datetime_for_consideration):
-        scheduled_listing = self.scheduler_client.whats_on(
-            channel_number=self.channel_number,
-            querytime=self.most_recent_half_hour(datetime_for_consideration))
-        if scheduled_listing is None:
-            raise ValueError('No listing info available!')
-        return scheduled_listing
+    def seconds_until_end_of_scheduling_block(self, scheduling_block, airs_at=None) -> Decimal:
+        # How much of the block is left from `airs_at` (by default, now) on.
+        airs_at = max(airs_at or self.clock.now(), scheduling_block['block_start'])
+        return Decimal(str((scheduling_block['block_end'] - airs_at).total_seconds()))
 
     # Adapted from the logic found here: https://stackoverflow.com/a/10854034
     def most_recent_half_hour(self, datetime_for_consideration):
@@ -271,70 +664,159 @@ class TechnicalDirector:
         rounding = seconds // thirty_minutes_in_seconds * thirty_minutes_in_seconds
         return datetime_for_consideration + datetime.timedelta(0, rounding - seconds, -datetime_for_consideration.microsecond)
 
-    # Simply sum the durations of all the videos in the video queue.
+    # The queue keeps a running total, so this doesn't walk the queue.
     def remaining_queue_duration_in_seconds(self):
-        duration = 0
-        for video in self.video_queue:
-            duration += video.duration_in_seconds()
-        return duration
+        return self.video_queue.duration_in_seconds()
 
     def estimated_time_at_end_of_current_video(self):
         if not (self.current_video_started and self.current_video_duration_in_seconds):
-            return datetime.datetime.now()
+            return self.clock.now()
         else:
             video_duration_seconds = int(self.current_video_duration_in_seconds)
             video_duration_milliseconds = int((self.current_video_duration_in_seconds - video_duration_seconds) * 1000)
             return self.current_video_started + datetime.timedelta(seconds=video_duration_seconds, milliseconds=video_duration_milliseconds)
 
+    def queued_videos(self):
+        # A copy, so it can be looped over while the planner adds to the queue.
+        return list(self.video_queue)
+
+    def estimated_time_at_end_of_queue(self):
+        return self.estimated_time_at_end_of_current_video() + datetime.timedelta(seconds=float(self.remaining_queue_duration_in_seconds()))
+
+    def video_airing_at(self, when):
+        # Which queued video will be on at `when`, or None if it's the one
+        # playing now or the queue runs out before then.
+        offset = (when - self.estimated_time_at_end_of_current_video()).total_seconds()
+        index = self.video_queue.index_at(Decimal(str(offset)))
+        return None if index is None else self.video_queue[index]
+
+    def print_queue_summary(self, videos):
+        # One line per plan. `print_queue` has the whole queue, when it's
+        # needed, and the as-run log has what actually aired.
+        print(f'Planned {len(videos)} videos through {self.planned_until}, '
+              f'queue depth is {round(self.remaining_queue_duration_in_seconds() / 60, 1)} minutes.')
+
     def print_queue(self):
         remaining_queue_duration = self.remaining_queue_duration_in_seconds()
         print(f'Queue depth is {round(remaining_queue_duration / 60, 3)} minutes.')
-        estimated_airtime = self.estimated_time_at_end_of_current_video()
 
         print('current queue:')
-        for index, video in enumerate(self.video_queue):
+        for video, estimated_airtime in self.video_queue.airtimes(self.estimated_time_at_end_of_current_video()):
             print(f"[{video.batch_label}] <{estimated_airtime}> {video.file_path.split('/')[-1]} ({round(Decimal(video.duration_in_seconds()), 3)}s)")
-            video_duration_seconds = int(video.duration_in_seconds())
-            video_duration_milliseconds = int((video.duration_in_seconds() - video_duration_seconds) * 1000)
-            estimated_airtime = estimated_airtime + datetime.timedelta(seconds=video_duration_seconds, milliseconds=video_duration_milliseconds)
 
+    def feed_queue_if_needed(self):
+        # The planner works in the background. If it's still busy with the
+        # last request, we leave the queue alone and look again later.
+        if self.planner.busy():
+            return
+        self.revise_plan_if_lineup_changed()
+        if self.remaining_queue_duration_in_seconds() < REFILL_BELOW_IN_SECONDS:
+            # Pick up where the planned blocks run out. If they ran out in
+            # the past (we've been airing the default video), start from
+            # when the queue will be empty instead.
+            queue_feed_time = self.estimated_time_at_end_of_queue()
+            if self.planned_until is not None and self.planned_until > queue_feed_time - datetime.timedelta(minutes=30):
+                queue_feed_time = self.planned_until
+            self.planner.request(queue_feed_time)
+
+    def revise_plan_if_lineup_changed(self):
+        # When the lineup changes, the blocks we already planned that are
+        # no longer what the Scheduler says are dropped from the queue,
+        # along with everything after them, and planned again. Blocks that
+        # didn't change, and the block on the air, are left alone.
+        schedule = self.scheduler_client.cached_channel_schedule(self.channel_number)
+        if schedule is None or schedule is self.planned_against:
+            return
+        self.planned_against = schedule
+
+        current_block_end = self.current_video.block_end if self.current_video else None
+        previous_block_end = current_block_end
+        checked_block = None
+        for index in range(len(self.video_queue)):
+            video = self.video_queue[index]
+            planned_block = video.scheduling_block
+            if planned_block is None or planned_block is checked_block or video.block_end == current_block_end:
+                continue
+            checked_block = planned_block
+            if self.same_scheduling_block(planned_block, schedule.blocks_between(planned_block['block_start'], planned_block['block_end'])):
+                previous_block_end = planned_block['block_end']
+                continue
+            removed = self.video_queue.truncate(index)
+            self.planned_until = previous_block_end or planned_block['block_start']
+            print(f'The lineup changed at {planned_block["block_start"]}, replanning from {self.planned_until} ({len(removed)} videos dropped).')
+            # So a restart doesn't pick the plan we just threw away back up.
+            self.save_plan()
+            return
+
+    @staticmethod
+    def same_scheduling_block(planned_block, scheduled_blocks) -> bool:
+        if planned_block['file_path'] is None:
+            # We planned dead air. It's still right if nothing is scheduled.
+            return not scheduled_blocks
+        if len(scheduled_blocks) != 1:
+            return False
+        scheduled_block = scheduled_blocks[0]
+        return all(planned_block[key] == scheduled_block[key] for key in ('listing_id', 'file_path', 'block_start', 'block_end'))
+
+    def run_loop_iteration(self):
+        # Advance the queue first if it's ready, so the next video starts
+        # as soon as possible after the last one ended.
+        if self.should_move_to_next_video:
+            self.should_move_to_next_video = False
+            self.play_next_video()
+        elif self.stall_reason is not None:
+            self.recover_from_stall()
+
+        self.feed_queue_if_needed()
+        QUEUE_DEPTH_SECONDS.set(float(self.remaining_queue_duration_in_seconds()), **self.metric_labels)
+        QUEUE_LENGTH.set(len(self.video_queue), **self.metric_labels)
+        self.drift_controller.measure_and_correct(self.current_video, self.current_video_started, self.clock.now())
+        self.stage_upcoming_videos()
+        # If the queue was empty when the current video started, the next
+        # one only exists now.
+        self.preroll_next_video()
 
     def queue_fill_advance_and_sleep_loop(self):
         while True:
-            remaining_queue_duration = self.remaining_queue_duration_in_seconds()
-            if remaining_queue_duration < (30 * 60):
-                # The queue has less than thirty minutes of content lined up.
-                # We'll feed the queue with what should be on at the time it
-                # would be empty. (If the queue has 20 minutes in it, we'll
-                # fill it with what should be on 20 minutes from now)
-                queue_feed_time = self.estimated_time_at_end_of_current_video()
-                remaining_seconds = int(remaining_queue_duration)
-                remaining_milliseconds = int((remaining_queue_duration - remaining_seconds) * 1000)
+            self.run_loop_iteration()
+
+            # Sleep until VLC wakes us. We clear the event before looking at
+            # the semaphore again, so an end-of-media that lands in between is
+            # never lost.
+            self.wake_event.wait(timeout=HOUSEKEEPING_INTERVAL_IN_SECONDS)
+            self.wake_event.clear()
+
+
+def report_startup_time(td):
+    startup_in_seconds = time.monotonic() - LAUNCHED_AT
+    STARTUP_SECONDS.set(startup_in_seconds, **td.metric_labels)
+    print(f'Channel {td.channel_number} on the air {round(startup_in_seconds, 2)}s after launch.')
 
 
+def main():
+    # Serve metrics for Prometheus to scrape, unless turned off with METRICS_PORT=0.
+    metrics_port = int(os.getenv('METRICS_PORT', DEFAULT_METRICS_PORT))
+    if metrics_port:
+        start_metrics_server(metrics_port)
 
-                # TODO: Ensure this is into the next timeslot. Don't feed the
-                # queue with what's already playing.
-                self.feed_queue(queue_feed_time + datetime.timedelta(seconds=remaining_seconds, milliseconds=remaining_milliseconds))
+    # Create our TechnicalDirector instance
+    td = TechnicalDirector()
 
-            # Advance the queue if it's ready.
-            if self.should_move_to_next_video:
-                self.should_move_to_next_video = False
-                self.play_next_video()
+    # Attach an event listener to the VLC player so that we can play the next video
+    # as soon as VLC reports that the in progress one has finished.
+    td.vlc_controller.on_end_reached(td.react_to_vlc_media_player_end_reached_event)
 
-            time.sleep(0.5)
+    # Hit play
+    td.play_next_video()
+    report_startup_time(td)
 
-# Create our TechnicalDirector instance
-td = TechnicalDirector()
+    # From here on, keep an eye on the player in case it stalls.
+    td.watchdog.start()
 
-# Attach an event listener to the VLC player so that we can play the next video
-# as soon as VLC reports that the in progress one has finished.
-events = td.vlc_controller.player.event_manager()
-events.event_attach(EventType.MediaPlayerEndReached, td.react_to_vlc_media_player_end_reached_event)
+    # Endlessly add scheduled items to the queue and sleep long enough to let them
+    # play.
+    td.queue_fill_advance_and_sleep_loop()
 
-# Hit play
-td.play_next_video()
 
-# Endlessly add scheduled items to the queue and sleep long enough to let them
-# play.
-td.queue_fill_advance_and_sleep_loop()
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,337 @@
+"""
+Make Pi-friendly renditions of the videos that are coming up, ahead of time.
+
+    poetry run python technical_director/transcode_cache.py --channel 7 --hours 24 --commercials
+
+The Pi decodes H.264 in hardware, at composite resolution, without
+breaking a sweat. HEVC, high bitrate 1080p, and exotic audio are another
+story. This re-encodes the upcoming listings (and/or the commercial catalog,
+and/or any files or directories given) into H.264 at 480 lines with AAC
+stereo audio, with a keyframe at every chapter boundary so cutting to a
+commercial break and back is clean. The director plays a rendition in place
+of the original whenever one exists.
+
+Encoding is slow. Run this on a beefier build host pointed at the same
+RENDITION_DIR (the source paths have to be the same there as on the Pi), or
+on the Pi itself with --nice during idle hours.
+"""
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from ffmpy import FFmpeg
+
+# How much storage the renditions may use.
+DEFAULT_BUDGET_IN_BYTES = 32 * 1024 * 1024 * 1024
+
+# Everything about how a rendition is encoded. Changing any of it changes
+# every fingerprint, so old renditions stop being used and age out.
+RENDITION_PROFILE = {
+    'height': 480,
+    'video': '-c:v libx264 -preset veryfast -profile:v high -level 4.0 -crf 21 -pix_fmt yuv420p',
+    'audio': '-c:a aac -b:a 160k -ac 2',
+}
+
+# How much of the start and end of a file go into its fingerprint. Hashing
+# whole episodes over the NAS would take longer than encoding them.
+FINGERPRINT_SAMPLE_IN_BYTES = 1024 * 1024
+
+# x264 already uses every core, so a couple of files at a time is plenty.
+DEFAULT_WORKERS = 2
+
+
+def default_rendition_dir() -> Path:
+    return Path.home().joinpath('.mylittlecableco', 'technical_director', 'renditions')
+
+
+def content_fingerprint(file_path) -> str:
+    # The size plus the first and last megabyte, and the profile we encode
+    # with. A file copied or moved on the NAS keeps its fingerprint, a
+    # re-encoded one doesn't.
+    digest = hashlib.sha1(json.dumps(RENDITION_PROFILE, sort_keys=True).encode('UTF-8'))
+    size = os.stat(file_path).st_size
+    digest.update(str(size).encode('UTF-8'))
+    with open(file_path, 'rb') as source:
+        digest.update(source.read(FINGERPRINT_SAMPLE_IN_BYTES))
+        if size > FINGERPRINT_SAMPLE_IN_BYTES:
+            source.seek(max(size - FINGERPRINT_SAMPLE_IN_BYTES, FINGERPRINT_SAMPLE_IN_BYTES))
+            digest.update(source.read(FINGERPRINT_SAMPLE_IN_BYTES))
+    return digest.hexdigest()
+
+
+def source_identity(file_path):
+    stat_result = os.stat(file_path)
+    return f'{file_path}|{stat_result.st_size}|{stat_result.st_mtime_ns}'
+
+
+def encode_rendition(file_path, destination, keyframe_times=(), nice=False):
+    """
+    Runs in a worker process. Encodes `file_path` to `destination`, through a
+    temporary file so a half-written rendition is never picked up.
+    """
+    if nice:
+        os.nice(19)
+    height = RENDITION_PROFILE['height']
+    output_options = [
+        '-map 0:v:0 -map 0:a:0? -map_chapters 0',
+        # Only ever scale down, and keep the width even for x264.
+        f"-vf 'scale=-2:min({height}\\,ih)'",
+        RENDITION_PROFILE['video'],
+        RENDITION_PROFILE['audio'],
+        '-movflags +faststart -f mp4',
+    ]
+    if keyframe_times:
+        output_options.append('-force_key_frames ' + ','.join(f'{float(keyframe_time):.3f}' for keyframe_time in keyframe_times))
+    partial = f'{destination}.partial'
+    cmd = FFmpeg(
+        global_options='-hide_banner -nostats -loglevel error -y',
+        inputs={file_path: None},
+        outputs={partial: ' '.join(output_options)},
+    )
+    try:
+        cmd.run(stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        os.replace(partial, destination)
+    except BaseException:
+        try:
+            os.unlink(partial)
+        except FileNotFoundError:
+            pass
+        raise
+    return destination
+
+
+class TranscodeCache:
+    """
+    Renditions on disk, named after the fingerprint of the file they were
+    made from, plus an index from source file (path, size, and mtime) to
+    fingerprint so the director can find a rendition without reading the
+    source.
+
+    The transcoder writes the index and evicts the least recently played
+    renditions once they're over budget. The director only reads: it
+    reloads the index when it changes and touches a rendition when it airs
+    it.
+    """
+
+    def __init__(self, rendition_dir=None, budget_in_bytes=DEFAULT_BUDGET_IN_BYTES):
+        self.rendition_dir = Path(rendition_dir or os.getenv('RENDITION_DIR') or default_rendition_dir())
+        # Renditions on a share (made by a build host) are worth copying
+        # locally ahead of time, ones on the Pi's own storage aren't.
+        self.is_local = self.rendition_dir == default_rendition_dir()
+        self.rendition_dir.mkdir(parents=True, exist_ok=True)
+        self.budget_in_bytes = budget_in_bytes
+        self._lock = threading.Lock()
+        # Source identity -> fingerprint.
+        self._index = {}
+        self._index_mtime_ns = None
+        # Source path -> rendition path, for what we've looked up this run.
+        self._renditions_by_source = {}
+
+    @property
+    def index_path(self) -> Path:
+        return self.rendition_dir / 'index.json'
+
+    def rendition_path(self, fingerprint) -> Path:
+        return self.rendition_dir / f'{fingerprint}.mp4'
+
+    def rendition_path_for(self, file_path):
+        """
+        The rendition of `file_path` if there is one, otherwise None.
+
+        The director asks for every upcoming video on every pass of its loop,
+        so the answer is remembered until the index changes. Only the first
+        lookup stats the source.
+        """
+        self._reload_index_if_changed()
+        with self._lock:
+            if file_path in self._renditions_by_source:
+                return self._renditions_by_source[file_path]
+        try:
+            identity = source_identity(file_path)
+        except OSError:
+            return None
+        with self._lock:
+            fingerprint = self._index.get(identity)
+        rendition = None
+        if fingerprint is not None and self.rendition_path(fingerprint).exists():
+            rendition = str(self.rendition_path(fingerprint))
+        with self._lock:
+            self._renditions_by_source[file_path] = rendition
+        return rendition
+
+    def mark_played(self, file_path):
+        # The director is putting the rendition of `file_path` on the air.
+        # Touch it, that's what keeps it from being evicted. Lookups don't, or
+        # everything coming up would look freshly played.
+        with self._lock:
+            rendition = self._renditions_by_source.get(file_path)
+        if rendition is None:
+            return
+        try:
+            os.utime(rendition)
+        except FileNotFoundError:
+            with self._lock:
+                self._renditions_by_source.pop(file_path, None)
+
+    def record(self, file_path, fingerprint):
+        # Transcoder only.
+        with self._lock:
+            self._index[source_identity(file_path)] = fingerprint
+            self._write_index()
+
+    def fingerprint_for(self, file_path):
+        # The fingerprint from the index if this version of the file was seen
+        # before, otherwise read from the file.
+        self._reload_index_if_changed()
+        with self._lock:
+            fingerprint = self._index.get(source_identity(file_path))
+        return fingerprint or content_fingerprint(file_path)
+
+    def evict(self, keep=()):
+        # Transcoder only. Drop the least recently played renditions until
+        # we're under budget, never the ones in `keep`.
+        renditions = []
+        for path in self.rendition_dir.glob('*.mp4'):
+            stat_result = path.stat()
+            renditions.append((stat_result.st_mtime, path, stat_result.st_size))
+        used = sum(size for _, _, size in renditions)
+        evicted = set()
+        for _, path, size in sorted(renditions):
+            if used <= self.budget_in_bytes:
+                break
+            if path.stem in keep:
+                continue
+            path.unlink()
+            used -= size
+            evicted.add(path.stem)
+        if evicted:
+            with self._lock:
+                self._index = {identity: fingerprint for identity, fingerprint in self._index.items() if fingerprint not in evicted}
+                self._write_index()
+            print(f'Evicted {len(evicted)} rendition(s) to stay under budget.')
+
+    def _reload_index_if_changed(self):
+        try:
+            mtime_ns = self.index_path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime_ns == self._index_mtime_ns:
+            return
+        try:
+            index = json.loads(self.index_path.read_text())
+        except (ValueError, OSError) as e:
+            print(f'Ignoring unreadable rendition index: {e}')
+            return
+        with self._lock:
+            self._index = index
+            self._index_mtime_ns = mtime_ns
+            self._renditions_by_source = {}
+
+    def _write_index(self):
+        # Must be called with the lock held.
+        descriptor, temporary_path = tempfile.mkstemp(dir=self.rendition_dir, prefix='.index.', suffix='.tmp')
+        with os.fdopen(descriptor, 'w') as temporary_file:
+            json.dump(self._index, temporary_file)
+        os.replace(temporary_path, self.index_path)
+        self._index_mtime_ns = self.index_path.stat().st_mtime_ns
+
+
+def upcoming_listing_paths(channel_number, hours):
+    from scheduler_client import SchedulerClient
+
+    now = datetime.datetime.now()
+    blocks = SchedulerClient().blocks_between(channel_number, now, now + datetime.timedelta(hours=hours))
+    return [block['file_path'] for block in blocks if block['file_path']]
+
+
+def commercial_paths():
+    from scheduler_client import SchedulerClient
+
+    return [commercial['file_path'] for commercial in SchedulerClient().get_all_commercials()]
+
+
+def paths_under(path):
+    from indexer import find_videos
+
+    if os.path.isdir(path):
+        return [file_path for file_path, _, _ in find_videos([path])]
+    return [path]
+
+
+def keyframe_times_for(file_path):
+    # Chapter boundaries, from the file or from break detection.
+    from video import Video
+
+    return [chapter['start_time'] for chapter in Video(file_path).chapters()[1:]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('paths', nargs='*', help='Files or directories to transcode.')
+    parser.add_argument('--channel', help='Transcode what this channel is airing in the next --hours.')
+    parser.add_argument('--hours', type=float, default=24)
+    parser.add_argument('--commercials', action='store_true', help='Transcode the commercial catalog.')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS)
+    parser.add_argument('--nice', action='store_true', help='Run the encoders at the lowest priority.')
+    parser.add_argument('--budget-gb', type=float, default=float(os.getenv('RENDITION_BUDGET_GB', DEFAULT_BUDGET_IN_BYTES / 1024 ** 3)))
+    args = parser.parse_args()
+
+    file_paths = []
+    if args.channel:
+        file_paths += upcoming_listing_paths(args.channel, args.hours)
+    if args.commercials:
+        file_paths += commercial_paths()
+    for path in args.paths:
+        file_paths += paths_under(path)
+    if not file_paths:
+        parser.error('Nothing to transcode. Give files or directories, --channel, or --commercials.')
+
+    cache = TranscodeCache(budget_in_bytes=int(args.budget_gb * 1024 ** 3))
+    started = time.monotonic()
+    wanted = set()
+    futures = {}
+    transcoded = skipped = failed = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        for file_path in dict.fromkeys(file_paths):
+            try:
+                fingerprint = cache.fingerprint_for(file_path)
+                wanted.add(fingerprint)
+                destination = cache.rendition_path(fingerprint)
+                if destination.exists():
+                    cache.record(file_path, fingerprint)
+                    skipped += 1
+                    continue
+                futures[executor.submit(encode_rendition, file_path, str(destination), keyframe_times_for(file_path), args.nice)] = (file_path, fingerprint)
+            except Exception as e:
+                failed += 1
+                print(f'Could not transcode {file_path}: {e}')
+
+        for future in as_completed(futures):
+            file_path, fingerprint = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                failed += 1
+                print(f'Could not transcode {file_path}: {e}')
+                continue
+            cache.record(file_path, fingerprint)
+            cache.evict(keep=wanted)
+            transcoded += 1
+            print(f'Transcoded {file_path}')
+
+    print(f'Transcoded {transcoded} file(s), {skipped} already done, {failed} failed, '
+          f'in {round(time.monotonic() - started, 1)}s.')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
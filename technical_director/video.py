@@ -1,20 +1,113 @@
 import uuid
+from decimal import Decimal
+
 from video_utils import (
+    DEFAULT_VIDEO_LOOP_IN_SECONDS,
     get_video_information,
     get_video_duration_in_seconds,
     get_default_video_filepath,
 )
 
+# How long the default video runs when there's nothing else to play.
+DEFAULT_VIDEO_DURATION_IN_SECONDS = 1800
+
 
 class Video:
+    # Hours of queue can mean hundreds of these, keep them compact.
+    __slots__ = (
+        'file_path',
+        'batch_label',
+        'label',
+        '_start_at_second',
+        '_end_at_second',
+        '_duration_in_seconds',
+        '_video_information',
+        'is_commercial',
+        'block_end',
+        'scheduling_block',
+        'planned_start',
+        'repeat_count',
+    )
+
     @classmethod
-    def default_video(cls):
-        return cls(get_default_video_filepath(), duration_in_seconds=1800, label='Dead Air')
+    def default_video(cls, channel_number=None):
+        return cls.dead_air(DEFAULT_VIDEO_DURATION_IN_SECONDS, channel_number)[0]
 
-    def __init__(self, file_path, batch_label=None, duration_in_seconds=None, label=None):
+    @classmethod
+    def dead_air(cls, duration_in_seconds, channel_number=None) -> list:
+        """
+        The default video's loop, repeated to fill exactly
+        `duration_in_seconds`: one Video that plays the whole loop as many
+        times as fits, and one that plays the part of it that's left over.
+        """
+        file_path = get_default_video_filepath(channel_number)
+        loop_length = Decimal(DEFAULT_VIDEO_LOOP_IN_SECONDS)
+        duration_in_seconds = Decimal(str(duration_in_seconds))
+        full_loops = int(duration_in_seconds // loop_length)
+        leftover = round(duration_in_seconds - full_loops * loop_length, 3)
+        videos = []
+        if full_loops:
+            loops = cls(file_path, label='Dead Air', repeat_count=full_loops - 1)
+            # The loop file may be a little longer than we asked ffmpeg for,
+            # so every pass is cut at exactly the loop length.
+            loops.end_at_second = loop_length
+            videos.append(loops)
+        if leftover > 0:
+            rest = cls(file_path, label='Dead Air')
+            rest.end_at_second = leftover
+            videos.append(rest)
+        return videos
+
+    @classmethod
+    def segment(cls, file_path, duration_in_seconds, start_at_second=None, end_at_second=None, batch_label=None, **kwargs):
+        # A part of a file whose length we already know, so nothing has to be
+        # probed to play it.
+        video = cls(file_path, **kwargs)
+        if batch_label:
+            video.batch_label = batch_label
+        video._start_at_second = start_at_second
+        video._end_at_second = end_at_second
+        video._duration_in_seconds = Decimal(duration_in_seconds)
+        return video
+
+    def remainder_after(self, offset_in_seconds) -> list:
+        """
+        What's left to play `offset_in_seconds` into this video, as a list:
+        empty if it's over, one Video picking up at the offset, or, if we're
+        partway through a repeated video, the rest of the current pass and
+        then the remaining passes.
+        """
+        offset_in_seconds = Decimal(offset_in_seconds)
+        duration_in_seconds = self.duration_in_seconds()
+        if offset_in_seconds >= duration_in_seconds:
+            return []
+        pass_length = duration_in_seconds / (1 + self.repeat_count)
+        passes_done = int(offset_in_seconds // pass_length)
+        into_pass = offset_in_seconds - passes_done * pass_length
+        start_at_second = Decimal(self.start_at_second or 0)
+
+        remainder = []
+        if into_pass:
+            remainder.append(self.segment(self.file_path, pass_length - into_pass, start_at_second=round(start_at_second + into_pass, 3),
+                                          end_at_second=self.end_at_second, batch_label=self.batch_label, label=self.label,
+                                          is_commercial=self.is_commercial))
+            passes_done += 1
+        passes_left = 1 + self.repeat_count - passes_done
+        if passes_left > 0:
+            remainder.append(self.segment(self.file_path, pass_length * passes_left, start_at_second=self.start_at_second,
+                                          end_at_second=self.end_at_second, batch_label=self.batch_label, label=self.label,
+                                          is_commercial=self.is_commercial, repeat_count=passes_left - 1))
+        for video in remainder:
+            video.block_end = self.block_end
+            video.scheduling_block = self.scheduling_block
+        return remainder
+
+    def __init__(self, file_path, batch_label=None, duration_in_seconds=None, label=None, is_commercial=False, repeat_count=0):
         self.file_path = file_path
         self._start_at_second = None
         self._end_at_second = None
+        # How many more times the player goes through it after the first.
+        self.repeat_count = repeat_count
         # batch_label is used for debugging purposes. Use it to remember what
         # videos were queued as part of the same process.
         self.batch_label = label or batch_label or str(uuid.uuid4())[-6:]
@@ -22,7 +115,15 @@ class Video:
         # If we know the duration upfront, no need to recalculate it.
         self._duration_in_seconds = duration_in_seconds
         self.label = label
-
+        self.is_commercial = is_commercial
+        # The datetime the scheduling block this video was planned for has
+        # to end at. Set by the planner, used to correct drift.
+        self.block_end = None
+        # The scheduling block (as the Scheduler described it) this video
+        # was planned for, so the plan can be checked against lineup changes.
+        self.scheduling_block = None
+        # When the video was expected to air at the moment it was queued.
+        self.planned_start = None
 
     def duration_in_seconds(self):
         if self._duration_in_seconds:
@@ -41,8 +142,14 @@ class Video:
         else:
             # We do not specify a start or an end, so we play the whole video.
             self._duration_in_seconds = get_video_duration_in_seconds(self.video_information())
+        # However long one pass is, the player makes this many.
+        self._duration_in_seconds *= 1 + self.repeat_count
         return self._duration_in_seconds
 
+    def duration_needs_probe(self) -> bool:
+        # Whether working out how long this is means asking ffprobe.
+        return not self._duration_in_seconds and not self.end_at_second
+
     def video_information(self):
         if self._video_information:
             return self._video_information
@@ -50,7 +157,10 @@ class Video:
         return self._video_information
 
     def chapters(self):
-        return self.video_information().get('chapters', [])
+        # Chapter markers from the file itself win. Failing that, the break
+        # points the indexer found in the picture and sound (if it looked).
+        video_information = self.video_information()
+        return video_information.get('chapters') or video_information.get('detected_chapters', [])
 
     def initialize_caches(self):
         self._duration_in_seconds = None
@@ -0,0 +1,152 @@
+import bisect
+import datetime
+import threading
+from decimal import Decimal
+
+# Popped entries are only dropped from the underlying list once at least this
+# many have piled up and they make up half of it. Until then popping is just
+# moving an index.
+COMPACTION_THRESHOLD = 64
+
+
+class VideoQueue:
+    """
+    The videos lined up to play, in order, with their airtimes precomputed.
+
+    Alongside every video we keep the running total of the durations before
+    it (a prefix sum), so the queue's total duration, when a given video
+    starts, and which video is on at a given moment are all answered without
+    walking the queue. Popping the front only advances an index.
+
+    The queue is safe to share between the planner thread, which adds whole
+    blocks to it, and the playback thread, which takes from the front.
+    """
+
+    def __init__(self, videos=()):
+        self._videos = []
+        # _starts[i] is the offset, in seconds, at which _videos[i] starts,
+        # counted from an arbitrary origin that never moves.
+        self._starts = []
+        self._end = Decimal(0)
+        self._head = 0
+        self._lock = threading.RLock()
+        self.extend(videos)
+
+    def append(self, video):
+        with self._lock:
+            self._starts.append(self._end)
+            self._videos.append(video)
+            self._end += Decimal(video.duration_in_seconds())
+
+    def extend(self, videos):
+        # Returns how many seconds after the front of the queue each of the
+        # new videos starts.
+        with self._lock:
+            offsets = []
+            for video in videos:
+                self.append(video)
+                offsets.append(self._starts[-1] - self._starts[self._head])
+            return offsets
+
+    def popleft(self):
+        with self._lock:
+            if self._head >= len(self._videos):
+                raise IndexError('pop from an empty VideoQueue')
+            video = self._videos[self._head]
+            self._head += 1
+            if self._head >= COMPACTION_THRESHOLD and self._head * 2 >= len(self._videos):
+                del self._videos[:self._head]
+                del self._starts[:self._head]
+                self._head = 0
+            return video
+
+    def peek(self):
+        with self._lock:
+            return self._videos[self._head] if self._head < len(self._videos) else None
+
+    def truncate(self, index):
+        """
+        Remove the video at `index` and everything after it, and return them.
+        """
+        with self._lock:
+            position = self._head + index
+            removed = self._videos[position:]
+            if removed:
+                self._end = self._starts[position]
+                del self._videos[position:]
+                del self._starts[position:]
+            return removed
+
+    def replace(self, start_index, stop_index, videos):
+        """
+        Swap the videos from `start_index` up to (not including) `stop_index`
+        for `videos`, in one step, and return the ones taken out.
+        """
+        with self._lock:
+            tail = self.truncate(start_index)
+            removed = tail[:stop_index - start_index]
+            self.extend(videos)
+            self.extend(tail[stop_index - start_index:])
+            return removed
+
+    def duration_in_seconds(self) -> Decimal:
+        with self._lock:
+            if self._head >= len(self._videos):
+                return Decimal(0)
+            return self._end - self._starts[self._head]
+
+    def offset_of(self, index) -> Decimal:
+        """
+        How many seconds after the front of the queue starts the video at
+        `index` starts.
+        """
+        with self._lock:
+            return self._starts[self._head + index] - self._starts[self._head]
+
+    def index_at(self, offset_in_seconds):
+        """
+        The index of the video that will be playing `offset_in_seconds` after
+        the front of the queue starts, or None if the queue has run out by
+        then.
+        """
+        with self._lock:
+            if self._head >= len(self._videos) or offset_in_seconds < 0:
+                return None
+            target = self._starts[self._head] + Decimal(offset_in_seconds)
+            if target >= self._end:
+                return None
+            return bisect.bisect_right(self._starts, target, lo=self._head) - 1 - self._head
+
+    def airtimes(self, front_starts_at):
+        """
+        Every queued video paired with the datetime it will air, given the
+        datetime the front of the queue starts.
+        """
+        with self._lock:
+            if self._head >= len(self._videos):
+                return []
+            origin = self._starts[self._head]
+            return [
+                (video, front_starts_at + datetime.timedelta(seconds=float(start - origin)))
+                for video, start in zip(self._videos[self._head:], self._starts[self._head:])
+            ]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._videos) - self._head
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def __getitem__(self, index):
+        with self._lock:
+            if index < 0:
+                index += len(self)
+            if not 0 <= index < len(self):
+                raise IndexError('VideoQueue index out of range')
+            return self._videos[self._head + index]
+
+    def __iter__(self):
+        # Iterate over a copy, so the queue can change while we loop.
+        with self._lock:
+            return iter(self._videos[self._head:])
@@ -1,10 +1,14 @@
 from decimal import Decimal
 import json
 from pathlib import Path
+import re
 import subprocess
 
 from ffmpy import FFmpeg, FFprobe
 
+from metadata_cache import get_metadata_cache
+from metrics import FFPROBE_DURATION_SECONDS
+
 
 def get_video_duration_in_seconds(video_information) -> Decimal:
     chapter_info = video_information['chapters']
@@ -20,14 +24,104 @@ def get_video_duration_in_seconds(video_information) -> Decimal:
 
 
 def get_video_information(video_path) -> dict:
+    # ffprobe over the NAS takes seconds on a Pi, so only do it the first time
+    # we see a given version of a file.
+    return get_metadata_cache().get_or_probe(video_path, probe_video_information)
+
+
+def probe_video_information(video_path) -> dict:
     cmd = FFprobe(global_options='-print_format json -show_streams -show_chapters', inputs={video_path: None})
-    stdout, stderr = cmd.run(stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    with FFPROBE_DURATION_SECONDS.time():
+        stdout, stderr = cmd.run(stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
     return json.loads(stdout.decode('UTF-8').rstrip())
 
 
+# Black frames and silence both have to last at least this long to count as
+# a break in the show.
+BREAK_DETECTION_MINIMUM_IN_SECONDS = 0.3
+# Breaks this close to the start or end of a show, or to each other, are
+# ignored. Nobody wants a commercial break 30 seconds into an episode.
+MINIMUM_SEGMENT_IN_SECONDS = 4 * 60
+# About as many breaks as a chaptered episode would have.
+MAXIMUM_DETECTED_BREAKS = 3
+
+BLACK_INTERVAL_PATTERN = re.compile(r'black_start:\s*([\d.]+)\s+black_end:\s*([\d.]+)')
+SILENCE_START_PATTERN = re.compile(r'silence_start:\s*([\d.]+)')
+SILENCE_END_PATTERN = re.compile(r'silence_end:\s*([\d.]+)')
+
+
+def detect_natural_breaks(video_path, duration_in_seconds) -> list:
+    """
+    Look for the places a show fades to black and goes quiet at the same
+    time, which is where its commercial breaks used to be, and return them as
+    chapters (in the same shape ffprobe gives us), or [] if there aren't any.
+
+    This decodes the whole file, so it's for the indexer, not for playback.
+    """
+    cmd = FFmpeg(
+        global_options='-hide_banner -nostats',
+        inputs={video_path: None},
+        outputs={'-': f'-vf blackdetect=d={BREAK_DETECTION_MINIMUM_IN_SECONDS}:pix_th=0.10 '
+                      f'-af silencedetect=n=-50dB:d={BREAK_DETECTION_MINIMUM_IN_SECONDS} -f null'},
+    )
+    stdout, stderr = cmd.run(stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    return chapters_from_break_points(parse_break_points(stderr.decode('UTF-8', errors='replace')), duration_in_seconds)
+
+
+def parse_break_points(ffmpeg_output) -> list:
+    # The middle of every black stretch that overlaps a silent one.
+    black_intervals = [(Decimal(start), Decimal(end)) for start, end in BLACK_INTERVAL_PATTERN.findall(ffmpeg_output)]
+    silence_starts = [Decimal(start) for start in SILENCE_START_PATTERN.findall(ffmpeg_output)]
+    silence_ends = [Decimal(end) for end in SILENCE_END_PATTERN.findall(ffmpeg_output)]
+    silent_intervals = list(zip(silence_starts, silence_ends))
+    break_points = []
+    for black_start, black_end in black_intervals:
+        if any(silence_start < black_end and black_start < silence_end for silence_start, silence_end in silent_intervals):
+            break_points.append((black_start + black_end) / 2)
+    return break_points
+
+
+def chapters_from_break_points(break_points, duration_in_seconds) -> list:
+    duration_in_seconds = Decimal(duration_in_seconds)
+    candidates = []
+    for break_point in sorted(break_points):
+        too_close_to_an_end = break_point < MINIMUM_SEGMENT_IN_SECONDS or duration_in_seconds - break_point < MINIMUM_SEGMENT_IN_SECONDS
+        too_close_to_the_last = candidates and break_point - candidates[-1] < MINIMUM_SEGMENT_IN_SECONDS
+        if not (too_close_to_an_end or too_close_to_the_last):
+            candidates.append(break_point)
+    if not candidates:
+        return []
+
+    # Too many to use? Keep the ones closest to evenly splitting the show.
+    break_count = min(len(candidates), MAXIMUM_DETECTED_BREAKS)
+    chosen = set()
+    for index in range(1, break_count + 1):
+        ideal = duration_in_seconds * index / (break_count + 1)
+        chosen.add(min((candidate for candidate in candidates if candidate not in chosen), key=lambda candidate: abs(candidate - ideal)))
+
+    boundaries = [Decimal(0)] + sorted(chosen) + [duration_in_seconds]
+    return [
+        {'id': index, 'start_time': f'{start:.6f}', 'end_time': f'{end:.6f}', 'detected': True}
+        for index, (start, end) in enumerate(zip(boundaries, boundaries[1:]))
+    ]
+
+
+# How long the dead air loop is. Short enough to encode in moments on a Pi,
+# long enough that VLC isn't constantly starting it over.
+DEFAULT_VIDEO_LOOP_IN_SECONDS = 10
+
+
 def get_default_video_filepath(channel_number=None) -> str:
+    # A short loop of color bars, captioned with the channel. It's played on
+    # repeat for as long as there's dead air (see `Video.dead_air`), so
+    # making it takes a second or two, not the many minutes a Pi needs to
+    # encode half an hour of bars. Each caption gets its own file.
+    video_caption = "MyLittleCableCo"
+    if channel_number is not None:
+        video_caption += f" Ch {channel_number}"
+
     td_config_dir = Path.home().joinpath('.mylittlecableco', 'technical_director')
-    default_video_file = td_config_dir / 'smpte.mp4'
+    default_video_file = td_config_dir / f"smpte-loop-{re.sub(r'[^A-Za-z0-9]+', '-', video_caption)}.mp4"
     if default_video_file.exists():
         return str(default_video_file)
 
@@ -36,14 +130,13 @@ def get_default_video_filepath(channel_number=None) -> str:
     # Ensure the config directory exists
     td_config_dir.mkdir(parents=True, exist_ok=True)
 
-    video_caption = "MyLittleCableCo"
-    if channel_number is not None:
-        video_caption += f" Ch {channel_number}"
-
-    # Form the ffmpeg command to generate the test file
+    # Form the ffmpeg command to generate the test file. It goes to a
+    # temporary name first, so a half-written loop is never played.
+    partial_file = td_config_dir / f'.{default_video_file.name}.partial'
     cmd = FFmpeg(
-        inputs={None: f"-f lavfi -i smptebars=size=640x480,drawtext=text='{video_caption}':font='mono|bold':fontcolor=white:fontsize=42:box=1:boxcolor=black@0.5:boxborderw=5:x=(w-text_w)/2:y=(h-text_h)/2 -t 1800"},
-        outputs={default_video_file: None}
+        inputs={None: f"-f lavfi -i smptebars=size=640x480,drawtext=text='{video_caption}':font='mono|bold':fontcolor=white:fontsize=42:box=1:boxcolor=black@0.5:boxborderw=5:x=(w-text_w)/2:y=(h-text_h)/2 -t {DEFAULT_VIDEO_LOOP_IN_SECONDS}"},
+        outputs={partial_file: '-f mp4'}
     )
     stdout, stderr = cmd.run(stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    partial_file.replace(default_video_file)
     return str(default_video_file)
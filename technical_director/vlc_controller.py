@@ -1,19 +1,132 @@
 import datetime
-from vlc import Instance
+import time
+from collections import deque
+from decimal import Decimal
+
+from vlc import EventType, Instance, MediaParseFlag, State
+
+from metrics import TRANSITION_GAP_SECONDS, TRANSITION_LATENCY_SECONDS
 
 DEFAULT_PLAYER_OPTIONS = [
     '--no-osd',
     '--no-video-title-show',
 ]
 
+# How long libvlc may spend pre-parsing the next media in the background.
+PREROLL_PARSE_TIMEOUT_IN_MILLISECONDS = 5000
+
+# How many recent transitions we remember for reporting.
+TRANSITION_HISTORY_LENGTH = 100
+
+# libvlc's player states, by the names the watchdog uses.
+PLAYER_STATES = {
+    State.NothingSpecial: 'idle',
+    State.Opening: 'opening',
+    State.Buffering: 'buffering',
+    State.Playing: 'playing',
+    State.Paused: 'paused',
+    State.Stopped: 'stopped',
+    State.Ended: 'ended',
+    State.Error: 'error',
+}
+
+
 class VLCController:
-    def __init__(self):
-        self.vlc_instance = Instance(' '.join(DEFAULT_PLAYER_OPTIONS))
+    def __init__(self, player_options=None, metric_labels=None):
+        # `player_options` are added to the defaults, e.g. to send this
+        # player to a particular display when one box drives several channels.
+        self.vlc_instance = Instance(' '.join(DEFAULT_PLAYER_OPTIONS + list(player_options or [])))
         self.player = self.vlc_instance.media_player_new()
         self.player.set_fullscreen(True)
+        self.metric_labels = metric_labels or {}
+
+        # The next media, built and parsed while the current one plays so
+        # that cutting to it doesn't have to wait on the NAS.
+        self.prepared_media = None
+        self.prepared_key = None
+
+        # Transition latency is the time from VLC reporting the end of one
+        # media to it reporting that the next one is playing.
+        self.end_reached_at = None
+        self.last_transition_latency_in_seconds = None
+        self.transition_latencies_in_seconds = deque(maxlen=TRANSITION_HISTORY_LENGTH)
+
+        self.events = self.player.event_manager()
+        self.events.event_attach(EventType.MediaPlayerPlaying, self.react_to_playing_event)
 
     def play(self):
+        if self.end_reached_at is not None:
+            TRANSITION_GAP_SECONDS.observe(time.monotonic() - self.end_reached_at, **self.metric_labels)
         self.player.play()
 
     def set_media(self, media):
         self.player.set_media(media)
+
+    def position_in_seconds(self):
+        # Where the player actually is in the current media, or None if it
+        # hasn't started playing it yet.
+        position_in_milliseconds = self.player.get_time()
+        if position_in_milliseconds is None or position_in_milliseconds < 0:
+            return None
+        return Decimal(position_in_milliseconds) / 1000
+
+    def state(self) -> str:
+        return PLAYER_STATES.get(self.player.get_state(), 'idle')
+
+    def on_error(self, callback):
+        # VLC gave up on the current media. It won't say it ended.
+        self.events.event_attach(EventType.MediaPlayerEncounteredError, callback)
+
+    def on_end_reached(self, callback):
+        # libvlc only keeps one callback per event type, so the controller
+        # owns the attachment and passes the event along after noting when
+        # it happened.
+        def react_to_end_reached_event(event):
+            self.end_reached_at = time.monotonic()
+            callback(event)
+        self.events.event_attach(EventType.MediaPlayerEndReached, react_to_end_reached_event)
+
+    def react_to_playing_event(self, event):
+        if self.end_reached_at is None:
+            return
+        latency = time.monotonic() - self.end_reached_at
+        self.end_reached_at = None
+        self.last_transition_latency_in_seconds = latency
+        self.transition_latencies_in_seconds.append(latency)
+        TRANSITION_LATENCY_SECONDS.observe(latency, **self.metric_labels)
+
+    def media_for(self, file_path, start_at_second=None, end_at_second=None, repeat_count=0):
+        media = self.vlc_instance.media_new(file_path)
+        if start_at_second:
+            media.add_option(f':start-time={round(Decimal(start_at_second), 3)}')
+        if end_at_second:
+            media.add_option(f':stop-time={round(Decimal(end_at_second), 3)}')
+        if repeat_count:
+            # Each pass goes from the start time to the stop time again.
+            media.add_option(f':input-repeat={repeat_count}')
+        return media
+
+    def prepare(self, file_path, start_at_second=None, end_at_second=None, repeat_count=0):
+        key = (file_path, start_at_second, end_at_second, repeat_count)
+        if key == self.prepared_key:
+            return
+        media = self.media_for(file_path, start_at_second, end_at_second, repeat_count)
+        # This returns immediately, libvlc parses on its own thread.
+        media.parse_with_options(MediaParseFlag.local, PREROLL_PARSE_TIMEOUT_IN_MILLISECONDS)
+        self.prepared_media = media
+        self.prepared_key = key
+
+    def take_prepared_media(self, file_path, start_at_second=None, end_at_second=None, repeat_count=0):
+        # Hand over the pre-rolled media if it's for what we're about to play,
+        # otherwise the caller builds it from scratch.
+        media = None
+        if self.prepared_key == (file_path, start_at_second, end_at_second, repeat_count):
+            media = self.prepared_media
+        self.prepared_media = None
+        self.prepared_key = None
+        return media
+
+    def average_transition_latency_in_seconds(self):
+        if not self.transition_latencies_in_seconds:
+            return None
+        return sum(self.transition_latencies_in_seconds) / len(self.transition_latencies_in_seconds)
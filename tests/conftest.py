@@ -0,0 +1,54 @@
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+# The director's modules import each other by bare name (they are run as a
+# script from inside technical_director/), so make them importable the same
+# way. Appended rather than prepended so `import technical_director` still
+# finds the package.
+sys.path.append(str(Path(__file__).resolve().parent.parent / 'technical_director'))
+
+# The rest can only be imported once the path above is set up.
+import commercial_catalog
+import metadata_cache
+import video_utils
+from clock import VirtualClock
+from commercial_catalog import CommercialCatalog
+from commercial_rotation import CommercialRotation
+from metadata_cache import MetadataCache
+from plan_store import PlanStore
+from technical_director.technical_director import TechnicalDirector
+
+from tests.fakes import START, Player
+
+
+@pytest.fixture
+def probes(monkeypatch, tmp_path):
+    # (file path, thread) for every time ffprobe would have run. The metadata
+    # cache is a real one, in a temporary directory.
+    probes = []
+
+    def probe(file_path):
+        probes.append((file_path, threading.current_thread().name))
+        return {'chapters': [{'start_time': '0', 'end_time': '600'}, {'start_time': '600', 'end_time': '1320'}],
+                'streams': [{'codec_type': 'video', 'duration': '1320'}]}
+
+    monkeypatch.setattr(video_utils, 'probe_video_information', probe)
+    monkeypatch.setattr(metadata_cache, '_shared_metadata_cache', MetadataCache(tmp_path / 'metadata.sqlite3'))
+    return probes
+
+
+@pytest.fixture
+def make_director(monkeypatch, tmp_path):
+    # A director on a fake player and a virtual clock, planning in the
+    # foreground, with nothing outside `tmp_path` touched.
+    monkeypatch.setenv('AS_RUN_MAX_MB', '0')
+
+    def make_director(scheduler_client, now=START, commercial_rotation=None):
+        monkeypatch.setattr(commercial_catalog, '_shared_commercial_catalog', CommercialCatalog(scheduler_client=scheduler_client))
+        return TechnicalDirector(channel_number='7', scheduler_client=scheduler_client, vlc_controller=Player(), clock=VirtualClock(now),
+                                 plan_in_background=False, read_ahead_budget_in_gb=0, rendition_budget_in_gb=0,
+                                 commercial_rotation=commercial_rotation or CommercialRotation(persist=False), plan_store=PlanStore(tmp_path / 'plans'))
+    return make_director
@@ -0,0 +1,118 @@
+"""
+Stand-ins for the player and the Scheduler, and a lineup to plan, shared by
+the tests that drive a whole director.
+"""
+import datetime
+import threading
+
+from scheduler_client import ChannelSchedule
+
+START = datetime.datetime(2026, 10, 19, 18, 0)
+COMMERCIALS = [{'file_path': f'/media/commercials/spot-{index}.mp4', 'duration': '30', 'subject': None} for index in range(40)]
+
+
+def listing(listing_id, file_path, start, minutes=30):
+    end = start + datetime.timedelta(minutes=minutes)
+    return {'listing_id': listing_id, 'title': f'Show {listing_id}', 'file_path': file_path,
+            'start_time': start.isoformat(), 'end_time': end.isoformat()}
+
+
+def episodes(tmp_path, count):
+    # Real files, so the metadata cache can key them.
+    file_paths = []
+    for index in range(count):
+        file_path = tmp_path / f'episode-{index}.mp4'
+        file_path.write_bytes(b'episode')
+        file_paths.append(str(file_path))
+    return file_paths
+
+
+class StubSchedulerClient:
+    def __init__(self, lineup):
+        self.schedule = ChannelSchedule(lineup)
+
+    def start_background_refresh(self):
+        pass
+
+    def blocks_between(self, channel_number, start, end):
+        return self.schedule.blocks_between(start, end)
+
+    def cached_channel_schedule(self, channel_number):
+        return self.schedule
+
+    def get_all_commercials_if_modified(self, etag=None, last_modified=None):
+        return COMMERCIALS, '"c1"', None
+
+
+class FakeMedia:
+    def __init__(self, file_path, start_at_second=None, end_at_second=None, repeat_count=0):
+        self.key = (file_path, start_at_second, end_at_second, repeat_count)
+        self.file_path = file_path
+
+
+class Player:
+    """
+    Looks like a VLCController to the director, but only remembers what it
+    was told to play, and which thread told it. `finish_current_media` and
+    `fail` fire the events VLC would, on whatever thread calls them.
+    """
+
+    def __init__(self):
+        self.current_media = None
+        self.played = []
+        self.prepared_media = None
+        self.end_reached_callback = None
+        self.error_callback = None
+        self.player_state = 'playing'
+        self.position = None
+        # (method, thread name) for every call made on the player.
+        self.calls = []
+
+    def _called(self, method):
+        self.calls.append((method, threading.current_thread().name))
+
+    def play(self):
+        self._called('play')
+        self.played.append(self.current_media)
+
+    def set_media(self, media):
+        self._called('set_media')
+        self.current_media = media
+
+    def media_for(self, file_path, start_at_second=None, end_at_second=None, repeat_count=0):
+        self._called('media_for')
+        return FakeMedia(file_path, start_at_second, end_at_second, repeat_count)
+
+    def prepare(self, file_path, start_at_second=None, end_at_second=None, repeat_count=0):
+        self._called('prepare')
+        self.prepared_media = FakeMedia(file_path, start_at_second, end_at_second, repeat_count)
+
+    def take_prepared_media(self, file_path, start_at_second=None, end_at_second=None, repeat_count=0):
+        self._called('take_prepared_media')
+        media = self.prepared_media
+        self.prepared_media = None
+        if media is None or media.key != (file_path, start_at_second, end_at_second, repeat_count):
+            return None
+        return media
+
+    def position_in_seconds(self):
+        self._called('position_in_seconds')
+        return self.position
+
+    def state(self):
+        self._called('state')
+        return self.player_state
+
+    def on_error(self, callback):
+        self.error_callback = callback
+
+    def on_end_reached(self, callback):
+        self.end_reached_callback = callback
+
+    def finish_current_media(self):
+        if self.end_reached_callback is not None:
+            self.end_reached_callback(None)
+
+    def fail(self):
+        if self.error_callback is not None:
+            self.error_callback(None)
@@ -0,0 +1,39 @@
+import datetime
+
+from as_run_log import AsRunLog, airings_between, read_records
+
+
+def test_rotates_and_reads_back_oldest_first(tmp_path):
+    path = tmp_path / 'ch7.jsonl'
+    as_run_log = AsRunLog(path, max_bytes=200, backup_count=2, flush_interval_in_seconds=0)
+    for index in range(12):
+        as_run_log.record(event='start', file_path=f'/media/tv/episode-{index}.mp4', actual_start=f'2026-10-19 20:{index:02d}:00')
+    as_run_log.close()
+
+    records = list(read_records(path))
+    assert (tmp_path / 'ch7.jsonl.1').exists()
+    assert not (tmp_path / 'ch7.jsonl.3').exists()
+    # The oldest were rotated away, what's left is the newest, in order.
+    first = 12 - len(records)
+    assert first > 0
+    assert [record['file_path'] for record in records] == [f'/media/tv/episode-{index}.mp4' for index in range(first, 12)]
+
+
+def test_what_aired_at_a_given_time(tmp_path):
+    path = tmp_path / 'ch7.jsonl'
+    as_run_log = AsRunLog(path)
+    start = datetime.datetime(2026, 10, 19, 20, 0)
+    as_run_log.record(event='start', file_path='/media/tv/show.mp4', actual_start=start)
+    as_run_log.record(event='end', file_path='/media/tv/show.mp4', actual_start=start, actual_end=start + datetime.timedelta(minutes=13))
+    as_run_log.record(event='start', file_path='/media/commercials/cola.mp4', actual_start=start + datetime.timedelta(minutes=13))
+    # The director was stopped before the commercial ended, then restarted.
+    as_run_log.record(event='start', file_path='/media/tv/show.mp4', actual_start=start + datetime.timedelta(minutes=15))
+    as_run_log.close()
+
+    def on_at(minute):
+        moment = start + datetime.timedelta(minutes=minute)
+        return [airing['file_path'] for airing in airings_between(path, moment, moment)]
+
+    assert on_at(12) == ['/media/tv/show.mp4']
+    assert on_at(14) == ['/media/commercials/cola.mp4']
+    assert on_at(40) == ['/media/tv/show.mp4']
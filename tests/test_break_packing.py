@@ -0,0 +1,48 @@
+import random
+import time
+from decimal import Decimal
+
+from break_packing import pack_commercial_break, split_break_lengths
+
+
+def commercial(duration, subject=None):
+    return {'file_path': f'/media/commercials/{duration}-{subject}.mp4', 'duration': str(duration), 'subject': subject}
+
+
+def total_duration(commercials):
+    return sum(Decimal(commercial['duration']) for commercial in commercials)
+
+
+def test_packs_close_to_target():
+    rng = random.Random(1)
+    catalog = [commercial(rng.choice([15, 30, 30, 60, 28.5, 31.2])) for _ in range(200)]
+    packed = pack_commercial_break(catalog, 125, rng=rng)
+    assert Decimal(125) <= total_duration(packed) <= Decimal(135)
+
+
+def test_never_repeats_a_subject():
+    catalog = [commercial(30, 'soda') for _ in range(10)] + [commercial(30, 'cereal') for _ in range(10)]
+    packed = pack_commercial_break(catalog, 120, rng=random.Random(2))
+    subjects = [commercial['subject'] for commercial in packed]
+    assert sorted(subjects) == ['cereal', 'soda']
+
+
+def test_terminates_when_every_commercial_shares_a_subject():
+    catalog = [commercial(30, 'soda') for _ in range(50)]
+    assert len(pack_commercial_break(catalog, 300, rng=random.Random(3))) == 1
+
+
+def test_large_catalog_is_bounded_in_time():
+    rng = random.Random(4)
+    catalog = [commercial(rng.randint(10, 120), rng.choice([None, 'a', 'b', 'c', 'd'])) for _ in range(10000)]
+    started = time.perf_counter()
+    packed = pack_commercial_break(catalog, 240, rng=rng)
+    assert time.perf_counter() - started < 2
+    assert Decimal(240) <= total_duration(packed) <= Decimal(250)
+
+
+def test_split_break_lengths_adds_up():
+    lengths = split_break_lengths(Decimal('361.5'), 4, rng=random.Random(5))
+    assert len(lengths) == 4
+    assert sum(lengths) == Decimal('361.5')
+    assert len(set(lengths)) > 1
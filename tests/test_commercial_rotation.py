@@ -0,0 +1,42 @@
+from commercial_rotation import CommercialRotation
+
+CATALOG = [
+    {'file_path': '/commercials/cola-1.mp4', 'duration': '30', 'subject': 'cola'},
+    {'file_path': '/commercials/cola-2.mp4', 'duration': '30', 'subject': 'cola'},
+    {'file_path': '/commercials/cars.mp4', 'duration': '30', 'subject': 'cars'},
+    {'file_path': '/commercials/psa.mp4', 'duration': '30', 'subject': None},
+]
+
+
+def test_recently_aired_spots_and_subjects_go_to_the_back(tmp_path):
+    rotation = CommercialRotation(tmp_path / 'rotation.json', candidate_count=2)
+    rotation.sync(CATALOG, version=1)
+    rotation.record_aired([CATALOG[0], CATALOG[3]], aired_at=1000)
+
+    # cola-2 hasn't aired, but cola did a minute ago.
+    candidates = rotation.candidates(now=1060)
+    assert [commercial['file_path'] for commercial in candidates] == ['/commercials/cars.mp4', '/commercials/cola-2.mp4']
+
+
+def test_airings_are_remembered_across_restarts(tmp_path):
+    rotation = CommercialRotation(tmp_path / 'rotation.json')
+    rotation.sync(CATALOG, version=1)
+    rotation.record_aired([CATALOG[2]], aired_at=1000)
+    rotation.save()
+
+    restarted = CommercialRotation(tmp_path / 'rotation.json', candidate_count=3)
+    restarted.sync(CATALOG, version=1)
+    assert restarted.last_aired('/commercials/cars.mp4') == 1000
+    assert '/commercials/cars.mp4' not in [commercial['file_path'] for commercial in restarted.candidates(now=2000)]
+
+
+def test_a_burst_of_airings_is_all_there_after_a_flush(tmp_path):
+    rotation = CommercialRotation(tmp_path / 'rotation.json')
+    rotation.sync(CATALOG, version=1)
+    # A plan being built records every spot in it within milliseconds.
+    for index, commercial in enumerate(CATALOG):
+        rotation.record_aired([commercial], aired_at=1000 + 30 * index)
+    rotation.flush()
+
+    restarted = CommercialRotation(tmp_path / 'rotation.json')
+    assert [restarted.last_aired(commercial['file_path']) for commercial in CATALOG] == [1000, 1030, 1060, 1090]
@@ -0,0 +1,106 @@
+import datetime
+from decimal import Decimal
+
+import commercial_catalog
+from commercial_catalog import CommercialCatalog
+from drift_controller import DriftController
+from plan_store import PlanStore
+from video import Video
+from video_queue import VideoQueue
+
+START = datetime.datetime(2026, 10, 19, 20, 0)
+
+
+class Player:
+    def __init__(self, position=None):
+        self.position = position
+
+    def position_in_seconds(self):
+        return self.position
+
+
+class Catalog:
+    def __init__(self):
+        self.requests = 0
+
+    def get_all_commercials_if_modified(self, etag=None, last_modified=None):
+        self.requests += 1
+        return [{'file_path': f'/media/commercials/spot-{index}.mp4', 'duration': '15', 'subject': None} for index in range(8)], None, None
+
+
+def commercial(seconds, block_end):
+    video = Video(f'/media/commercials/{seconds}.mp4', duration_in_seconds=Decimal(seconds), is_commercial=True)
+    video.block_end = block_end
+    return video
+
+
+def test_drift_follows_the_player_position():
+    block_end = START + datetime.timedelta(seconds=660)
+    act = Video.segment('/media/tv/show.mp4', 600, start_at_second=Decimal(0), end_at_second=Decimal(600))
+    act.block_end = block_end
+    now = START + datetime.timedelta(seconds=100)
+
+    on_time = DriftController(VideoQueue([commercial(30, block_end), commercial(30, block_end)]), Player(Decimal(100)))
+    assert on_time.measure(act, START, now) == 0
+    # The player is ten seconds behind the clock, so the block ends ten late.
+    assert DriftController(VideoQueue([commercial(30, block_end), commercial(30, block_end)]), Player(Decimal(90))).measure(act, START, now) == 10
+
+
+def test_repeated_video_is_measured_by_the_clock():
+    block_end = START + datetime.timedelta(seconds=90)
+    loop = Video.segment('/config/smpte-loop.mp4', 90, end_at_second=Decimal(10), label='Dead Air', repeat_count=8)
+    loop.block_end = block_end
+
+    # Five seconds into the sixth pass. VLC says 5, not 55.
+    controller = DriftController(VideoQueue(), Player(Decimal(5)))
+    assert controller.measure(loop, START, START + datetime.timedelta(seconds=55)) == 0
+
+
+def test_late_block_drops_commercials():
+    block_end = START + datetime.timedelta(seconds=90)
+    queue = VideoQueue([commercial(30, block_end), commercial(30, block_end), commercial(30, block_end)])
+    controller = DriftController(queue, Player())
+
+    controller.shorten_block(block_end, Decimal(30))
+
+    assert sum(video.duration_in_seconds() for video in queue) == 60
+
+
+def test_early_block_gets_commercials_without_asking_the_scheduler(monkeypatch):
+    scheduler = Catalog()
+    catalog = CommercialCatalog(scheduler_client=scheduler, ttl_in_seconds=0)
+    catalog.refresh()
+    monkeypatch.setattr(commercial_catalog, '_shared_commercial_catalog', catalog)
+    block_end = START + datetime.timedelta(seconds=90)
+    queue = VideoQueue([commercial(30, block_end), Video.segment('/media/tv/show.mp4', 60)])
+    queue[1].block_end = block_end
+
+    DriftController(queue, Player()).lengthen_block(block_end, Decimal(30))
+
+    assert sum(video.duration_in_seconds() for video in queue) == 120
+    # The extra spots go in the break, ahead of the show.
+    assert [video.is_commercial for video in queue] == [True, True, True, False]
+    # The catalog is stale, but that's for the background refresh to fix.
+    assert scheduler.requests == 1
+
+
+def test_added_commercials_stay_in_their_block_across_a_restart(monkeypatch, tmp_path):
+    catalog = CommercialCatalog(scheduler_client=Catalog())
+    catalog.refresh()
+    monkeypatch.setattr(commercial_catalog, '_shared_commercial_catalog', catalog)
+    block_end = START + datetime.timedelta(seconds=90)
+    scheduling_block = {'listing_id': 1, 'file_path': '/media/tv/show.mp4', 'block_start': START, 'block_end': block_end}
+    queue = VideoQueue([commercial(30, block_end), Video.segment('/media/tv/show.mp4', 60)])
+    for video in queue:
+        video.block_end = block_end
+        video.scheduling_block = scheduling_block
+    plan_store = PlanStore(tmp_path)
+    controller = DriftController(queue, Player(), on_queue_changed=lambda: plan_store.save('7', queue.airtimes(START), now=START))
+
+    controller.lengthen_block(block_end, Decimal(30))
+
+    # What a restart would bring back: the corrected plan, as one block.
+    restored = [video for video, _ in plan_store.load('7')]
+    assert len(restored) == 4
+    assert all(video.block_end == block_end for video in restored)
+    assert DriftController(VideoQueue(restored), Player()).block_videos(block_end) == restored
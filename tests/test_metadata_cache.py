@@ -0,0 +1,50 @@
+from metadata_cache import MetadataCache
+
+
+def test_get_or_probe_only_probes_once(tmp_path):
+    video_path = tmp_path / 'episode.mp4'
+    video_path.write_bytes(b'not really a video')
+    probes = []
+
+    def probe(file_path):
+        probes.append(file_path)
+        return {'chapters': [], 'streams': []}
+
+    cache = MetadataCache(tmp_path / 'metadata.sqlite3')
+    cache.get_or_probe(str(video_path), probe)
+    cache.get_or_probe(str(video_path), probe)
+
+    # A fresh cache on the same database simulates a restart.
+    MetadataCache(tmp_path / 'metadata.sqlite3').get_or_probe(str(video_path), probe)
+    assert probes == [str(video_path)]
+
+
+def test_changed_file_is_probed_again(tmp_path):
+    video_path = tmp_path / 'episode.mp4'
+    video_path.write_bytes(b'first version')
+    cache = MetadataCache(tmp_path / 'metadata.sqlite3')
+    cache.get_or_probe(str(video_path), lambda file_path: {'version': 1})
+
+    video_path.write_bytes(b'second, longer version')
+    assert cache.get_or_probe(str(video_path), lambda file_path: {'version': 2}) == {'version': 2}
+    assert len(cache) == 1
+
+
+def test_size_cap_evicts_least_recently_used(tmp_path):
+    cache = MetadataCache(tmp_path / 'metadata.sqlite3', max_entries=2)
+    for index in range(3):
+        cache.put(f'/media/tv/{index}.mp4', 1, 1, {'index': index})
+    assert len(cache) == 2
+    assert MetadataCache(tmp_path / 'metadata.sqlite3').get('/media/tv/2.mp4', 1, 1) == {'index': 2}
+
+
+def test_memo_is_bounded_and_falls_back_to_the_database(tmp_path):
+    cache = MetadataCache(tmp_path / 'metadata.sqlite3', memo_entries=2)
+    for index in range(3):
+        cache.put(f'/media/tv/{index}.mp4', 1, 1, {'index': index})
+    assert list(cache._memo) == ['/media/tv/1.mp4', '/media/tv/2.mp4']
+    assert cache.get('/media/tv/0.mp4', 1, 1) == {'index': 0}
+    # A newer version of the file replaces the row instead of adding one.
+    cache.put('/media/tv/0.mp4', 2, 2, {'index': 'new'})
+    assert cache.get('/media/tv/0.mp4', 1, 1) is None
+    assert len(cache) == 3
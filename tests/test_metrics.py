@@ -0,0 +1,33 @@
+import urllib.request
+
+from metrics import Registry, start_metrics_server
+
+
+def test_render_in_prometheus_text_format():
+    registry = Registry()
+    registry.counter('lookups_total', 'Lookups.').inc(result='hit')
+    registry.gauge('queue_length', 'Queue length.').set(3)
+    histogram = registry.histogram('probe_seconds', 'Probes.', buckets=(0.1, 1))
+    histogram.observe(0.5)
+    histogram.observe(2)
+
+    rendered = registry.render()
+    assert '# TYPE technical_director_lookups_total counter' in rendered
+    assert 'technical_director_lookups_total{result="hit"} 1.0' in rendered
+    assert 'technical_director_queue_length 3.0' in rendered
+    assert 'technical_director_probe_seconds_bucket{le="0.1"} 0.0' in rendered
+    assert 'technical_director_probe_seconds_bucket{le="1.0"} 1.0' in rendered
+    assert 'technical_director_probe_seconds_bucket{le="+Inf"} 2.0' in rendered
+    assert 'technical_director_probe_seconds_count 2.0' in rendered
+
+
+def test_metrics_endpoint_serves_the_registry():
+    registry = Registry()
+    registry.counter('requests_total', 'Requests.').inc()
+    server = start_metrics_server(port=0, registry=registry)
+    try:
+        url = f'http://127.0.0.1:{server.server_address[1]}/metrics'
+        with urllib.request.urlopen(url) as response:
+            assert 'technical_director_requests_total 1.0' in response.read().decode('UTF-8')
+    finally:
+        server.shutdown()
@@ -0,0 +1,64 @@
+import datetime
+import sys
+
+import commercial_catalog
+import commercial_rotation
+import technical_director.technical_director
+from commercial_catalog import get_commercial_catalog
+from commercial_rotation import CommercialRotation
+from metrics import FEED_QUEUE_DURATION_SECONDS
+
+from tests.fakes import Player, StubSchedulerClient, episodes, listing
+
+
+def multi_channel_runtime_class(monkeypatch):
+    # multi_channel.py imports the director as `technical_director`, which is
+    # the module when it runs from inside technical_director/, but the
+    # package here.
+    monkeypatch.setitem(sys.modules, 'technical_director', technical_director.technical_director)
+    from multi_channel import MultiChannelRuntime
+    return MultiChannelRuntime
+
+
+def test_channels_share_everything_but_the_player_and_queue(tmp_path, monkeypatch, probes):
+    # Everything the runtime keeps on disk goes under tmp_path.
+    monkeypatch.setenv('HOME', str(tmp_path))
+    monkeypatch.setenv('SNAPSHOT_DAYS', '0')
+    monkeypatch.setenv('SAVE_PLANS', '0')
+    monkeypatch.setenv('AS_RUN_MAX_MB', '0')
+    monkeypatch.setenv('READ_AHEAD_BUDGET_GB', '1')
+    monkeypatch.setenv('RENDITION_BUDGET_GB', '1')
+    monkeypatch.setattr(commercial_catalog, '_shared_commercial_catalog', None)
+    monkeypatch.setattr(commercial_rotation, '_shared_commercial_rotation', CommercialRotation(persist=False))
+    now = datetime.datetime.now()
+    start = now.replace(minute=now.minute // 30 * 30, second=0, microsecond=0)
+    lineup = [listing(index, file_path, start + datetime.timedelta(minutes=30 * index)) for index, file_path in enumerate(episodes(tmp_path, 8))]
+    scheduler_client = StubSchedulerClient(lineup)
+    players = {'41': Player(), '42': Player()}
+
+    runtime = multi_channel_runtime_class(monkeypatch)(['41', '42'], scheduler_client=scheduler_client, vlc_controllers=players)
+    try:
+        first, second = runtime.directors
+        # A player and a queue each...
+        assert [first.vlc_controller, second.vlc_controller] == [players['41'], players['42']]
+        assert first.video_queue is not second.video_queue
+        # ...and one of everything else.
+        assert first.scheduler_client is second.scheduler_client is scheduler_client
+        assert get_commercial_catalog().scheduler_client is scheduler_client
+        assert first.read_ahead_cache is second.read_ahead_cache is runtime.read_ahead_cache is not None
+        assert first.transcode_cache is second.transcode_cache is runtime.transcode_cache is not None
+        assert first.planner.probe_executor is second.planner.probe_executor
+        # Both channels planned the same show, and it was only probed once.
+        probed = [file_path for file_path, _ in probes]
+        assert probed and sorted(probed) == sorted(set(probed))
+
+        # Each channel reports under its own label.
+        assert FEED_QUEUE_DURATION_SECONDS.count(channel='41') == 1
+        assert FEED_QUEUE_DURATION_SECONDS.count(channel='42') == 1
+        first.feed_queue(first.planned_until)
+        assert FEED_QUEUE_DURATION_SECONDS.count(channel='41') == 2
+        assert FEED_QUEUE_DURATION_SECONDS.count(channel='42') == 1
+    finally:
+        get_commercial_catalog().stop_background_refresh()
+        runtime.planning_executor.shutdown()
+        runtime.probe_executor.shutdown()
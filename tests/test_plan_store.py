@@ -0,0 +1,55 @@
+import datetime
+from decimal import Decimal
+
+from plan_store import PlanStore, resume_at
+from video import Video
+
+START = datetime.datetime(2026, 10, 19, 20, 0)
+BLOCK = {
+    'label': 'Show', 'listing_id': 42, 'file_path': '/media/tv/show.mp4', 'show_commercials': True,
+    'block_start': START, 'block_end': START + datetime.timedelta(minutes=30), 'block_duration_in_minutes': 30,
+}
+
+
+def planned_block():
+    first_act = Video.segment('/media/tv/show.mp4', Decimal('600'), start_at_second=Decimal(0), end_at_second=Decimal('600'), label='42')
+    commercial = Video.segment('/media/commercials/cola.mp4', Decimal('30'), is_commercial=True, batch_label='42-break#0')
+    bars = Video.segment('/config/smpte-loop.mp4', Decimal('30'), end_at_second=Decimal(10), label='Dead Air', repeat_count=2)
+    videos = [first_act, commercial, bars]
+    for video in videos:
+        video.scheduling_block = BLOCK
+        video.block_end = BLOCK['block_end']
+    airtimes = [START, START + datetime.timedelta(seconds=600), START + datetime.timedelta(seconds=630)]
+    return list(zip(videos, airtimes))
+
+
+def test_plan_round_trips_without_probing(tmp_path):
+    store = PlanStore(tmp_path)
+    store.save('7', planned_block(), now=START)
+
+    loaded = store.load('7')
+    assert [(video.file_path, video.duration_in_seconds(), video.is_commercial, video.batch_label) for video, _ in loaded] == [
+        ('/media/tv/show.mp4', Decimal('600'), False, '42'),
+        ('/media/commercials/cola.mp4', Decimal('30'), True, '42-break#0'),
+        ('/config/smpte-loop.mp4', Decimal('30'), False, 'Dead Air'),
+    ]
+    assert loaded[1][1] == START + datetime.timedelta(seconds=600)
+    assert loaded[0][0].scheduling_block is loaded[2][0].scheduling_block
+    assert loaded[0][0].block_end == BLOCK['block_end']
+
+
+def test_resume_picks_up_partway_through_a_segment():
+    videos = resume_at(planned_block(), START + datetime.timedelta(seconds=612))
+    assert [(video.file_path, video.start_at_second, video.duration_in_seconds()) for video in videos] == [
+        ('/media/commercials/cola.mp4', Decimal(12), Decimal(18)),
+        ('/config/smpte-loop.mp4', None, Decimal(30)),
+    ]
+
+    # Partway through the second pass of the bars: the rest of that pass,
+    # then the last one.
+    videos = resume_at(planned_block(), START + datetime.timedelta(seconds=644))
+    assert [(video.start_at_second, video.end_at_second, video.repeat_count, video.duration_in_seconds()) for video in videos] == [
+        (Decimal(4), Decimal(10), 0, Decimal(6)),
+        (None, Decimal(10), 0, Decimal(10)),
+    ]
+    assert resume_at(planned_block(), START + datetime.timedelta(minutes=11)) == []
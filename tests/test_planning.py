@@ -0,0 +1,116 @@
+import datetime
+
+import video
+import video_utils
+from commercial_rotation import CommercialRotation
+from plan_store import PlanStore
+from scheduler_client import ChannelSchedule
+from technical_director.technical_director import TechnicalDirector
+
+from tests.fakes import COMMERCIALS, START, StubSchedulerClient, episodes, listing
+
+def test_planning_probes_each_feature_once_on_the_probe_workers(tmp_path, probes, make_director):
+    lineup = [listing(index, file_path, START + datetime.timedelta(minutes=30 * index))
+              for index, file_path in enumerate(episodes(tmp_path, 8))]
+
+    director = make_director(StubSchedulerClient(lineup))
+    # The rest of the horizon, the way the main loop asks for it.
+    director.feed_queue_if_needed()
+
+    planned = list(director.video_queue)
+    assert any(video.is_commercial for video in planned)
+    probed = [file_path for file_path, _ in probes]
+    # Only the features, each once, and none of them on the planning thread.
+    assert sorted(probed) == sorted(set(probed))
+    assert set(probed) == {video.file_path for video in planned if not video.is_commercial}
+    assert all(thread.startswith('probe') for _, thread in probes)
+
+
+def block_starts(videos):
+    return sorted({video.scheduling_block['block_start'] for video in videos})
+
+
+def test_planning_fills_the_horizon_block_by_block(tmp_path, probes, make_director):
+    lineup = [listing(index, file_path, START + datetime.timedelta(minutes=30 * index))
+              for index, file_path in enumerate(episodes(tmp_path, 10))]
+
+    director = make_director(StubSchedulerClient(lineup))
+    director.feed_queue_if_needed()
+
+    assert director.planned_until == START + datetime.timedelta(hours=3)
+    assert block_starts(director.video_queue) == [START + datetime.timedelta(minutes=30 * index) for index in range(6)]
+
+
+
+def test_a_feature_that_cannot_be_probed_only_costs_its_own_block(tmp_path, monkeypatch, probes, make_director):
+    file_paths = episodes(tmp_path, 6)
+    lineup = [listing(index, file_path, START + datetime.timedelta(minutes=30 * index)) for index, file_path in enumerate(file_paths)]
+    probe = video_utils.probe_video_information
+
+    def probe_or_fail(file_path):
+        if file_path == file_paths[3]:
+            raise RuntimeError('ffprobe failed')
+        return probe(file_path)
+
+    monkeypatch.setattr(video_utils, 'probe_video_information', probe_or_fail)
+    monkeypatch.setattr(video, 'get_default_video_filepath', lambda channel_number=None: '/config/smpte-loop.mp4')
+    director = make_director(StubSchedulerClient(lineup))
+    director.feed_queue_if_needed()
+
+    # 19:30 gets the default video, everything around it is planned as usual.
+    assert director.planned_until == START + datetime.timedelta(hours=3)
+    assert block_starts(director.video_queue) == [START + datetime.timedelta(minutes=30 * index) for index in range(6)]
+    features = {video.file_path for video in director.video_queue if video.file_path in file_paths}
+    assert features == set(file_paths) - {file_paths[3]}
+
+
+def test_changed_listing_is_replanned_from_its_start(tmp_path, probes, make_director):
+    file_paths = episodes(tmp_path, 11)
+    lineup = [listing(index, file_path, START + datetime.timedelta(minutes=30 * index)) for index, file_path in enumerate(file_paths[:10])]
+    scheduler_client = StubSchedulerClient(lineup)
+    director = make_director(scheduler_client)
+    director.feed_queue_if_needed()
+
+    # The Scheduler swaps the 19:30 show for another one.
+    changed_at = START + datetime.timedelta(minutes=90)
+    lineup[3] = listing(99, file_paths[10], changed_at)
+    scheduler_client.schedule = ChannelSchedule(lineup)
+    director.revise_plan_if_lineup_changed()
+
+    assert director.planned_until == changed_at
+    assert block_starts(director.video_queue)[-1] < changed_at
+    saved = PlanStore(tmp_path / 'plans').load('7')
+    assert all(video.scheduling_block['block_start'] < changed_at for video, _ in saved)
+
+    # What the main loop asks for once the queue runs low again.
+    director.planner.request(director.planned_until)
+    replanned = [video for video in director.video_queue if video.scheduling_block['block_start'] == changed_at]
+    assert {video.file_path for video in replanned if not video.is_commercial} == {file_paths[10]}
+    assert director.planned_until == START + datetime.timedelta(hours=3)
+
+
+def test_joining_mid_block_only_records_the_spots_still_to_air(tmp_path, monkeypatch, probes, make_director):
+    # The seed normally includes the file path, which is different every run.
+    # With this one the break runs from 10:00 to 18:00, so joining at 14:00
+    # skips half of it.
+    monkeypatch.setattr(TechnicalDirector, 'plan_seed', staticmethod(lambda scheduling_block: 'joined'))
+    lineup = [listing(0, episodes(tmp_path, 1)[0], START)]
+
+    director = make_director(StubSchedulerClient(lineup), now=START + datetime.timedelta(minutes=14))
+
+    queued = {video.file_path for video in director.video_queue if video.is_commercial}
+    recorded = {commercial['file_path'] for commercial in COMMERCIALS if director.commercial_rotation.last_aired(commercial['file_path'])}
+    assert queued
+    assert recorded == queued
+
+
+def test_every_spot_in_a_plan_is_saved_with_it(tmp_path, probes, make_director):
+    lineup = [listing(index, file_path, START + datetime.timedelta(minutes=30 * index))
+              for index, file_path in enumerate(episodes(tmp_path, 6))]
+    director = make_director(StubSchedulerClient(lineup), commercial_rotation=CommercialRotation(tmp_path / 'rotation.json'))
+    director.feed_queue_if_needed()
+
+    restarted = CommercialRotation(tmp_path / 'rotation.json')
+    queued = {video.file_path for video in director.video_queue if video.is_commercial}
+    assert queued
+    assert all(restarted.last_aired(file_path) is not None for file_path in queued)
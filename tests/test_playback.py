@@ -0,0 +1,100 @@
+import threading
+from decimal import Decimal
+
+from video import Video
+
+from tests.fakes import START, StubSchedulerClient, episodes, listing
+
+
+def fire_on_vlc_thread(event):
+    # libvlc calls back on a thread of its own.
+    vlc_thread = threading.Thread(target=event, name='vlc-events')
+    vlc_thread.start()
+    vlc_thread.join()
+
+
+def calls_from_vlc_thread(player):
+    return [method for method, thread in player.calls if thread == 'vlc-events']
+
+
+def test_end_of_media_wakes_the_loop_and_it_moves_on(tmp_path, probes, make_director):
+    director = make_director(StubSchedulerClient([listing(0, episodes(tmp_path, 1)[0], START)]))
+    player = director.vlc_controller
+    # What main() does before it hits play.
+    player.on_end_reached(director.react_to_vlc_media_player_end_reached_event)
+    director.play_next_video()
+    up_next = director.video_queue.peek()
+    director.wake_event.clear()
+
+    fire_on_vlc_thread(player.finish_current_media)
+
+    # The event only leaves a note and wakes the loop...
+    assert director.wake_event.is_set()
+    assert calls_from_vlc_thread(player) == []
+    # ...which is what puts the next video on.
+    director.run_loop_iteration()
+    assert director.current_video is up_next
+    assert player.played[-1].file_path == up_next.file_path
+
+
+def test_error_event_wakes_the_loop_and_it_reloads_the_video(tmp_path, probes, make_director):
+    director = make_director(StubSchedulerClient([listing(0, episodes(tmp_path, 1)[0], START)]))
+    player = director.vlc_controller
+    director.play_next_video()
+    failed_video = director.current_video
+    director.clock.advance(10)
+    director.wake_event.clear()
+
+    fire_on_vlc_thread(player.fail)
+    assert calls_from_vlc_thread(player) == []
+    # The watchdog's next look at the player is what reports it.
+    director.watchdog.sample()
+    assert director.wake_event.is_set()
+
+    director.run_loop_iteration()
+    # Back on, from where it should be by now.
+    assert director.current_video.file_path == failed_video.file_path
+    assert director.current_video.start_at_second == (failed_video.start_at_second or 0) + 10
+    assert player.played[-1].key[1] == director.current_video.start_at_second
+
+
+def test_next_video_is_prepared_while_the_current_one_plays(tmp_path, probes, make_director):
+    director = make_director(StubSchedulerClient([listing(0, episodes(tmp_path, 1)[0], START)]))
+    player = director.vlc_controller
+
+    director.play_next_video()
+
+    up_next = director.video_queue.peek()
+    assert player.prepared_media.key == (up_next.file_path, up_next.start_at_second, up_next.end_at_second, up_next.repeat_count)
+
+
+def test_next_video_goes_on_from_the_prepared_media(tmp_path, probes, make_director):
+    director = make_director(StubSchedulerClient([listing(0, episodes(tmp_path, 1)[0], START)]))
+    player = director.vlc_controller
+    director.play_next_video()
+    prepared = player.prepared_media
+    built_before = [method for method, _ in player.calls].count('media_for')
+
+    director.should_move_to_next_video = True
+    director.run_loop_iteration()
+
+    assert player.played[-1] is prepared
+    assert [method for method, _ in player.calls].count('media_for') == built_before
+
+
+def test_next_video_is_loaded_normally_if_the_queue_changed_since_it_was_prepared(tmp_path, probes, make_director):
+    file_paths = episodes(tmp_path, 2)
+    director = make_director(StubSchedulerClient([listing(0, file_paths[0], START)]))
+    player = director.vlc_controller
+    director.play_next_video()
+    prepared = player.prepared_media
+    # Something else took its place after it was prepared.
+    replacement = Video.segment(file_paths[1], 60, start_at_second=Decimal(120))
+    director.video_queue.replace(0, 1, [replacement])
+
+    director.should_move_to_next_video = True
+    director.run_loop_iteration()
+
+    assert director.current_video is replacement
+    assert player.played[-1] is not prepared
+    assert player.played[-1].key == (file_paths[1], Decimal(120), None, 0)
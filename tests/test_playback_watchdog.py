@@ -0,0 +1,46 @@
+import datetime
+from decimal import Decimal
+
+from clock import VirtualClock
+from playback_watchdog import FROZEN_AFTER_IN_SECONDS, PlaybackWatchdog
+
+START = datetime.datetime(2026, 10, 19, 20, 0)
+
+
+class Player:
+    def __init__(self):
+        self.player_state = 'playing'
+        self.position = Decimal(0)
+
+    def state(self):
+        return self.player_state
+
+    def position_in_seconds(self):
+        return self.position
+
+
+def test_frozen_position_is_reported_once_from_when_it_stopped_moving():
+    clock = VirtualClock(START)
+    player = Player()
+    stalls = []
+    watchdog = PlaybackWatchdog(player, clock, on_stall=lambda reason, since: stalls.append((reason, since)))
+
+    for second in range(5):
+        clock.advance(1)
+        player.position = Decimal(second)
+        watchdog.sample()
+    frozen_at = clock.now()
+    for _ in range(FROZEN_AFTER_IN_SECONDS + 3):
+        clock.advance(1)
+        watchdog.sample()
+
+    assert stalls == [('frozen', frozen_at)]
+
+    # Something new on the air, and that one ends up stopped.
+    watchdog.watch()
+    player.player_state = 'stopped'
+    for _ in range(5):
+        clock.advance(1)
+        watchdog.sample()
+
+    assert [reason for reason, _ in stalls] == ['frozen', 'stopped']
@@ -0,0 +1,47 @@
+from read_ahead_cache import ReadAheadCache
+
+
+def nas_file(tmp_path, name, size):
+    path = tmp_path / 'nas' / name
+    path.parent.mkdir(exist_ok=True)
+    path.write_bytes(b'x' * size)
+    return str(path)
+
+
+def staged(cache, file_paths):
+    cache.stage_upcoming(file_paths)
+    cache.join()
+    return [cache.local_path_for(file_path) is not None for file_path in file_paths]
+
+
+def test_budget_holds_when_upcoming_files_dont_fit(tmp_path):
+    cache = ReadAheadCache(tmp_path / 'local', budget_in_bytes=100)
+    first, second = nas_file(tmp_path, 'first.mp4', 60), nas_file(tmp_path, 'second.mp4', 60)
+
+    # Both are coming up, so neither may be evicted for the other.
+    assert staged(cache, [first, second]) == [True, False]
+    assert sum(path.stat().st_size for path in (tmp_path / 'local').iterdir()) <= 100
+
+
+def test_least_recently_used_copy_is_evicted_first(tmp_path):
+    cache = ReadAheadCache(tmp_path / 'local', budget_in_bytes=100)
+    first, second, third = (nas_file(tmp_path, f'{name}.mp4', 40) for name in ('first', 'second', 'third'))
+    staged(cache, [first, second])
+    cache.local_path_for(first)
+
+    assert staged(cache, [third]) == [True]
+    assert cache.local_path_for(first) is not None
+    assert cache.local_path_for(second) is None
+
+
+def test_copies_from_an_earlier_run_are_used_again(tmp_path, monkeypatch):
+    file_path = nas_file(tmp_path, 'episode.mp4', 40)
+    staged(ReadAheadCache(tmp_path / 'local', budget_in_bytes=100), [file_path])
+
+    restarted = ReadAheadCache(tmp_path / 'local', budget_in_bytes=100)
+    copies = []
+    monkeypatch.setattr('shutil.copyfileobj', lambda *args: copies.append(args))
+    # Nothing is looked up on the NAS until the file is asked for.
+    assert restarted.local_path_for(file_path) is None
+    assert staged(restarted, [file_path]) == [True]
+    assert copies == []
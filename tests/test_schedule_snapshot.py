@@ -0,0 +1,23 @@
+import datetime
+
+from schedule_snapshot import ScheduleSnapshot
+
+
+def test_lineup_round_trip_keeps_only_the_window(tmp_path):
+    now = datetime.datetime(2026, 10, 19, 6, 0)
+    listings = []
+    for index, offset_in_days in enumerate([-1, 0, 2, 5]):
+        start_time = now + datetime.timedelta(days=offset_in_days)
+        listings.append((start_time, start_time + datetime.timedelta(minutes=30), {'listing_id': index}))
+
+    snapshot = ScheduleSnapshot(tmp_path, days=3)
+    snapshot.save_lineup('7', listings, now=now)
+
+    lineup = ScheduleSnapshot(tmp_path).load_lineup('7')
+    assert [listing['listing_id'] for listing in lineup] == [1, 2]
+
+
+def test_unreadable_snapshot_is_ignored(tmp_path):
+    (tmp_path / 'ch7-lineup.json').write_text('{"lineup": [')
+    assert ScheduleSnapshot(tmp_path).load_lineup('7') is None
+    assert ScheduleSnapshot(tmp_path).load_commercials() is None
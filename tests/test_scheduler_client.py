@@ -0,0 +1,72 @@
+import datetime
+
+from schedule_snapshot import ScheduleSnapshot
+from scheduler_client import ChannelSchedule, SchedulerClient
+
+
+def listing(listing_id, start, minutes):
+    end = start + datetime.timedelta(minutes=minutes)
+    return {'listing_id': listing_id, 'title': f'Show {listing_id}', 'file_path': f'/media/tv/{listing_id}.mp4',
+            'start_time': start.isoformat(), 'end_time': end.isoformat()}
+
+
+def test_block_at_finds_long_blocks_and_gaps():
+    six = datetime.datetime(2026, 10, 19, 6, 0)
+    # A 90 minute movie, then nothing for half an hour, then a sitcom.
+    schedule = ChannelSchedule([listing(1, six, 90), listing(2, six + datetime.timedelta(hours=2), 30)])
+
+    assert schedule.block_at(six + datetime.timedelta(minutes=75))['listing_id'] == 1
+    assert schedule.block_at(six + datetime.timedelta(minutes=100)) is None
+    assert schedule.block_at(six - datetime.timedelta(minutes=1)) is None
+
+    blocks = schedule.blocks_between(six + datetime.timedelta(minutes=45), six + datetime.timedelta(hours=3))
+    assert [block['listing_id'] for block in blocks] == [1, 2]
+    assert blocks[0]['block_end'] == six + datetime.timedelta(minutes=90)
+
+
+class Response:
+    def __init__(self, status_code, payload=None, headers=None):
+        self.status_code = status_code
+        self.payload = payload
+        self.headers = headers or {}
+
+    def json(self):
+        return self.payload
+
+    def raise_for_status(self):
+        pass
+
+
+class Scheduler:
+    # Answers the way the real one does: 304 when the ETag still matches.
+    def __init__(self, lineup):
+        self.lineup = lineup
+        self.requests = []
+
+    def get(self, url, headers=None, timeout=None):
+        self.requests.append(headers or {})
+        if (headers or {}).get('If-None-Match') == '"v1"':
+            return Response(304, headers={'ETag': '"v1"'})
+        return Response(200, {'lineup': self.lineup}, headers={'ETag': '"v1"'})
+
+
+def test_restart_from_snapshot_still_gets_the_whole_lineup(tmp_path, monkeypatch):
+    monkeypatch.setenv('SCHEDULER_URL', 'http://scheduler.test')
+    now = datetime.datetime.now().replace(microsecond=0)
+    far_out = now + datetime.timedelta(days=5)
+    scheduler = Scheduler([listing(1, now, 30), listing(2, far_out, 30)])
+
+    SchedulerClient(session=scheduler, snapshot=ScheduleSnapshot(tmp_path, days=3)).refresh_channel_schedule('7')
+
+    # After a restart the snapshot only reaches three days out. The lineup
+    # behind it hasn't changed, but we have to ask for all of it anyway.
+    client = SchedulerClient(session=scheduler, snapshot=ScheduleSnapshot(tmp_path, days=3))
+    assert client.channel_schedule('7').block_starting_at(far_out) is None
+    client.refresh_channel_schedule('7')
+
+    assert 'If-None-Match' not in scheduler.requests[-1]
+    assert client.whats_on('7', far_out)['listing_id'] == 2
+    # Once we have all of it, asking again is a 304 and changes nothing.
+    client.refresh_channel_schedule('7')
+    assert scheduler.requests[-1]['If-None-Match'] == '"v1"'
+    assert client.whats_on('7', far_out)['listing_id'] == 2
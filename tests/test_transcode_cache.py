@@ -0,0 +1,52 @@
+import os
+
+from transcode_cache import TranscodeCache
+
+
+def make_rendition(cache, source, fingerprint, size=10):
+    cache.rendition_path(fingerprint).write_bytes(b'x' * size)
+    cache.record(str(source), fingerprint)
+
+
+def test_rendition_is_found_through_the_index(tmp_path):
+    source = tmp_path / 'episode.mkv'
+    source.write_bytes(b'an hevc episode')
+    make_rendition(TranscodeCache(tmp_path / 'renditions'), source, 'abc')
+
+    # A separate cache on the same directory is what the director sees.
+    director_cache = TranscodeCache(tmp_path / 'renditions')
+    assert director_cache.rendition_path_for(str(source)) == str(tmp_path / 'renditions' / 'abc.mp4')
+    assert director_cache.rendition_path_for(str(tmp_path / 'other.mkv')) is None
+
+
+def test_least_recently_played_renditions_are_evicted(tmp_path):
+    cache = TranscodeCache(tmp_path / 'renditions', budget_in_bytes=25)
+    for index, fingerprint in enumerate(['old', 'kept', 'new']):
+        source = tmp_path / f'{fingerprint}.mkv'
+        source.write_bytes(fingerprint.encode())
+        make_rendition(cache, source, fingerprint)
+        os.utime(cache.rendition_path(fingerprint), (index, index))
+
+    cache.evict(keep={'new'})
+    assert sorted(path.stem for path in (tmp_path / 'renditions').glob('*.mp4')) == ['kept', 'new']
+    assert cache.rendition_path_for(str(tmp_path / 'old.mkv')) is None
+
+
+def test_only_airing_a_rendition_counts_as_playing_it(tmp_path):
+    source = tmp_path / 'episode.mkv'
+    source.write_bytes(b'an hevc episode')
+    make_rendition(TranscodeCache(tmp_path / 'renditions'), source, 'abc')
+    rendition = TranscodeCache(tmp_path / 'renditions').rendition_path('abc')
+    os.utime(rendition, (1, 1))
+
+    director_cache = TranscodeCache(tmp_path / 'renditions')
+    assert director_cache.rendition_path_for(str(source)) == str(rendition)
+    # Looked up again and again, without going back to the source or
+    # touching the rendition.
+    source.unlink()
+    for _ in range(3):
+        assert director_cache.rendition_path_for(str(source)) == str(rendition)
+    assert rendition.stat().st_mtime == 1
+
+    director_cache.mark_played(str(source))
+    assert rendition.stat().st_mtime > 1
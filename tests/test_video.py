@@ -0,0 +1,14 @@
+from decimal import Decimal
+
+import video
+from video import Video
+
+
+def test_dead_air_fills_the_time_exactly_with_the_loop(monkeypatch):
+    monkeypatch.setattr(video, 'get_default_video_filepath', lambda channel_number=None: f'/config/smpte-loop-Ch-{channel_number}.mp4')
+
+    videos = Video.dead_air(Decimal('95.5'), channel_number=7)
+
+    assert [(v.end_at_second, v.repeat_count) for v in videos] == [(Decimal(10), 8), (Decimal('5.5'), 0)]
+    assert sum(v.duration_in_seconds() for v in videos) == Decimal('95.5')
+    assert all(v.file_path == '/config/smpte-loop-Ch-7.mp4' and v.label == 'Dead Air' for v in videos)
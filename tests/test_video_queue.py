@@ -0,0 +1,55 @@
+import datetime
+from decimal import Decimal
+
+from video_queue import VideoQueue
+
+
+class FakeVideo:
+    def __init__(self, name, duration_in_seconds):
+        self.name = name
+        self._duration_in_seconds = Decimal(duration_in_seconds)
+
+    def duration_in_seconds(self):
+        return self._duration_in_seconds
+
+
+def test_running_total_follows_appends_and_pops():
+    queue = VideoQueue([FakeVideo('a', '30'), FakeVideo('b', '15.5'), FakeVideo('c', 60)])
+    assert queue.duration_in_seconds() == Decimal('105.5')
+    assert queue.popleft().name == 'a'
+    assert queue.duration_in_seconds() == Decimal('75.5')
+    queue.append(FakeVideo('d', 10))
+    assert queue.duration_in_seconds() == Decimal('85.5')
+    assert [video.name for video in queue] == ['b', 'c', 'd']
+
+
+def test_index_at_finds_what_airs_at_an_offset():
+    queue = VideoQueue([FakeVideo('a', 30), FakeVideo('b', 15), FakeVideo('c', 60)])
+    queue.popleft()
+    assert queue.index_at(0) == 0
+    assert queue.index_at(Decimal('14.9')) == 0
+    assert queue.index_at(15) == 1
+    assert queue.index_at(75) is None
+    assert queue.offset_of(1) == Decimal(15)
+
+
+def test_compaction_keeps_answers_stable():
+    queue = VideoQueue(FakeVideo(str(index), 1) for index in range(500))
+    for _ in range(400):
+        queue.popleft()
+    assert len(queue) == 100
+    assert queue[0].name == '400'
+    assert queue.index_at(Decimal('50.5')) == 50
+    assert queue.duration_in_seconds() == 100
+
+
+def test_truncate_and_airtimes():
+    queue = VideoQueue([FakeVideo('a', 30), FakeVideo('b', 15), FakeVideo('c', 60)])
+    removed = queue.truncate(1)
+    assert [video.name for video in removed] == ['b', 'c']
+    queue.append(FakeVideo('e', 5))
+    start = datetime.datetime(2026, 1, 1, 20, 0)
+    assert [(video.name, airtime) for video, airtime in queue.airtimes(start)] == [
+        ('a', start),
+        ('e', start + datetime.timedelta(seconds=30)),
+    ]
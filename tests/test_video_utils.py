@@ -0,0 +1,31 @@
+from decimal import Decimal
+
+from video_utils import chapters_from_break_points, parse_break_points
+
+FFMPEG_OUTPUT = """
+[blackdetect @ 0x1] black_start:0 black_end:1.2 black_duration:1.2
+[silencedetect @ 0x2] silence_start: 0.1
+[silencedetect @ 0x2] silence_end: 1.1 | silence_duration: 1.0
+[blackdetect @ 0x1] black_start:401.5 black_end:402.5 black_duration:1
+[silencedetect @ 0x2] silence_start: 401.8
+[silencedetect @ 0x2] silence_end: 402.9 | silence_duration: 1.1
+[blackdetect @ 0x1] black_start:700 black_end:700.5 black_duration:0.5
+[blackdetect @ 0x1] black_start:900 black_end:901 black_duration:1
+[silencedetect @ 0x2] silence_start: 900.2
+[silencedetect @ 0x2] silence_end: 900.8 | silence_duration: 0.6
+"""
+
+
+def test_breaks_need_black_and_silence_together():
+    # 700 is black but not quiet, so it isn't a break.
+    assert parse_break_points(FFMPEG_OUTPUT) == [Decimal('0.6'), Decimal('402.0'), Decimal('900.5')]
+
+
+def test_break_points_become_chapters_away_from_the_ends():
+    chapters = chapters_from_break_points([Decimal('0.6'), Decimal('402.0'), Decimal('900.5')], Decimal(1320))
+    assert [(chapter['start_time'], chapter['end_time']) for chapter in chapters] == [
+        ('0.000000', '402.000000'),
+        ('402.000000', '900.500000'),
+        ('900.500000', '1320.000000'),
+    ]
+    assert chapters_from_break_points([Decimal(60)], Decimal(1320)) == []